@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from .cache import get_client
+from .database import engine
+from .schemas import GameSessionCreate
+from .windows import GLOBAL_KEY, submit_boards
+from .scoreboard import scoreboard
+from .hot_cache import INVALIDATION_CHANNEL, TOP_K
+from .metrics import SIZE_BUCKETS, counter, histogram
+from .stats import queue_stats
+
+logger = logging.getLogger(__name__)
+
+# Flush when this many submissions are queued...
+SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", "500"))
+# ...or when the oldest queued submission has waited this long.
+SUBMIT_BATCH_WINDOW_MS = float(os.getenv("SUBMIT_BATCH_WINDOW_MS", "5"))
+# Bound on queued submissions; producers wait once it is full (backpressure).
+SUBMIT_QUEUE_SIZE = int(os.getenv("SUBMIT_QUEUE_SIZE", "10000"))
+
+# The whole batch as one statement with a fixed text, so asyncpg prepares it
+# once per connection whatever the batch size. submission_ids are claimed in
+# game_session_submissions first (game_sessions is partitioned, so it cannot
+# hold the unique constraint); sessions whose id was already claimed are
+# skipped, and only the inserted scores are added to leaderboard, locking
+# leaderboard rows in user_id order so concurrent writers cannot deadlock.
+# Returns a row per inserted submission_id, then one per updated leaderboard
+# row with its total before (NULL for a new row) and after the batch.
+SUBMIT_BATCH_SQL = text("""
+    WITH batch AS (
+        SELECT * FROM unnest(
+            CAST(:sids AS varchar[]), CAST(:uids AS int[]), CAST(:scores AS int[]), CAST(:modes AS varchar[])
+        ) AS b(submission_id, user_id, score, game_mode)
+    ),
+    claimed AS (
+        INSERT INTO game_session_submissions (submission_id, created_at)
+        SELECT submission_id, CAST(:ts AS timestamp) FROM batch WHERE submission_id IS NOT NULL
+        ON CONFLICT (submission_id) DO NOTHING
+        RETURNING submission_id
+    ),
+    inserted AS (
+        INSERT INTO game_sessions (submission_id, user_id, score, game_mode, timestamp)
+        SELECT submission_id, user_id, score, game_mode, CAST(:ts AS timestamp) FROM batch
+        WHERE submission_id IS NULL OR submission_id IN (SELECT submission_id FROM claimed)
+        RETURNING submission_id, user_id, score
+    ),
+    totals AS (
+        SELECT user_id, SUM(score) AS delta FROM inserted GROUP BY user_id
+    ),
+    upserted AS (
+        INSERT INTO leaderboard (user_id, total_score, rank)
+        SELECT user_id, delta, 0 FROM totals ORDER BY user_id
+        ON CONFLICT (user_id)
+        DO UPDATE SET total_score = leaderboard.total_score + EXCLUDED.total_score
+        RETURNING user_id, total_score, xmax = 0 AS created
+    )
+    SELECT submission_id, CAST(NULL AS int) AS old_total, CAST(NULL AS int) AS new_total
+    FROM inserted WHERE submission_id IS NOT NULL
+    UNION ALL
+    SELECT NULL, CASE WHEN u.created THEN NULL ELSE u.total_score - t.delta END, u.total_score
+    FROM upserted u JOIN totals t USING (user_id)
+""")
+
+FLUSH_SECONDS = histogram("submit_batch_flush_seconds", "Micro-batch flush time by stage", ("stage",))
+BATCH_SIZE = histogram("submit_batch_size", "Submissions per micro-batch", buckets=SIZE_BUCKETS)
+REDIS_ERRORS = counter("submit_batch_redis_errors_total", "Committed batches that failed to apply to Redis")
+DUPLICATES = counter("submit_duplicates_total", "Submissions ignored because their submission_id was already applied", ("mode",))
+REJECTED = counter("submit_rejected_total", "Submissions Postgres refused on their own data, split out of their batch", ("mode",))
+
+# SQLSTATE classes of errors caused by the rows of a statement rather than by
+# the database: 22 data exception (value out of range, string too long), 23
+# integrity constraint violation (e.g. a user_id with no users row)
+DATA_ERROR_CLASSES = ("22", "23")
+FOREIGN_KEY_VIOLATION = "23503"
+# Also class 23, but raised for a game_sessions row with no partition for its
+# timestamp (no table has CHECK constraints): a missing partition is a server
+# fault, not the submission's, so it fails the batch
+NO_PARTITION = "23514"
+
+
+class RejectedSubmission(Exception):
+    """A submission Postgres refused on its own data; the rest of its batch was applied."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+def sqlstate(error):
+    return getattr(getattr(error, "orig", None), "sqlstate", None) or ""
+
+
+def is_data_error(error):
+    """True if Postgres refused a statement because of the values it carried."""
+    if not isinstance(error, DBAPIError) or sqlstate(error) == NO_PARTITION:
+        return False
+    return sqlstate(error)[:2] in DATA_ERROR_CLASSES
+
+
+def rejection(error):
+    if sqlstate(error) == FOREIGN_KEY_VIOLATION:
+        return RejectedSubmission(404, "User not found")
+    return RejectedSubmission(422, f"Submission rejected by the database ({sqlstate(error)})")
+
+
+async def persist_isolated(persist, items, rejected):
+    """
+    Run persist(items) in one transaction. When Postgres refuses the batch for
+    its data, split it in halves until each refused item is alone, so one bad
+    item costs O(log n) extra statements and every other item is still
+    persisted; rejected(item, error) is called for the refused ones. Returns
+    the concatenated results of the committed statements. Other errors
+    (connection, timeout) propagate.
+    """
+    try:
+        return await persist(items)
+    except Exception as e:
+        if not is_data_error(e):
+            raise
+        if len(items) == 1:
+            rejected(items[0], e)
+            return []
+    middle = len(items) // 2
+    return await persist_isolated(persist, items[:middle], rejected) + await persist_isolated(persist, items[middle:], rejected)
+
+
+class SubmissionBatcher:
+    """
+    Coalesces score submissions into micro-batches.
+
+    Each flush issues one statement that inserts into game_sessions and upserts
+    leaderboard with a single row per distinct user, one commit, and one
+    pipelined ZINCRBY batch covering every mode/window board. Callers are released only after the commit.
+
+    Submissions carrying a submission_id that was already persisted (a client
+    retry within SUBMISSION_ID_RETENTION_DAYS) are dropped and skipped in Redis.
+    A submission Postgres refuses (e.g. an unknown user_id) fails only its own
+    caller, with RejectedSubmission.
+    """
+
+    def __init__(self, batch_size=SUBMIT_BATCH_SIZE, window_ms=SUBMIT_BATCH_WINDOW_MS, queue_size=SUBMIT_QUEUE_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.window = max(0.0, window_ms) / 1000
+        self.queue_size = queue_size
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Let queued submissions flush before shutting down
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, item: GameSessionCreate):
+        """Queue a submission and wait until its batch is committed. Returns False for a duplicate submission_id."""
+        if self._task is None:
+            raise RuntimeError("Submission batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Pick up anything that arrived while we were waiting, without blocking
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Keep the loop alive: a dead task would leave stop() waiting on the queue forever
+                logger.exception("Failed to flush batch of %d submissions", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        now = datetime.utcnow()
+        # A retry queued in the same batch as its original counts once
+        items, first = [], {}
+        for item, _ in batch:
+            if item.submission_id is None:
+                items.append(item)
+            elif item.submission_id not in first:
+                items.append(item)
+                first[item.submission_id] = item
+
+        async def persist(items):
+            async with engine.begin() as conn:
+                return (await conn.execute(SUBMIT_BATCH_SQL, {
+                    "ts": now,
+                    "sids": [i.submission_id for i in items],
+                    "uids": [i.user_id for i in items],
+                    "scores": [i.score for i in items],
+                    "modes": [i.game_mode for i in items],
+                })).all()
+
+        errors = {}
+
+        def rejected(item, error):
+            logger.warning("Rejected submission for user %s: %s", item.user_id, error.orig)
+            REJECTED.inc("batched")
+            errors[id(item)] = rejection(error)
+
+        # 1. Persist the whole batch in one transaction (split only around rejected submissions)
+        db_start = time.perf_counter()
+        try:
+            rows = await persist_isolated(persist, items, rejected)
+        except Exception as e:
+            logger.exception("Failed to persist batch of %d submissions", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        failed = 0
+        for item, future in batch:
+            # A repeat of a rejected submission_id in the same batch shares its error
+            error = errors.get(id(first.get(item.submission_id, item)))
+            if error is not None:
+                failed += 1
+                if not future.done():
+                    future.set_exception(error)
+        FLUSH_SECONDS.observe(time.perf_counter() - db_start, "db")
+        BATCH_SIZE.observe(len(batch))
+        inserted = {row.submission_id for row in rows if row.submission_id is not None}
+        moves = [(row.old_total, row.new_total) for row in rows if row.new_total is not None]
+
+        applied = [
+            item for item in items
+            if id(item) not in errors and (item.submission_id is None or item.submission_id in inserted)
+        ]
+        if len(applied) + failed < len(batch):
+            DUPLICATES.inc("batched", amount=len(batch) - len(applied) - failed)
+        applied_ids = {id(item) for item in applied}
+
+        # Per-board increments: {key: {user_id: delta}} and each board's expiry
+        board_totals = defaultdict(lambda: defaultdict(int))
+        board_expiry = {}
+        mode_boards = {}
+        for item in applied:
+            if item.game_mode not in mode_boards:
+                mode_boards[item.game_mode] = submit_boards(item.game_mode, now)
+            for key, expire_at in mode_boards[item.game_mode].items():
+                board_totals[key][item.user_id] += item.score
+                board_expiry[key] = expire_at
+        if not board_totals:
+            self._resolve(batch, applied_ids)
+            return
+
+        # 2. Apply the aggregated increments to Redis in one round trip.
+        # The batch is already durable, so a Redis failure is logged rather than
+        # surfaced to callers.
+        redis_start = time.perf_counter()
+        try:
+            client = get_client()
+            global_update = None
+            if not scoreboard.on_primary:
+                # The global board lives on the shards; update it alongside the primary
+                global_update = scoreboard.incr_many(board_totals.pop(GLOBAL_KEY))
+            async with client.pipeline(transaction=False) as pipe:
+                for key, deltas in board_totals.items():
+                    for uid, delta in deltas.items():
+                        pipe.zincrby(key, delta, str(uid))
+                    if board_expiry[key]:
+                        pipe.expireat(key, board_expiry[key])
+                    # Current K-th score, to tell whether cached top lists went stale
+                    pipe.zrevrange(key, TOP_K - 1, TOP_K - 1, withscores=True)
+                # Score histogram and active players for /stats and approximate ranks (replies unused)
+                queue_stats(pipe, moves, list({item.user_id for item in applied}), now)
+                if global_update is not None:
+                    replies, _ = await asyncio.gather(pipe.execute(), global_update)
+                else:
+                    replies = await pipe.execute()
+
+            # 3. Invalidate cached top lists of boards where a new score reached the top K
+            stale = [GLOBAL_KEY] if not scoreboard.on_primary else []
+            pos = 0
+            for key, deltas in board_totals.items():
+                new_scores = replies[pos:pos + len(deltas)]
+                pos += len(deltas) + (1 if board_expiry[key] else 0)
+                kth = replies[pos]
+                pos += 1
+                if not kth or max(new_scores) >= kth[0][1]:
+                    stale.append(key)
+            if stale:
+                async with client.pipeline(transaction=False) as pipe:
+                    for key in stale:
+                        pipe.publish(INVALIDATION_CHANNEL, key)
+                    await pipe.execute()
+        except Exception:
+            logger.exception("Failed to apply batch of %d submissions to Redis", len(batch))
+            REDIS_ERRORS.inc()
+        FLUSH_SECONDS.observe(time.perf_counter() - redis_start, "redis")
+
+        self._resolve(batch, applied_ids)
+
+    @staticmethod
+    def _resolve(batch, applied_ids):
+        for item, future in batch:
+            if not future.done():
+                future.set_result(id(item) in applied_ids)
+
+
+submission_batcher = SubmissionBatcher()
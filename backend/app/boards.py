@@ -0,0 +1,430 @@
+import logging
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import text
+
+from .batcher import DUPLICATES, REJECTED, SubmissionBatcher, persist_isolated, rejection
+from .cache import get_client
+from .database import engine
+from .hot_cache import INVALIDATION_CHANNEL, TOP_K, top_cache
+from .metrics import SIZE_BUCKETS, counter, histogram
+from .windows import LOADED_CHECK_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker trusts its copy of a board's configuration
+BOARD_CONFIG_TTL = float(os.getenv("BOARD_CONFIG_TTL", "60"))
+# Board configurations (and unknown board ids) remembered per worker, least recently used dropped first
+BOARD_CONFIG_CACHE_SIZE = int(os.getenv("BOARD_CONFIG_CACHE_SIZE", "10000"))
+BOARD_LOAD_CHUNK_SIZE = int(os.getenv("BOARD_LOAD_CHUNK_SIZE", "20000"))
+BOARD_LOAD_LOCK_TTL = 300
+# Bearer token required to create or delete boards; unset disables both
+BOARD_ADMIN_TOKEN = os.getenv("BOARD_ADMIN_TOKEN", "")
+
+BOARD_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+SORT_ORDERS = ("desc", "asc")
+AGGREGATIONS = ("sum", "best")
+
+BOARD_COLUMNS = "board_id, name, sort_order, aggregation, created_at"
+BOARD_SQL = text(f"SELECT {BOARD_COLUMNS} FROM boards WHERE board_id = :id")
+LIST_BOARDS_SQL = text(f"SELECT {BOARD_COLUMNS} FROM boards WHERE board_id > :after ORDER BY board_id LIMIT :limit")
+CREATE_BOARD_SQL = text(f"""
+    INSERT INTO boards (board_id, name, sort_order, aggregation, created_at)
+    VALUES (:id, :name, :sort_order, :aggregation, :ts)
+    ON CONFLICT (board_id) DO NOTHING
+    RETURNING {BOARD_COLUMNS}
+""")
+DELETE_BOARD_SQL = text("DELETE FROM boards WHERE board_id = :id RETURNING board_id")
+DELETE_SCORES_SQL = text("DELETE FROM board_scores WHERE board_id = :id")
+DELETE_SUBMISSIONS_SQL = text("DELETE FROM board_submissions WHERE board_id = :id")
+
+# Every board's submissions of a flush in one statement with a fixed text. As
+# for the default board, submission_ids are claimed first and repeats are
+# skipped; they are claimed per board in board_submissions, so the same id on
+# another board or on the default board is a different submission. Each board's scores are folded per player by its `op` (sum, or the
+# max/min for best-score boards) and upserted by the matching CTE; rows are
+# locked in (op, board_id, user_id) order so concurrent flushes cannot
+# deadlock. A best score that does not improve leaves its row untouched.
+# Returns a row per claimed (board_id, submission_id), then one per changed
+# board_scores row with its new score.
+BOARD_SUBMIT_SQL = text("""
+    WITH batch AS (
+        SELECT * FROM unnest(
+            CAST(:sids AS varchar[]), CAST(:boards AS varchar[]), CAST(:uids AS int[]),
+            CAST(:scores AS bigint[]), CAST(:ops AS varchar[])
+        ) AS b(submission_id, board_id, user_id, score, op)
+    ),
+    claimed AS (
+        INSERT INTO board_submissions (board_id, submission_id, created_at)
+        SELECT board_id, submission_id, CAST(:ts AS timestamp) FROM batch WHERE submission_id IS NOT NULL
+        ON CONFLICT (board_id, submission_id) DO NOTHING
+        RETURNING board_id, submission_id
+    ),
+    folded AS (
+        SELECT board_id, user_id, op,
+               CASE op WHEN 'sum' THEN SUM(score) WHEN 'max' THEN MAX(score) ELSE MIN(score) END AS score
+        FROM batch
+        WHERE submission_id IS NULL OR (board_id, submission_id) IN (SELECT board_id, submission_id FROM claimed)
+        GROUP BY board_id, user_id, op
+    ),
+    summed AS (
+        INSERT INTO board_scores (board_id, user_id, score, updated_at)
+        SELECT board_id, user_id, score, CAST(:ts AS timestamp) FROM folded WHERE op = 'sum' ORDER BY board_id, user_id
+        ON CONFLICT (board_id, user_id)
+        DO UPDATE SET score = board_scores.score + EXCLUDED.score, updated_at = EXCLUDED.updated_at
+        RETURNING board_id, user_id, score
+    ),
+    raised AS (
+        INSERT INTO board_scores (board_id, user_id, score, updated_at)
+        SELECT board_id, user_id, score, CAST(:ts AS timestamp) FROM folded WHERE op = 'max' ORDER BY board_id, user_id
+        ON CONFLICT (board_id, user_id)
+        DO UPDATE SET score = EXCLUDED.score, updated_at = EXCLUDED.updated_at WHERE EXCLUDED.score > board_scores.score
+        RETURNING board_id, user_id, score
+    ),
+    lowered AS (
+        INSERT INTO board_scores (board_id, user_id, score, updated_at)
+        SELECT board_id, user_id, score, CAST(:ts AS timestamp) FROM folded WHERE op = 'min' ORDER BY board_id, user_id
+        ON CONFLICT (board_id, user_id)
+        DO UPDATE SET score = EXCLUDED.score, updated_at = EXCLUDED.updated_at WHERE EXCLUDED.score < board_scores.score
+        RETURNING board_id, user_id, score
+    )
+    SELECT submission_id, board_id, CAST(NULL AS int) AS user_id, CAST(NULL AS bigint) AS score
+    FROM claimed
+    UNION ALL SELECT NULL, board_id, user_id, score FROM summed
+    UNION ALL SELECT NULL, board_id, user_id, score FROM raised
+    UNION ALL SELECT NULL, board_id, user_id, score FROM lowered
+""")
+
+FLUSH_SECONDS = histogram("board_submit_flush_seconds", "Board micro-batch flush time by stage", ("stage",))
+BATCH_SIZE = histogram("board_submit_batch_size", "Submissions per board micro-batch", buckets=SIZE_BUCKETS)
+BOARDS_PER_BATCH = histogram("board_submit_boards_per_batch", "Distinct boards per board micro-batch", buckets=SIZE_BUCKETS)
+REDIS_ERRORS = counter("board_submit_redis_errors_total", "Committed board batches that failed to apply to Redis")
+LOAD_SECONDS = histogram("board_load_seconds", "Time to load a board into Redis from board_scores", buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60))
+
+# {sorted set key: monotonic time until which it is known to be loaded}
+_loaded_boards = {}
+
+
+def scores_key(board_id):
+    # The hash tag keeps a board's keys in one Redis Cluster slot
+    return f"board:{{{board_id}}}:scores"
+
+
+def loaded_key(board_id):
+    return f"board:{{{board_id}}}:loaded"
+
+
+def config_key(board_id):
+    """Published on INVALIDATION_CHANNEL when a board is created or deleted."""
+    return f"board:{{{board_id}}}:config"
+
+
+class Board(NamedTuple):
+    board_id: str
+    name: str
+    sort_order: str
+    aggregation: str
+    created_at: datetime
+
+    @property
+    def ascending(self):
+        return self.sort_order == "asc"
+
+    @property
+    def key(self):
+        return scores_key(self.board_id)
+
+    @property
+    def op(self):
+        """How a new score combines with a player's standing: sum, or keep the max/min."""
+        if self.aggregation == "sum":
+            return "sum"
+        return "min" if self.ascending else "max"
+
+    @property
+    def zadd_flags(self):
+        # Standings only move one way (scores are non-negative), so a stale
+        # ZADD arriving late can never overwrite a newer value
+        return {"lt": True} if self.op == "min" else {"gt": True}
+
+    def beats(self, score, other):
+        """True if `score` ranks at or above `other` on this board."""
+        return score <= other if self.ascending else score >= other
+
+    def as_dict(self):
+        return self._asdict()
+
+
+class BoardRegistry:
+    """
+    Per-worker cache of board configurations, so a request resolves its board
+    with a dict lookup and no query. Unknown ids are cached as well. Entries
+    are re-read after BOARD_CONFIG_TTL seconds, and dropped at once when a
+    board's config_key is published on INVALIDATION_CHANNEL.
+    """
+
+    def __init__(self, ttl=BOARD_CONFIG_TTL, max_size=BOARD_CONFIG_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # board_id -> (monotonic expiry, Board or None)
+        self._entries = OrderedDict()
+
+    async def start(self):
+        top_cache.add_listener(self._on_invalidate)
+
+    async def get(self, board_id):
+        """The board's configuration, or None if there is no such board."""
+        entry = self._entries.get(board_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(board_id)
+            return entry[1]
+        async with engine.connect() as conn:
+            row = (await conn.execute(BOARD_SQL, {"id": board_id})).first()
+        board = Board(**row._mapping) if row is not None else None
+        self._entries[board_id] = (time.monotonic() + self.ttl, board)
+        self._entries.move_to_end(board_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return board
+
+    def forget(self, board_id):
+        self._entries.pop(board_id, None)
+        _loaded_boards.pop(scores_key(board_id), None)
+
+    def _on_invalidate(self, key):
+        if key is None:
+            # Missed messages while the listener reconnected
+            self._entries.clear()
+            _loaded_boards.clear()
+        elif key.startswith("board:{") and key.endswith("}:config"):
+            self.forget(key[len("board:{"):-len("}:config")])
+
+
+board_registry = BoardRegistry()
+
+
+async def _discard_board(board_id):
+    """Drop a board's Redis keys and tell every worker to forget its configuration and cached top list."""
+    board_registry.forget(board_id)
+    async with get_client().pipeline(transaction=False) as pipe:
+        pipe.unlink(scores_key(board_id), loaded_key(board_id))
+        pipe.publish(INVALIDATION_CHANNEL, config_key(board_id))
+        pipe.publish(INVALIDATION_CHANNEL, scores_key(board_id))
+        await pipe.execute()
+
+
+async def create_board(board_id, name, sort_order="desc", aggregation="sum"):
+    """Create a board; returns it, or None if board_id is taken."""
+    async with engine.begin() as conn:
+        row = (await conn.execute(CREATE_BOARD_SQL, {
+            "id": board_id, "name": name, "sort_order": sort_order, "aggregation": aggregation, "ts": datetime.utcnow(),
+        })).first()
+        if row is None:
+            return None
+        # Scores a submit racing the deletion of an earlier board with this id may have left
+        await conn.execute(DELETE_SCORES_SQL, {"id": board_id})
+        await conn.execute(DELETE_SUBMISSIONS_SQL, {"id": board_id})
+    await _discard_board(board_id)
+    return Board(**row._mapping)
+
+
+async def delete_board(board_id):
+    """Delete a board with its scores and submission_ids. Returns False if there is no such board."""
+    async with engine.begin() as conn:
+        if (await conn.execute(DELETE_BOARD_SQL, {"id": board_id})).first() is None:
+            return False
+        await conn.execute(DELETE_SCORES_SQL, {"id": board_id})
+        await conn.execute(DELETE_SUBMISSIONS_SQL, {"id": board_id})
+    await _discard_board(board_id)
+    return True
+
+
+async def list_boards(after="", limit=100):
+    async with engine.connect() as conn:
+        rows = (await conn.execute(LIST_BOARDS_SQL, {"after": after, "limit": limit})).all()
+    return [Board(**row._mapping) for row in rows]
+
+
+async def load_board(redis, board):
+    """
+    Load a board's sorted set from board_scores and mark it loaded.
+
+    Written in chunks with ZADD GT (LT for lowest-best boards), so standings
+    already raised by concurrent submits are kept. Returns False if another
+    worker is already loading the board.
+    """
+    lock_key = f"{board.key}:load_lock"
+    token = uuid.uuid4().hex
+    if not await redis.set(lock_key, token, nx=True, ex=BOARD_LOAD_LOCK_TTL):
+        return False
+
+    start_time = time.perf_counter()
+    loaded = 0
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(
+                text("SELECT user_id, score FROM board_scores WHERE board_id = :id"),
+                {"id": board.board_id},
+                execution_options={"yield_per": BOARD_LOAD_CHUNK_SIZE},
+            )
+            async for rows in result.partitions(BOARD_LOAD_CHUNK_SIZE):
+                await redis.zadd(board.key, {str(row.user_id): row.score for row in rows}, **board.zadd_flags)
+                loaded += len(rows)
+        await redis.set(loaded_key(board.board_id), 1)
+    finally:
+        if await redis.get(lock_key) == token:
+            await redis.delete(lock_key)
+
+    load_time = time.perf_counter() - start_time
+    logger.info("Loaded %d players of board %s into Redis in %.2fs", loaded, board.board_id, load_time)
+    LOAD_SECONDS.observe(load_time)
+    return True
+
+
+async def ensure_loaded(redis, board):
+    """
+    Key of the board's sorted set, loading it from board_scores on first use.
+    Returns None while another worker is loading it.
+    """
+    key = board.key
+    if _loaded_boards.get(key, 0) > time.monotonic():
+        return key
+    if not await redis.exists(loaded_key(board.board_id)):
+        if not await load_board(redis, board):
+            return None
+    _loaded_boards[key] = time.monotonic() + LOADED_CHECK_TTL_SECONDS
+    return key
+
+
+class BoardSubmissionBatcher(SubmissionBatcher):
+    """
+    Micro-batches submissions to every board together: however many boards a
+    flush touches, it costs one statement, one commit and one Redis pipeline,
+    so thousands of boards add no per-board work to the write path.
+
+    Redis gets each changed player's new standing from the statement with
+    ZADD GT/LT rather than an increment, so the sorted set of a board that is
+    not loaded yet holds correct values for the players it has, and the
+    loader can merge into it. A submission Postgres refuses fails only its
+    own caller, with RejectedSubmission.
+    """
+
+    async def submit(self, board, item):
+        """Queue a submission to `board` and wait until it is committed. Returns False for a duplicate submission_id."""
+        return await super().submit((board, item))
+
+    async def _flush(self, batch):
+        now = datetime.utcnow()
+        # A retry queued in the same batch as its original counts once
+        entries, first = [], {}
+        for entry, _ in batch:
+            board, item = entry
+            if item.submission_id is None:
+                entries.append(entry)
+            elif (board.board_id, item.submission_id) not in first:
+                entries.append(entry)
+                first[(board.board_id, item.submission_id)] = entry
+
+        async def persist(entries):
+            async with engine.begin() as conn:
+                return (await conn.execute(BOARD_SUBMIT_SQL, {
+                    "ts": now,
+                    "sids": [item.submission_id for _, item in entries],
+                    "boards": [board.board_id for board, _ in entries],
+                    "uids": [item.user_id for _, item in entries],
+                    "scores": [item.score for _, item in entries],
+                    "ops": [board.op for board, _ in entries],
+                })).all()
+
+        errors = {}
+
+        def rejected(entry, error):
+            logger.warning("Rejected submission to board %s for user %s: %s", entry[0].board_id, entry[1].user_id, error.orig)
+            REJECTED.inc("board")
+            errors[id(entry)] = rejection(error)
+
+        # 1. Persist every board's submissions in one transaction (split only around rejected submissions)
+        db_start = time.perf_counter()
+        try:
+            rows = await persist_isolated(persist, entries, rejected)
+        except Exception as e:
+            logger.exception("Failed to persist batch of %d board submissions", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        failed = 0
+        for entry, future in batch:
+            # A repeat of a rejected submission_id in the same batch shares its error
+            error = errors.get(id(first.get((entry[0].board_id, entry[1].submission_id), entry)))
+            if error is not None:
+                failed += 1
+                if not future.done():
+                    future.set_exception(error)
+        FLUSH_SECONDS.observe(time.perf_counter() - db_start, "db")
+        BATCH_SIZE.observe(len(batch))
+        claimed = {(row.board_id, row.submission_id) for row in rows if row.submission_id is not None}
+
+        applied = [
+            entry for entry in entries
+            if id(entry) not in errors
+            and (entry[1].submission_id is None or (entry[0].board_id, entry[1].submission_id) in claimed)
+        ]
+        if len(applied) + failed < len(batch):
+            DUPLICATES.inc("board", amount=len(batch) - len(applied) - failed)
+        applied_ids = {id(entry) for entry in applied}
+
+        # New standings per board: {board_id: {user_id: score}}
+        boards = {board.board_id: board for board, _ in applied}
+        standings = defaultdict(dict)
+        for row in rows:
+            if row.user_id is not None:
+                standings[row.board_id][str(row.user_id)] = row.score
+        BOARDS_PER_BATCH.observe(len(boards))
+        if not standings:
+            self._resolve(batch, applied_ids)
+            return
+
+        # 2. Apply them to Redis in one round trip; the batch is already durable,
+        # so a Redis failure is logged rather than surfaced to callers
+        redis_start = time.perf_counter()
+        try:
+            client = get_client()
+            async with client.pipeline(transaction=False) as pipe:
+                for board_id, scores in standings.items():
+                    board = boards[board_id]
+                    pipe.zadd(board.key, scores, **board.zadd_flags)
+                    # Current K-th entry, to tell whether cached top lists went stale
+                    if board.ascending:
+                        pipe.zrange(board.key, TOP_K - 1, TOP_K - 1, withscores=True)
+                    else:
+                        pipe.zrevrange(board.key, TOP_K - 1, TOP_K - 1, withscores=True)
+                replies = await pipe.execute()
+
+            # 3. Invalidate cached top lists of boards where a new standing reached the top K
+            stale = []
+            for i, (board_id, scores) in enumerate(standings.items()):
+                board, kth = boards[board_id], replies[2 * i + 1]
+                best = (min if board.ascending else max)(scores.values())
+                if not kth or board.beats(best, kth[0][1]):
+                    stale.append(board.key)
+            if stale:
+                async with client.pipeline(transaction=False) as pipe:
+                    for key in stale:
+                        pipe.publish(INVALIDATION_CHANNEL, key)
+                    await pipe.execute()
+        except Exception:
+            logger.exception("Failed to apply batch of %d board submissions to Redis", len(batch))
+            REDIS_ERRORS.inc()
+        FLUSH_SECONDS.observe(time.perf_counter() - redis_start, "redis")
+
+        self._resolve(batch, applied_ids)
+
+
+board_batcher = BoardSubmissionBatcher()
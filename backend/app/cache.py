@@ -1,11 +1,178 @@
 from redis import asyncio as redis
 import os
+import time
+
+from .metrics import gauge, histogram
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
+# Pool sizing: callers wait up to REDIS_POOL_TIMEOUT seconds for a free connection
+# once REDIS_MAX_CONNECTIONS are checked out, instead of opening new sockets.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+
+# Resolves rank and score for every member in one server-side step, so both
+# values come from the same snapshot of the sorted set.
+RANK_LOOKUP_LUA = """
+local out = {}
+for i, member in ipairs(ARGV) do
+    local rank = redis.call('ZREVRANK', KEYS[1], member)
+    if rank then
+        out[i] = {rank, redis.call('ZSCORE', KEYS[1], member)}
+    else
+        out[i] = false
+    end
+end
+return out
+"""
+
+# Neighbours of a member: its rank and up to ARGV[2] entries above and below it.
+AROUND_LUA = """
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[1])
+if not rank then
+    return false
+end
+local radius = tonumber(ARGV[2])
+local start = math.max(0, rank - radius)
+return {start, redis.call('ZREVRANGE', KEYS[1], start, rank + radius, 'WITHSCORES')}
+"""
+
+# The same two scripts for boards where the lowest score ranks first
+RANK_LOOKUP_ASC_LUA = RANK_LOOKUP_LUA.replace("ZREVRANK", "ZRANK")
+AROUND_ASC_LUA = AROUND_LUA.replace("ZREVRANK", "ZRANK").replace("ZREVRANGE", "ZRANGE")
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """BlockingConnectionPool that tracks checkouts and time spent waiting for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def make_connection(self):
+        self.created += 1
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        waited = time.perf_counter() - start
+        self.in_use += 1
+        self.checkouts += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        POOL_WAIT_SECONDS.observe(waited)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        self.in_use -= 1
+
+    def stats(self):
+        return {
+            "max_connections": self.max_connections,
+            "created": self.created,
+            "in_use": self.in_use,
+            "idle": max(self.created - self.in_use, 0),
+            "checkouts": self.checkouts,
+            "wait_time_avg_ms": (self.wait_time_total / self.checkouts * 1000) if self.checkouts else 0.0,
+            "wait_time_max_ms": self.wait_time_max * 1000,
+        }
+
+
+_pool = None
+_client = None
+
+POOL_WAIT_SECONDS = histogram("redis_pool_wait_seconds", "Time spent waiting for a Redis connection from the pool")
+# Lua source -> registered script
+_scripts = {}
+
+
+async def init_redis():
+    """Create the process-wide Redis client. Called once from the app startup hook."""
+    global _pool, _client
+    _pool = InstrumentedConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        decode_responses=True,
+    )
+    _client = redis.Redis(connection_pool=_pool)
+    await _client.ping()
+
+
+async def close_redis():
+    global _pool, _client
+    if _client is not None:
+        await _client.close()
+        await _pool.disconnect()
+    _pool = None
+    _client = None
+
+
+def get_client():
+    """Shared client for code running outside a request (background tasks, batchers)."""
+    if _client is None:
+        raise RuntimeError("Redis client is not initialized")
+    return _client
+
+
+def _script(client, source):
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = client.register_script(source)
+    return script
+
+
+async def lookup_ranks(client, key, user_ids, ascending=False):
+    """
+    Rank and score for each user id in one round trip.
+
+    Returns a list aligned with user_ids holding (rank, score) with a 1-based
+    rank, or None for users that are not in the sorted set. With `ascending`
+    the lowest score ranks first.
+    """
+    if not user_ids:
+        return []
+    lookup = _script(client, RANK_LOOKUP_ASC_LUA if ascending else RANK_LOOKUP_LUA)
+    replies = await lookup(keys=[key], args=[str(uid) for uid in user_ids], client=client)
+    return [(int(r[0]) + 1, int(float(r[1]))) if r else None for r in replies]
+
+
+async def lookup_around(client, key, user_id, radius, ascending=False):
+    """
+    Entries around a user in one round trip.
+
+    Returns [(rank, user_id, score)] with 1-based ranks, or None if the user is
+    not in the sorted set. With `ascending` the lowest score ranks first.
+    """
+    lookup = _script(client, AROUND_ASC_LUA if ascending else AROUND_LUA)
+    reply = await lookup(keys=[key], args=[str(user_id), radius], client=client)
+    if not reply:
+        return None
+    start, flat = int(reply[0]), reply[1]
+    return [(start + i + 1, int(flat[2 * i]), int(float(flat[2 * i + 1]))) for i in range(len(flat) // 2)]
+
+
+def pool_stats():
+    return _pool.stats() if _pool is not None else {}
+
+
+def _pool_connections():
+    stats = pool_stats()
+    return {(state,): stats[state] for state in ("max_connections", "created", "in_use", "idle") if state in stats}
+
+
+gauge("redis_pool_connections", "Redis pool connections by state", _pool_connections, ("state",))
+
+
 async def get_redis():
-    client = redis.from_url(REDIS_URL, decode_responses=True)
-    try:
-        yield client
-    finally:
-        await client.close()
+    yield get_client()
@@ -1,14 +1,67 @@
 import os
+import time
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from .metrics import gauge, histogram
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://user:password@db:5432/leaderboard")
+# Optional streaming replica for read-only fallback queries (top lists, DB ranks)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 
-engine = create_async_engine(
-    SQLALCHEMY_DATABASE_URL,
-    echo=True, # Set to False in production
-)
+# Pool sizing per worker: DB_POOL_SIZE persistent connections plus up to
+# DB_MAX_OVERFLOW extra under bursts; callers wait DB_POOL_TIMEOUT seconds for one.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Prepared statements kept per connection by the asyncpg driver
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+QUERY_SECONDS = histogram("db_query_seconds", "Statement execution time", ("engine",))
+
+
+def create_engine(url, name):
+    engine = create_async_engine(
+        url,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        connect_args={
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            # Short OLTP queries never benefit from JIT compilation, which can add tens of ms
+            "server_settings": {"application_name": f"leaderboard-{name}", "jit": "off"},
+        },
+    )
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+        context._query_timed = True
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        context._query_timed = False
+        QUERY_SECONDS.observe(time.perf_counter() - conn.info["query_start"].pop(), name)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _drop_timer(exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start so the
+        # next statement on this pooled connection is not timed from it
+        context = exception_context.execution_context
+        if context is not None and getattr(context, "_query_timed", False):
+            context._query_timed = False
+            exception_context.connection.info["query_start"].pop()
+
+    return engine
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, "primary")
+read_engine = create_engine(DATABASE_REPLICA_URL, "replica") if DATABASE_REPLICA_URL else engine
 
 SessionLocal = sessionmaker(
     bind=engine,
@@ -17,8 +70,36 @@ SessionLocal = sessionmaker(
     autoflush=False,
 )
 
+ReadSessionLocal = sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+)
+
 Base = declarative_base()
 
+def _pool_connections():
+    engines = {"primary": engine}
+    if read_engine is not engine:
+        engines["replica"] = read_engine
+    values = {}
+    for name, eng in engines.items():
+        pool = eng.sync_engine.pool
+        values[(name, "size")] = pool.size()
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "overflow")] = pool.overflow()
+        # checked_out reaching max means callers are queueing for a connection
+        values[(name, "max")] = pool.size() + DB_MAX_OVERFLOW
+    return values
+
+gauge("db_pool_connections", "SQLAlchemy pool connections by state", _pool_connections, ("engine", "state"))
+
 async def get_db():
     async with SessionLocal() as session:
         yield session
+
+async def get_read_db():
+    """Session for read-only queries; the replica when DATABASE_REPLICA_URL is set, else the primary"""
+    async with ReadSessionLocal() as session:
+        yield session
@@ -0,0 +1,56 @@
+import json
+
+from fastapi import Response
+
+# Both are in requirements.txt; without orjson the standard encoder is used,
+# and without msgpack every response is JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_ACCEPT = {MSGPACK_MEDIA_TYPE, "application/x-msgpack"}
+# Responses differ by Accept, so shared caches must key on it
+VARY = {"Vary": "Accept"}
+
+
+def dumps_json(payload):
+    """Compact JSON bytes of plain dicts/lists/str/int/float/None."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def negotiate(request):
+    """Media type of the response: msgpack when the client accepts it (and it is installed), else JSON."""
+    accept = request.headers.get("accept", "") if request is not None else ""
+    if msgpack is None or "msgpack" not in accept:
+        return JSON_MEDIA_TYPE
+    for part in accept.split(","):
+        media, _, params = part.partition(";")
+        if media.strip() in MSGPACK_ACCEPT:
+            return JSON_MEDIA_TYPE if params.replace(" ", "") in ("q=0", "q=0.0") else MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def encode(payload, media_type=JSON_MEDIA_TYPE):
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(payload)
+    return dumps_json(payload)
+
+
+def encoded_response(payload, media_type=JSON_MEDIA_TYPE, status_code=200):
+    """
+    Response with a payload already shaped like the endpoint's response
+    model. Returning a Response makes FastAPI skip re-validating it through
+    the model and re-encoding it with jsonable_encoder; response_model stays
+    on the route for the OpenAPI schema only.
+    """
+    return Response(content=encode(payload, media_type), media_type=media_type, status_code=status_code, headers=VARY)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import time
+
+from .cache import get_client
+from .metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached /top response is served without checking Redis
+TOP_CACHE_TTL = float(os.getenv("TOP_CACHE_TTL", "2"))
+# Size of the cached top list; submits only invalidate when they can enter it
+TOP_K = 10
+# Carries the board key whose top-K may have changed
+INVALIDATION_CHANNEL = "leaderboard:top_invalidate"
+
+
+class TopCache:
+    """
+    Per-worker cache of serialized /top responses, keyed by board key, with
+    one body per response encoding.
+
+    Entries expire after TOP_CACHE_TTL seconds and are dropped early when a
+    board key is published on INVALIDATION_CHANNEL, which submit paths do
+    only when a new score is at least the board's current K-th score.
+    Listeners added with add_listener see the same invalidations, so other
+    per-worker consumers share this one subscription.
+    """
+
+    def __init__(self, ttl=TOP_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._listeners = []
+        self._task = None
+
+    def get(self, key, media_type="application/json"):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            body = entry[1].get(media_type)
+            if body is not None:
+                self.hits += 1
+                return body
+        self.misses += 1
+        return None
+
+    def put(self, key, body, media_type="application/json"):
+        """Cache a body in one encoding; encodings of the same key share one expiry and invalidation."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            entry[1][media_type] = body
+        else:
+            self._entries[key] = (time.monotonic() + self.ttl, {media_type: body})
+
+    def invalidate(self, key):
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def add_listener(self, callback):
+        """callback(key) runs for every invalidated board key, and with None after missed messages."""
+        self._listeners.append(callback)
+
+    def _notify(self, key):
+        for callback in self._listeners:
+            callback(key)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with get_client().pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.invalidate(message["data"])
+                            self._notify(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Missed messages while disconnected; drop everything and resubscribe
+                logger.exception("Top cache invalidation listener failed")
+                self._entries.clear()
+                self._notify(None)
+                await asyncio.sleep(1)
+
+
+top_cache = TopCache()
+
+gauge(
+    "top_cache_lookups",
+    "Entries, hits, misses and invalidations of this worker's /top cache",
+    lambda: {(stat,): value for stat, value in top_cache.stats().items()},
+    ("stat",),
+)
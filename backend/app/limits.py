@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from redis.exceptions import RedisError
+
+from .cache import get_client
+from .database import DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_POOL_TIMEOUT
+from .metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Sustained requests per second; each bucket holds RATE_LIMIT_BURST_SECONDS worth of tokens
+SUBMIT_RATE_PER_USER = float(os.getenv("SUBMIT_RATE_PER_USER", "10"))
+SUBMIT_RATE_PER_IP = float(os.getenv("SUBMIT_RATE_PER_IP", "1000"))
+READ_RATE_PER_IP = float(os.getenv("READ_RATE_PER_IP", "1000"))
+# Submissions per second to one /api/boards board, so one game cannot take the shared batcher
+SUBMIT_RATE_PER_BOARD = float(os.getenv("SUBMIT_RATE_PER_BOARD", "5000"))
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "2"))
+# Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+# Postgres fallback reads allowed in flight per worker (defaults to the pool's capacity),
+# how many more may wait, and for how long, before requests are shed with 503
+DB_ADMISSION_LIMIT = int(os.getenv("DB_ADMISSION_LIMIT", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+DB_ADMISSION_QUEUE = int(os.getenv("DB_ADMISSION_QUEUE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+DB_ADMISSION_TIMEOUT = float(os.getenv("DB_ADMISSION_TIMEOUT", str(min(1.0, DB_POOL_TIMEOUT))))
+
+# Token buckets, all charged or none. KEYS = one hash per bucket;
+# ARGV = cost, then rate and capacity per key. Returns {1, 0} when allowed,
+# else {0, milliseconds until enough tokens}. Denials write nothing.
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+local t = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local capacity = tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local elapsed = math.max(0, t - (tonumber(state[2]) or t))
+    tokens = math.min(capacity, tokens + elapsed * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return {0, math.ceil(wait * 1000)}
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i])
+    local capacity = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', key, 'tokens', levels[i] - cost, 'ts', t)
+    -- A bucket left alone for this long is full again, so the key can go
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return {1, 0}
+"""
+
+DECISIONS = counter("rate_limit_decisions_total", "Rate limiter decisions", ("scope", "result"))
+DECISION_SECONDS = histogram("rate_limit_decision_seconds", "Time to decide one rate-limited request", ("scope",))
+REJECTIONS = counter("admission_rejections_total", "Requests shed by a concurrency limiter", ("limiter", "reason"))
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Token-bucket limits kept in Redis, shared by every worker.
+
+    All buckets that apply to a request (e.g. its user_id and its client IP)
+    are checked and charged in one script call, so a decision is one round
+    trip. A client that was refused is refused locally until its retry time,
+    without touching Redis, so a flood costs the limiter nothing. If Redis is
+    unavailable requests are allowed.
+    """
+
+    def __init__(self, enabled=RATE_LIMIT_ENABLED, burst_seconds=RATE_LIMIT_BURST_SECONDS):
+        self.enabled = enabled
+        self.burst_seconds = burst_seconds
+        self._script = None
+        # bucket keys -> monotonic time until which they are known to be empty
+        self._blocked = {}
+
+    async def check(self, scope, limits, cost=1):
+        """
+        Charge `cost` tokens to each (key, rate) in limits, or raise RateLimited.
+        Keys are suffixes such as "user:42" or "ip:10.0.0.1".
+        """
+        if not self.enabled:
+            return
+        keys = tuple(f"ratelimit:{scope}:{key}" for key, _ in limits)
+        now = time.monotonic()
+        blocked_until = self._blocked.get(keys)
+        if blocked_until is not None:
+            if blocked_until > now:
+                DECISIONS.inc(scope, "limited")
+                raise RateLimited(blocked_until - now)
+            del self._blocked[keys]
+
+        args = [cost]
+        for _, rate in limits:
+            args += [rate, max(cost, rate * self.burst_seconds)]
+        start = time.perf_counter()
+        try:
+            if self._script is None:
+                self._script = get_client().register_script(TOKEN_BUCKET_LUA)
+            allowed, wait_ms = await self._script(keys=list(keys), args=args)
+        except RedisError:
+            DECISIONS.inc(scope, "error")
+            logger.warning("Rate limiter unavailable, allowing request", exc_info=True)
+            return
+        finally:
+            DECISION_SECONDS.observe(time.perf_counter() - start, scope)
+
+        if allowed:
+            DECISIONS.inc(scope, "allowed")
+            return
+        DECISIONS.inc(scope, "limited")
+        if len(self._blocked) > 10000:
+            self._blocked.clear()
+        self._blocked[keys] = now + wait_ms / 1000
+        raise RateLimited(wait_ms / 1000)
+
+
+class ConcurrencyLimiter:
+    """
+    Per-worker cap on concurrent work, shedding load instead of queueing it.
+
+    At most `limit` callers run at once. Up to `max_waiting` more wait, each
+    for at most `timeout` seconds; anyone else is rejected immediately with
+    Overloaded. Bounding the queue bounds the latency of admitted requests.
+    """
+
+    def __init__(self, name, limit, max_waiting, timeout):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "limit": self.limit}
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                REJECTIONS.inc(self.name, "queue_full")
+                raise Overloaded(f"{self.name} is at capacity")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                REJECTIONS.inc(self.name, "timeout")
+                raise Overloaded(f"{self.name} is at capacity")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+def client_ip(request):
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def ranks_cost(count):
+    """POST /ranks is charged one token per 100 user_ids."""
+    return max(1, math.ceil(count / 100))
+
+
+rate_limiter = RateLimiter()
+db_admission = ConcurrencyLimiter("db_fallback", DB_ADMISSION_LIMIT, DB_ADMISSION_QUEUE, DB_ADMISSION_TIMEOUT)
+
+gauge(
+    "admission_requests",
+    "Requests running and waiting in each concurrency limiter",
+    lambda: {(db_admission.name, state): value for state, value in db_admission.stats().items() if state != "limit"},
+    ("limiter", "state"),
+)
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+from .cache import get_client
+from .encoding import dumps_json
+from .hot_cache import TOP_K, top_cache
+from .metrics import counter, gauge
+from .scoreboard import scoreboard
+from .warmup import is_cache_ready
+from .windows import GLOBAL_KEY
+
+logger = logging.getLogger(__name__)
+
+# Minimum time between top-K reads; invalidations arriving meanwhile are coalesced into one diff
+STREAM_MIN_INTERVAL = float(os.getenv("STREAM_MIN_INTERVAL", "0.5"))
+# Re-read the top K this often while viewers are connected, in case an invalidation was missed
+STREAM_RESYNC_INTERVAL = float(os.getenv("STREAM_RESYNC_INTERVAL", "10"))
+# Live viewers per worker; further /stream requests get 503 and should poll /top
+STREAM_MAX_CONNECTIONS = int(os.getenv("STREAM_MAX_CONNECTIONS", "20000"))
+# Undelivered event bytes a connection may hold before it is switched to a snapshot
+STREAM_BUFFER_BYTES = int(os.getenv("STREAM_BUFFER_BYTES", "16384"))
+# Comment line sent to idle connections so proxies keep them open
+HEARTBEAT_SECONDS = 15
+HEARTBEAT = b": ping\n\n"
+
+EVENTS = counter("stream_events_total", "Top-K events encoded for live viewers", ("event",))
+OVERFLOWS = counter("stream_overflows_total", "Slow live viewers whose queued diffs were replaced by a snapshot")
+
+
+def encode_event(event, version, payload):
+    """One server-sent event, encoded once and shared by every connection."""
+    EVENTS.inc(event)
+    return f"id: {version}\nevent: {event}\ndata: ".encode() + dumps_json(payload) + b"\n\n"
+
+
+class Subscriber:
+    """
+    Per-connection queue of encoded events, bounded by STREAM_BUFFER_BYTES.
+
+    A viewer that falls that far behind has its backlog dropped and gets the
+    current snapshot instead, so a slow client costs a bounded amount of
+    memory and never delays the others.
+    """
+
+    __slots__ = ("pending", "pending_bytes", "resync", "ready")
+
+    def __init__(self):
+        self.pending = deque()
+        self.pending_bytes = 0
+        # Every connection starts with a snapshot
+        self.resync = True
+        self.ready = asyncio.Event()
+        self.ready.set()
+
+    def push(self, message):
+        if not self.resync:
+            if self.pending_bytes + len(message) > STREAM_BUFFER_BYTES:
+                self.pending.clear()
+                self.pending_bytes = 0
+                self.resync = True
+                OVERFLOWS.inc()
+            else:
+                self.pending.append(message)
+                self.pending_bytes += len(message)
+        self.ready.set()
+
+
+class TopBroadcaster:
+    """
+    Pushes the global top K to live viewers of GET /api/leaderboard/stream.
+
+    One background task per worker listens for top-K invalidations (through
+    the hot cache's pub/sub subscription), reads the top K from Redis at most
+    once per STREAM_MIN_INTERVAL, and fans the change out to every
+    connection as one pre-encoded `diff` event. Redis reads therefore depend
+    on how often the top K changes, not on the number of viewers.
+    """
+
+    def __init__(self, max_connections=STREAM_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.version = 0
+        self._entries = {}
+        self._snapshot = None
+        self._subscribers = set()
+        self._dirty = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    def full(self):
+        return len(self._subscribers) >= self.max_connections
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "version": self.version,
+            "events": {labels[0]: value for labels, value in EVENTS.snapshot().items()},
+            "overflows": sum(OVERFLOWS.snapshot().values()),
+        }
+
+    async def start(self):
+        self._closing = False
+        top_cache.add_listener(self._on_invalidate)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Let open streams finish so shutdown is not held up by viewers
+        self._closing = True
+        for subscriber in self._subscribers:
+            subscriber.ready.set()
+
+    def _on_invalidate(self, key):
+        if key is None or key == GLOBAL_KEY:
+            self._dirty.set()
+
+    async def events(self):
+        """Server-sent event stream for one connection: a snapshot, then diffs."""
+        subscriber = Subscriber()
+        self._subscribers.add(subscriber)
+        if self._snapshot is None:
+            self._dirty.set()
+        try:
+            yield b"retry: 2000\n\n"
+            while not self._closing:
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+                subscriber.ready.clear()
+                if subscriber.resync and self._snapshot is not None:
+                    subscriber.resync = False
+                    yield self._snapshot
+                while subscriber.pending:
+                    message = subscriber.pending.popleft()
+                    subscriber.pending_bytes -= len(message)
+                    yield message
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def refresh(self):
+        """Read the top K and broadcast what changed since the last read."""
+        if not await is_cache_ready(get_client()):
+            return
+        rows = await scoreboard.top(0, TOP_K - 1)
+        entries = {uid: (score, rank) for rank, (uid, score) in enumerate(rows, start=1)}
+        if entries == self._entries and self._snapshot is not None:
+            return
+
+        changed = [
+            {"user_id": uid, "total_score": score, "rank": rank}
+            for uid, (score, rank) in entries.items()
+            if self._entries.get(uid) != (score, rank)
+        ]
+        removed = [uid for uid in self._entries if uid not in entries]
+        self._entries = entries
+        self.version += 1
+        self._snapshot = encode_event("snapshot", self.version, {
+            "top_players": [{"user_id": uid, "total_score": score, "rank": rank} for uid, (score, rank) in entries.items()],
+        })
+        if not self._subscribers:
+            return
+        diff = encode_event("diff", self.version, {"changed": changed, "removed": removed})
+        for subscriber in self._subscribers:
+            subscriber.push(diff)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty.wait(), STREAM_RESYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            if not self._subscribers:
+                # Nobody is watching; the next viewer triggers a fresh read
+                self._snapshot = None
+                continue
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Live top-K refresh failed")
+            await asyncio.sleep(STREAM_MIN_INTERVAL)
+
+
+top_broadcaster = TopBroadcaster()
+
+gauge("stream_subscribers", "Open live leaderboard streams on this worker", lambda: {(): top_broadcaster.stats()["subscribers"]})
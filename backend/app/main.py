@@ -1,29 +1,28 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import leaderboard
-from .database import engine, Base
+from fastapi.responses import JSONResponse
+from .routers import boards, leaderboard
+from .batcher import submission_batcher
+from .boards import board_batcher, board_registry
+from .cache import init_redis, close_redis, pool_stats
+from .warmup import cache_warmer
+from .scoreboard import scoreboard
+from .hot_cache import top_cache
+from .live import top_broadcaster
+from .limits import db_admission
+from .partitions import partition_maintainer
+from .ranks import rank_maintainer
+from .reconcile import reconciler
+from .rollup import rollup_maintainer
+from .write_behind import SUBMIT_MODE, write_behind_queue, stream_stats
+from .metrics import REGISTRY, counter, histogram, metrics_exporter
+from .migrations import migrate
+from .runtime import worker, init_newrelic
 import os
 import time
-import newrelic.agent
-
-# Initialize New Relic with configuration file
-NEW_RELIC_LICENSE_KEY = os.getenv("NEW_RELIC_LICENSE_KEY")
-if NEW_RELIC_LICENSE_KEY:
-    try:
-        # Set environment variable for config file
-        os.environ["NEW_RELIC_LICENSE_KEY"] = NEW_RELIC_LICENSE_KEY
-        
-        # Initialize with config file
-        config_file = os.path.join(os.path.dirname(__file__), "..", "newrelic.ini")
-        if os.path.exists(config_file):
-            newrelic.agent.initialize(config_file)
-            print(f"✅ New Relic agent initialized with config file: {config_file}")
-        else:
-            # Fallback to programmatic initialization
-            newrelic.agent.initialize()
-            print("✅ New Relic agent initialized (no config file)")
-    except Exception as e:
-        print(f"❌ Failed to initialize New Relic: {e}")
+
+# Schema work belongs to `python migrate.py`; this lets a single-process dev run create it on boot
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
 
 app = FastAPI(
     title="Gaming Leaderboard",
@@ -47,56 +46,133 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Custom middleware for New Relic metrics
+REQUEST_SECONDS = histogram("http_request_duration_seconds", "End-to-end request latency", ("method", "route"))
+REQUESTS = counter("http_requests_total", "Requests by route and status", ("method", "route", "status"))
+
 @app.middleware("http")
-async def new_relic_metrics_middleware(request: Request, call_next):
-    """Track custom metrics for each request"""
-    start_time = time.time()
-    
-    # Add custom attributes to the transaction
-    if NEW_RELIC_LICENSE_KEY:
-        transaction = newrelic.agent.current_transaction()
-        if transaction:
-            # Add custom parameters to track
-            transaction.add_custom_attribute('request_path', request.url.path)
-            transaction.add_custom_attribute('request_method', request.method)
-            transaction.add_custom_attribute('client_host', request.client.host if request.client else 'unknown')
-    
-    # Process the request
+async def metrics_middleware(request: Request, call_next):
+    """Time every request; one histogram observation and one counter increment"""
+    start_time = time.perf_counter()
     response = await call_next(request)
-    
-    # Calculate response time
-    process_time = time.time() - start_time
+    process_time = time.perf_counter() - start_time
     response.headers["X-Process-Time"] = str(process_time)
     
-    # Record custom metrics in New Relic
-    if NEW_RELIC_LICENSE_KEY:
-        try:
-            # Record response time metric
-            newrelic.agent.record_custom_metric(f'Custom/ResponseTime/{request.url.path}', process_time)
-            
-            # Record status code metric
-            newrelic.agent.record_custom_metric(f'Custom/StatusCode/{response.status_code}', 1)
-            
-            # Record endpoint-specific metrics
-            if request.url.path.startswith('/api/leaderboard'):
-                endpoint_name = request.url.path.split('/')[-1] or 'root'
-                newrelic.agent.record_custom_metric(f'Custom/Leaderboard/{endpoint_name}/ResponseTime', process_time)
-                newrelic.agent.record_custom_metric(f'Custom/Leaderboard/{endpoint_name}/Calls', 1)
-        except Exception as e:
-            print(f"Failed to record New Relic metric: {e}")
-    
+    # Label by route template (/api/leaderboard/rank/{user_id}), not the raw path, to keep series bounded
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    REQUEST_SECONDS.observe(process_time, request.method, route)
+    REQUESTS.inc(request.method, route, response.status_code)
     return response
 
 
 # Startup
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    worker.starting()
+    if MIGRATE_ON_STARTUP:
+        await migrate()
+    # Imported and started here, in the worker, only when NEW_RELIC_LICENSE_KEY is set
+    init_newrelic()
+    # Creates upcoming game_sessions partitions, archives old ones and prunes submission_ids, in the background
+    await partition_maintainer.start()
+    await init_redis()
+    await scoreboard.start()
+    await top_cache.start()
+    # Pushes top-K diffs to /api/leaderboard/stream viewers from this worker's invalidation listener
+    await top_broadcaster.start()
+    if SUBMIT_MODE == "write_behind":
+        await write_behind_queue.start()
+    else:
+        await submission_batcher.start()
+    # Every /api/boards board shares one micro-batcher; configs are cached per worker and dropped on change
+    await board_registry.start()
+    await board_batcher.start()
+    # Loads the full leaderboard into Redis in the background; reads use Postgres until it is done
+    await cache_warmer.start()
+    # Keeps the score histogram used by the DB rank fallback fresh
+    await rank_maintainer.start()
+    # Compares leaderboard against the Redis board and repairs drift, rate-limited
+    await reconciler.start()
+    # Folds new game_sessions into leaderboard_rollup so a leaderboard rebuild stays incremental
+    await rollup_maintainer.start()
+    await metrics_exporter.start()
+    # Opens the first Postgres and Redis connections so this worker's first requests skip connecting
+    await worker.warm_pools()
+    worker.ready()
+
+# Shutdown
+@app.on_event("shutdown")
+async def shutdown():
+    worker.stopping()
+    await metrics_exporter.stop()
+    await rollup_maintainer.stop()
+    await partition_maintainer.stop()
+    await reconciler.stop()
+    await rank_maintainer.stop()
+    await cache_warmer.stop()
+    await write_behind_queue.stop()
+    await submission_batcher.stop()
+    await board_batcher.stop()
+    await top_broadcaster.stop()
+    await top_cache.stop()
+    await scoreboard.close()
+    await close_redis()
+
+@app.get("/healthz")
+async def liveness():
+    """Liveness: the worker's event loop is responding. Checks no dependency, so a Postgres or Redis outage does not restart workers"""
+    return worker.liveness()
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness: startup finished, not shutting down, Postgres and Redis answering; reports pool warmth and cold start"""
+    ready, report = await worker.readiness()
+    return JSONResponse(report, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """All in-process metrics of this worker in the Prometheus text format"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/redis")
+async def redis_pool_metrics():
+    """Connection pool usage for sizing REDIS_MAX_CONNECTIONS"""
+    return pool_stats()
+
+@app.get("/metrics/cache")
+async def hot_cache_metrics():
+    """Hit/miss/invalidation counters of this worker's /top cache"""
+    return top_cache.stats()
+
+@app.get("/metrics/write-behind")
+async def write_behind_metrics():
+    """Persist-stream lag when SUBMIT_MODE=write_behind"""
+    if SUBMIT_MODE != "write_behind":
+        return {"mode": SUBMIT_MODE}
+    return await stream_stats()
+
+@app.get("/metrics/stream")
+async def stream_metrics():
+    """Open live streams, events broadcast and slow-viewer overflows on this worker"""
+    return top_broadcaster.stats()
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """Postgres fallback reads running and waiting on this worker"""
+    return db_admission.stats()
+
+@app.get("/metrics/reconcile")
+async def reconcile_metrics():
+    """Rows scanned, drift found and repairs made by this worker's reconciler"""
+    return reconciler.stats()
 
 app.include_router(leaderboard.router)
+app.include_router(boards.router)
+
+def max_workers():
+    """Worker processes this app can run in: one when the global board is ranked in-process"""
+    return 1 if scoreboard.local else None
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # One preforked worker per CPU; see serve.py
+    from .prefork import serve
+    serve(app, max_workers=max_workers())
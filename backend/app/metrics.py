@@ -0,0 +1,255 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between pushes to optional exporters (New Relic); /metrics is always live
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "60"))
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 20000)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    def snapshot(self):
+        return dict(self.values)
+
+
+class Histogram:
+    """
+    Fixed-bucket distribution per label combination.
+
+    An observation is one bisect and a few integer adds on plain Python
+    containers; every caller runs on the event loop thread, so no locking is
+    needed and the cost does not grow with traffic.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last is +Inf), sum, count, interval min, interval max]
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0, value, value]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+        if value < series[3]:
+            series[3] = value
+        if value > series[4]:
+            series[4] = value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        for labels, (counts, total, count, _, _) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames + ("le",), labels + (bound,))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            label_str = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {total}"
+            yield f"{self.name}_count{label_str} {count}"
+
+    def snapshot(self):
+        """{labels: (sum, count, min, max)}, resetting min/max for the next export interval."""
+        out = {}
+        for labels, series in self.series.items():
+            out[labels] = (series[1], series[2], series[3], series[4])
+            series[3], series[4] = float("inf"), float("-inf")
+        return out
+
+
+class Gauge:
+    """Point-in-time values read from `collect()` at scrape time, e.g. pool stats."""
+
+    kind = "gauge"
+
+    def __init__(self, name, description, collect, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def _values(self):
+        try:
+            values = self.collect()
+        except Exception:
+            logger.exception("Failed to collect gauge %s", self.name)
+            return {}
+        return values if isinstance(values, dict) else {(): values}
+
+    def render(self):
+        for labels, value in self._values().items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    def snapshot(self):
+        return self._values()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labelnames=()):
+        return self._register(Counter(name, description, labelnames))
+
+    def histogram(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, labelnames, buckets))
+
+    def gauge(self, name, description, collect, labelnames=()):
+        return self._register(Gauge(name, description, collect, labelnames))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+
+
+class NewRelicExporter:
+    """
+    Pushes each interval's aggregates to New Relic as custom metrics, one
+    call per flush instead of several per request. Metric names are
+    Custom/<metric>/<label values...>.
+    """
+
+    def __init__(self):
+        import newrelic.agent
+        self.agent = newrelic.agent
+        self._last_counts = {}
+
+    def export(self, registry):
+        application = self.agent.application()
+        if application is None or not application.active:
+            return
+        metrics = []
+        for metric in registry.metrics.values():
+            for labels, value in metric.snapshot().items():
+                name = "/".join(("Custom", metric.name) + tuple(str(label) for label in labels))
+                if metric.kind == "histogram":
+                    total, count, low, high = value
+                    # Only the change since the previous flush; New Relic sums intervals itself
+                    prev_total, prev_count = self._last_counts.get(name, (0.0, 0))
+                    self._last_counts[name] = (total, count)
+                    if count > prev_count:
+                        metrics.append((name, {"count": count - prev_count, "total": total - prev_total, "min": low, "max": high}))
+                elif metric.kind == "counter":
+                    previous = self._last_counts.get(name, 0)
+                    self._last_counts[name] = value
+                    if value > previous:
+                        metrics.append((name, value - previous))
+                else:
+                    metrics.append((name, value))
+        if metrics:
+            self.agent.record_custom_metrics(metrics, application=application)
+
+
+class MetricsExporter:
+    """Background task that flushes the registry to each exporter every METRICS_EXPORT_INTERVAL seconds."""
+
+    def __init__(self, registry=REGISTRY, interval=METRICS_EXPORT_INTERVAL):
+        self.registry = registry
+        self.interval = interval
+        self.exporters = []
+        self._task = None
+
+    def add(self, exporter):
+        self.exporters.append(exporter)
+
+    async def start(self):
+        if self.exporters:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._flush()
+
+    def _flush(self):
+        for exporter in self.exporters:
+            try:
+                exporter.export(self.registry)
+            except Exception:
+                logger.exception("Metrics export via %s failed", type(exporter).__name__)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._flush()
+
+
+metrics_exporter = MetricsExporter()
@@ -0,0 +1,21 @@
+from sqlalchemy import text
+
+from . import models  # noqa: F401  (registers the tables for create_all)
+from .database import Base, engine
+from .partitions import ensure_partitions
+
+# Arbitrary constant serializing concurrent migrations (pg_advisory_xact_lock)
+MIGRATION_LOCK_ID = 7310004
+
+
+async def migrate():
+    """
+    Create missing tables and indexes, then this month's and upcoming
+    game_sessions partitions. Idempotent and safe to run from several hosts at
+    once; run once per deploy (`python migrate.py`), not from API workers.
+    Returns the number of partitions created.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        await conn.run_sync(Base.metadata.create_all)
+    return await ensure_partitions()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -11,17 +11,96 @@ class User(Base):
 
 class GameSession(Base):
     __tablename__ = "game_sessions"
-    id = Column(Integer, primary_key=True)
+    # Monthly range partitions on timestamp (app/partitions.py); the primary
+    # key must include the partition key, so it is (id, timestamp)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # Client idempotency key; uniqueness is enforced by game_session_submissions
+    submission_id = Column(String(64))
     user_id = Column(Integer, ForeignKey("users.id"))
     score = Column(Integer)
     game_mode = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Per-user history, newest first (keyset on timestamp, id)
+        Index("idx_game_sessions_user_timestamp", "user_id", timestamp.desc(), id.desc()),
+        # Time-window roll-ups: tiny next to a btree, and rows arrive in timestamp order
+        Index("idx_game_sessions_timestamp_brin", "timestamp", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+class SubmissionId(Base):
+    __tablename__ = "game_session_submissions"
+    # submission_ids already persisted, pruned after SUBMISSION_ID_RETENTION_DAYS
+    submission_id = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_game_session_submissions_created_brin", "created_at", postgresql_using="brin"),
+    )
 
 class LeaderboardEntry(Base):
     __tablename__ = "leaderboard"
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
     total_score = Column(Integer, index=True)
+    # Not maintained; ranks are computed on read (app/ranks.py)
     rank = Column(Integer, index=True)
     
     user = relationship("User")
+
+    # Keyset pagination on (total_score, user_id)
+    __table_args__ = (
+        Index("idx_leaderboard_score_user", total_score.desc(), user_id.desc()),
+    )
+
+class ScoreBucket(Base):
+    __tablename__ = "leaderboard_score_buckets"
+    # total_score / SCORE_BUCKET_WIDTH
+    bucket = Column(Integer, primary_key=True)
+    user_count = Column(Integer, nullable=False)
+
+class LeaderboardRollup(Base):
+    __tablename__ = "leaderboard_rollup"
+    # SUM(score) per user over game_sessions up to the roll-up watermark
+    user_id = Column(Integer, primary_key=True)
+    total_score = Column(BigInteger, nullable=False)
+
+class RollupWatermark(Base):
+    __tablename__ = "leaderboard_rollup_watermark"
+    name = Column(String(64), primary_key=True)
+    # Highest game_sessions.id included in leaderboard_rollup
+    last_session_id = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class Board(Base):
+    __tablename__ = "boards"
+    # Leaderboards of other games, served under /api/boards/{board_id}
+    board_id = Column(String(64), primary_key=True)
+    name = Column(String(255), nullable=False)
+    # desc: higher score wins; asc: lower score wins
+    sort_order = Column(String(4), nullable=False, default="desc")
+    # sum: a player's scores add up; best: only their best score counts
+    aggregation = Column(String(4), nullable=False, default="sum")
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BoardScore(Base):
+    __tablename__ = "board_scores"
+    # Durable copy of each board's sorted set, one row per player of a board.
+    # Reads are served from Redis, so there is no score index to maintain on writes.
+    board_id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    score = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class BoardSubmission(Base):
+    __tablename__ = "board_submissions"
+    # submission_ids already persisted per board, so ids only need to be unique
+    # within a board; pruned with game_session_submissions
+    board_id = Column(String(64), primary_key=True)
+    submission_id = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("idx_board_submissions_created_brin", "created_at", postgresql_using="brin"),
+    )
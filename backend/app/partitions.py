@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from .database import engine
+from .metrics import counter
+from .rollup import WATERMARK_NAME
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions created ahead of the current month
+GAME_SESSIONS_PREMAKE_MONTHS = int(os.getenv("GAME_SESSIONS_PREMAKE_MONTHS", "3"))
+# Partitions older than this many months are detached into the archive schema (0 keeps everything)
+GAME_SESSIONS_RETENTION_MONTHS = int(os.getenv("GAME_SESSIONS_RETENTION_MONTHS", "0"))
+# How long a client submission_id is remembered for de-duplication
+SUBMISSION_ID_RETENTION_DAYS = int(os.getenv("SUBMISSION_ID_RETENTION_DAYS", "7"))
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "3600"))
+
+# Arbitrary constant serializing partition DDL across workers (pg_advisory_xact_lock)
+PARTITION_JOB_LOCK_ID = 7310003
+ARCHIVE_SCHEMA = "archive"
+PRUNE_BATCH_SIZE = 10000
+
+IS_PARTITIONED_SQL = text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'game_sessions'::regclass)")
+# Attached partitions, oldest first (names sort by month)
+PARTITIONS_SQL = text("""
+    SELECT child.relname AS name
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'game_sessions'::regclass
+    ORDER BY child.relname
+""")
+PRUNE_SUBMISSIONS_SQL = tuple(text(f"""
+    DELETE FROM {table} WHERE ctid = ANY(ARRAY(
+        SELECT ctid FROM {table} WHERE created_at < :before LIMIT :limit
+    ))
+""") for table in ("game_session_submissions", "board_submissions"))
+
+PARTITIONS_CREATED = counter("game_sessions_partitions_created_total", "Monthly game_sessions partitions created")
+PARTITIONS_ARCHIVED = counter("game_sessions_partitions_archived_total", "game_sessions partitions detached into the archive schema")
+
+
+def month_start(day, offset=0):
+    """First day of the month `offset` months after the one containing `day`."""
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"game_sessions_p{month.year}_{month.month:02d}"
+
+
+async def is_partitioned(conn):
+    return await conn.scalar(IS_PARTITIONED_SQL)
+
+
+async def create_partitions(conn, first, last, parent="game_sessions"):
+    """Create the missing monthly partitions of `parent` from `first`'s month through `last`'s."""
+    existing = {row.name for row in await conn.execute(PARTITIONS_SQL)} if parent == "game_sessions" else set()
+    month = month_start(first)
+    created = 0
+    while month <= month_start(last):
+        name = partition_name(month)
+        if name not in existing:
+            # Bounds are literals: DDL cannot take bind parameters
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+            ))
+            created += 1
+            logger.info("Created partition %s", name)
+        month = month_start(month, 1)
+    PARTITIONS_CREATED.inc(amount=created)
+    return created
+
+
+async def ensure_partitions(start=None, months_ahead=GAME_SESSIONS_PREMAKE_MONTHS):
+    """
+    Create the monthly partitions from `start`'s month (default: this month)
+    through `months_ahead` months from now. Returns the number created.
+    """
+    today = datetime.utcnow().date()
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_JOB_LOCK_ID})
+        if not await is_partitioned(conn):
+            logger.warning("game_sessions is not partitioned; run `python seed.py partition` to convert it")
+            return 0
+        return await create_partitions(conn, start or today, month_start(today, months_ahead))
+
+
+async def archive_partitions(retention_months=GAME_SESSIONS_RETENTION_MONTHS):
+    """
+    Detach partitions that ended more than `retention_months` ago into the
+    archive schema, where they stay queryable until dumped and dropped.
+
+    A partition is only detached once the roll-up watermark is past all of its
+    rows, so leaderboard can still be rebuilt from leaderboard_rollup.
+    """
+    if retention_months <= 0:
+        return 0
+    cutoff = month_start(datetime.utcnow().date(), -retention_months)
+    archived = 0
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_JOB_LOCK_ID})
+        if not await is_partitioned(conn):
+            return 0
+        watermark = await conn.scalar(
+            text("SELECT last_session_id FROM leaderboard_rollup_watermark WHERE name = :name"), {"name": WATERMARK_NAME},
+        ) or 0
+        await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+        for row in (await conn.execute(PARTITIONS_SQL)).all():
+            if row.name >= partition_name(cutoff):
+                break
+            newest = await conn.scalar(text(f"SELECT MAX(id) FROM {row.name}"))
+            if newest is not None and newest > watermark:
+                logger.warning("Not archiving %s: rows past the roll-up watermark (%s > %s)", row.name, newest, watermark)
+                break
+            # Keep the parent lock short; a busy table is retried on the next run
+            await conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            await conn.execute(text(f"ALTER TABLE game_sessions DETACH PARTITION {row.name}"))
+            await conn.execute(text(f"ALTER TABLE {row.name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            archived += 1
+            logger.info("Archived partition %s to schema %s", row.name, ARCHIVE_SCHEMA)
+    PARTITIONS_ARCHIVED.inc(amount=archived)
+    return archived
+
+
+async def prune_submission_ids(retention_days=SUBMISSION_ID_RETENTION_DAYS):
+    """Forget submission_ids (default board and boards) older than the de-duplication window, in small batches."""
+    before = datetime.utcnow() - timedelta(days=retention_days)
+    pruned = 0
+    for statement in PRUNE_SUBMISSIONS_SQL:
+        while True:
+            async with engine.begin() as conn:
+                deleted = (await conn.execute(statement, {"before": before, "limit": PRUNE_BATCH_SIZE})).rowcount
+            pruned += deleted
+            if deleted < PRUNE_BATCH_SIZE:
+                break
+            await asyncio.sleep(0.1)
+    return pruned
+
+
+# Conversion of a pre-partitioning game_sessions, in one transaction. The new
+# table takes over the old id sequence, so ids keep increasing and the roll-up
+# watermark stays valid; it gets its canonical name once the old table is gone.
+CONVERT_PREPARE_SQL = (
+    "LOCK TABLE game_sessions IN ACCESS EXCLUSIVE MODE",
+    "ALTER SEQUENCE game_sessions_id_seq AS bigint OWNED BY NONE",
+    """
+    CREATE TABLE game_sessions_partitioned (
+        id BIGINT NOT NULL DEFAULT nextval('game_sessions_id_seq'),
+        submission_id VARCHAR(64),
+        user_id INT REFERENCES users(id) ON DELETE CASCADE,
+        score INT NOT NULL,
+        game_mode VARCHAR(50) NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+    """,
+)
+CONVERT_COPY_SQL = (
+    """
+    INSERT INTO game_sessions_partitioned (id, submission_id, user_id, score, game_mode, timestamp)
+    SELECT id, submission_id, user_id, score, game_mode, COALESCE(timestamp, CURRENT_TIMESTAMP) FROM game_sessions
+    """,
+    """
+    INSERT INTO game_session_submissions (submission_id, created_at)
+    SELECT submission_id, COALESCE(timestamp, CURRENT_TIMESTAMP) FROM game_sessions WHERE submission_id IS NOT NULL
+    ON CONFLICT (submission_id) DO NOTHING
+    """,
+)
+CONVERT_FINISH_SQL = (
+    "DROP TABLE game_sessions",
+    "ALTER TABLE game_sessions_partitioned RENAME TO game_sessions",
+    "ALTER TABLE game_sessions RENAME CONSTRAINT game_sessions_partitioned_pkey TO game_sessions_pkey",
+    "ALTER TABLE game_sessions RENAME CONSTRAINT game_sessions_partitioned_user_id_fkey TO game_sessions_user_id_fkey",
+    "ALTER SEQUENCE game_sessions_id_seq OWNED BY game_sessions.id",
+    "CREATE INDEX idx_game_sessions_user_timestamp ON game_sessions (user_id, timestamp DESC, id DESC)",
+    "CREATE INDEX idx_game_sessions_timestamp_brin ON game_sessions USING brin (timestamp)",
+    "ANALYZE game_sessions",
+)
+
+
+async def convert_to_partitioned():
+    """
+    Rebuild an unpartitioned game_sessions as the partitioned table, keeping
+    ids. Submits wait on the table lock until it commits. Returns the number
+    of rows moved, or None if game_sessions is already partitioned.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_JOB_LOCK_ID})
+        if await is_partitioned(conn):
+            return None
+        for statement in CONVERT_PREPARE_SQL:
+            await conn.execute(text(statement))
+        bounds = (await conn.execute(text("SELECT MIN(timestamp) AS first, MAX(timestamp) AS last FROM game_sessions"))).one()
+        today = datetime.utcnow().date()
+        first = bounds.first.date() if bounds.first else today
+        last = max(bounds.last.date() if bounds.last else today, month_start(today, GAME_SESSIONS_PREMAKE_MONTHS))
+        await create_partitions(conn, first, last, parent="game_sessions_partitioned")
+        moved = (await conn.execute(text(CONVERT_COPY_SQL[0]))).rowcount
+        await conn.execute(text(CONVERT_COPY_SQL[1]))
+        for statement in CONVERT_FINISH_SQL:
+            await conn.execute(text(statement))
+    return moved
+
+
+async def run_maintenance():
+    """One round of partition upkeep; every step is safe to run from several workers."""
+    await ensure_partitions()
+    await archive_partitions()
+    await prune_submission_ids()
+
+
+class PartitionMaintainer:
+    """
+    Creates upcoming monthly game_sessions partitions, archives expired ones
+    and prunes old submission_ids every PARTITION_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, interval=PARTITION_CHECK_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        # The first rounds of partitions come from migrate.py, so a booting worker does no DDL
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_maintenance()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("game_sessions partition maintenance failed")
+
+
+partition_maintainer = PartitionMaintainer()
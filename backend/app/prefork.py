@@ -0,0 +1,176 @@
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# API worker processes; 0 runs one per CPU
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+# Seconds workers get to finish in-flight requests and run shutdown hooks on SIGTERM
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+LISTEN_BACKLOG = int(os.getenv("LISTEN_BACKLOG", "2048"))
+
+# A worker exiting sooner than this after its fork counts as a failed boot;
+# repeated failures are retried with a doubling delay instead of a fork loop
+MIN_WORKER_UPTIME = 10.0
+MAX_RESPAWN_DELAY = 30.0
+POLL_INTERVAL = 0.2
+
+
+def worker_count(requested=WEB_CONCURRENCY):
+    return requested if requested > 0 else os.cpu_count() or 1
+
+
+def bind(host, port, backlog=LISTEN_BACKLOG):
+    """The listening socket, bound once in the parent and inherited by every worker."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class Arbiter:
+    """
+    Parent of a preforked, shared-nothing pool of API workers.
+
+    The app is imported once before forking, so a worker starts with every
+    module already loaded and only runs the startup hook: its own event loop,
+    Postgres and Redis pools and background tasks. Workers share nothing but
+    the listening socket; the kernel spreads accepted connections across them.
+    An exited worker is replaced. SIGTERM/SIGINT stop the pool gracefully,
+    SIGTTIN/SIGTTOU add or remove one worker, up to max_workers if set.
+    """
+
+    def __init__(self, app, sock, workers, graceful_timeout=GRACEFUL_TIMEOUT, log_level="info", max_workers=None):
+        self.app = app
+        self.sock = sock
+        self.max_workers = max_workers
+        self.target = workers
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        # pid -> monotonic time of the fork
+        self.workers = {}
+        self.failures = 0
+        self.respawn_at = 0.0
+        self.stopping = False
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_stop)
+        signal.signal(signal.SIGTTIN, self._on_scale)
+        signal.signal(signal.SIGTTOU, self._on_scale)
+        host, port = self.sock.getsockname()[:2]
+        logger.info("Starting %d workers on %s:%d (pid %d)", self.target, host, port, os.getpid())
+        try:
+            while not self.stopping:
+                self._reap()
+                self._scale()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self._stop_workers()
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_scale(self, signum, frame):
+        target = self.target + 1 if signum == signal.SIGTTIN else max(1, self.target - 1)
+        if self.max_workers is not None and target > self.max_workers:
+            logger.warning("Not scaling past %d workers", self.max_workers)
+            return
+        self.target = target
+        logger.info("Scaling to %d workers", self.target)
+
+    def _scale(self):
+        while len(self.workers) > self.target:
+            pid = max(self.workers, key=self.workers.get)
+            os.kill(pid, signal.SIGTERM)
+            # Forgotten here; _reap skips unknown pids once it exits
+            del self.workers[pid]
+        while len(self.workers) < self.target and time.monotonic() >= self.respawn_at:
+            self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._serve()
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def _serve(self):
+        """Worker body: a single-process uvicorn server on the inherited socket."""
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, signal.SIG_DFL)
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            access_log=False,
+            log_level=self.log_level,
+            timeout_graceful_shutdown=int(self.graceful_timeout),
+        )
+        server = uvicorn.Server(config)
+        # Installs its own SIGTERM/SIGINT handlers: stop accepting, drain, run shutdown hooks
+        server.run(sockets=[self.sock])
+        # uvicorn returns without raising when the startup hook fails
+        return 0 if server.started else 3
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            forked_at = self.workers.pop(pid, None)
+            if forked_at is None or self.stopping:
+                continue
+            uptime = time.monotonic() - forked_at
+            logger.warning("Worker %d exited with code %d after %.1fs", pid, os.waitstatus_to_exitcode(status), uptime)
+            if uptime < MIN_WORKER_UPTIME:
+                self.failures += 1
+                delay = min(MAX_RESPAWN_DELAY, 2 ** (self.failures - 1))
+                self.respawn_at = time.monotonic() + delay
+                logger.warning("%d workers in a row exited within %.0fs of starting; respawning in %.0fs", self.failures, MIN_WORKER_UPTIME, delay)
+            else:
+                self.failures = 0
+
+    def _stop_workers(self):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(POLL_INTERVAL)
+        for pid in self.workers:
+            logger.warning("Worker %d did not stop in time; killing it", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.sock.close()
+
+
+def serve(app, host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY, log_level="info", max_workers=None):
+    """
+    Run `app` in a preforked pool of worker_count(workers) processes until
+    SIGTERM/SIGINT, never more than max_workers (e.g. 1 for an app that keeps
+    state in-process).
+    """
+    count = worker_count(workers)
+    if max_workers is not None and count > max_workers:
+        logger.warning("Running %d workers instead of %d: the app supports at most %d", max_workers, count, max_workers)
+        count = max_workers
+    Arbiter(app, bind(host, port), count, log_level=log_level, max_workers=max_workers).run()
@@ -0,0 +1,430 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# Where the embedded ranking backend keeps its snapshot ("" disables snapshots)
+RANK_SNAPSHOT_PATH = os.getenv("RANK_SNAPSHOT_PATH", "")
+RANK_SNAPSHOT_INTERVAL = float(os.getenv("RANK_SNAPSHOT_INTERVAL", "60"))
+# Highest user_id the engine accepts; the score array is indexed by user_id, so
+# this caps its size (8 bytes per id: 80MB at the default)
+RANK_MAX_USER_ID = int(os.getenv("RANK_MAX_USER_ID", "10000000"))
+
+SNAPSHOT_MAGIC = b"LBRANK02"
+# magic, user capacity, ranked users
+SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+
+SNAPSHOT_SECONDS = histogram("rank_snapshot_seconds", "Time to write an embedded ranking snapshot", ("stage",), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+ABSENT = -1
+
+# Entries are packed as score << 32 | user_id, so one int64 orders by score,
+# then user_id. Scores are capped at the int4 range the database stores.
+USER_BITS = 32
+USER_MASK = (1 << USER_BITS) - 1
+MAX_SCORE = 2**31 - 1
+# Entries per block; a block is split when it doubles and merged into its
+# neighbour when it falls under a quarter of this
+BLOCK_SIZE = 1024
+
+
+class RankEngine:
+    """
+    Order-statistic index of user scores in flat arrays.
+
+    - `scores[user_id]` is the user's score, or -1 if absent (8 bytes per id;
+      user ids are the dense SERIAL ids of the users table).
+    - `blocks` is every ranked user's (score, user_id) entry in ascending
+      order, split into arrays of BLOCK_SIZE to 2 * BLOCK_SIZE entries (8 bytes
+      per user); `maxes` holds each block's last entry for bisecting.
+    - `index` is a Fenwick tree over block lengths, so the position of an
+      entry and the entry at a position are O(log n) whatever the scores are.
+
+    Positions are 0-based from the top; ties are ordered by user_id
+    descending. About 16 bytes per user, against well over 100 for a dict of
+    user_id -> score. Scores must be between 0 and MAX_SCORE and user ids at
+    most `max_user_id`; set() raises ValueError otherwise, before allocating
+    anything.
+    """
+
+    def __init__(self, user_capacity=1024, max_user_id=RANK_MAX_USER_ID):
+        if max_user_id > USER_MASK:
+            raise ValueError(f"max_user_id must be at most {USER_MASK}")
+        self.max_user_id = max_user_id
+        self.scores = array("q", [ABSENT]) * min(user_capacity, max_user_id + 1)
+        self.blocks = []
+        self.maxes = []
+        self.index = array("q", [0])
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def memory_bytes(self):
+        entries = sum(block.buffer_info()[1] * block.itemsize for block in self.blocks)
+        return (
+            len(self.scores) * self.scores.itemsize
+            + entries
+            + len(self.index) * self.index.itemsize
+            + len(self.maxes) * 40
+        )
+
+    # Fenwick tree over block lengths; index i counts the entries of block i - 1
+
+    def _reindex(self):
+        size = len(self.blocks)
+        tree = array("q", [0]) * (size + 1)
+        for i, block in enumerate(self.blocks, start=1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self.index = tree
+
+    def _add(self, block, delta):
+        tree = self.index
+        size = len(tree) - 1
+        i = block + 1
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+    def _before(self, block):
+        """Entries in the blocks before `block`."""
+        tree = self.index
+        i = block
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, offset):
+        """(block, offset within it) of the entry at ascending `offset`."""
+        tree = self.index
+        size = len(tree) - 1
+        block = 0
+        step = _power_of_two(size + 1) >> 1
+        while step:
+            if block + step <= size and tree[block + step] <= offset:
+                block += step
+                offset -= tree[block]
+            step >>= 1
+        return block, offset
+
+    # Sorted blocks
+
+    def _insert(self, key):
+        if not self.blocks:
+            self.blocks.append(array("q", [key]))
+            self.maxes.append(key)
+            self._reindex()
+            return
+        b = min(bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[b]
+        insort(block, key)
+        self.maxes[b] = block[-1]
+        if len(block) > 2 * BLOCK_SIZE:
+            self.blocks[b:b + 1] = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self.maxes[b:b + 1] = [self.blocks[b][-1], block[-1]]
+            self._reindex()
+        else:
+            self._add(b, 1)
+
+    def _discard(self, key):
+        b = bisect_left(self.maxes, key)
+        block = self.blocks[b]
+        del block[bisect_left(block, key)]
+        if len(block) >= BLOCK_SIZE // 4 or (len(self.blocks) == 1 and block):
+            self.maxes[b] = block[-1]
+            self._add(b, -1)
+            return
+        # Fold a small block into its neighbour (and split again if that overfills it)
+        del self.blocks[b], self.maxes[b]
+        if self.blocks:
+            n = min(b, len(self.blocks) - 1)
+            merged = self.blocks[n] + block if n < b else block + self.blocks[n]
+            half = len(merged) // 2
+            parts = [merged[:half], merged[half:]] if len(merged) > 2 * BLOCK_SIZE else [merged]
+            self.blocks[n:n + 1] = parts
+            self.maxes[n:n + 1] = [part[-1] for part in parts]
+        self._reindex()
+
+    # Point updates
+
+    def score(self, user_id):
+        if 0 <= user_id < len(self.scores) and self.scores[user_id] != ABSENT:
+            return self.scores[user_id]
+        return None
+
+    def set(self, user_id, score):
+        if not 0 <= user_id <= self.max_user_id:
+            raise ValueError(f"user_id must be between 0 and {self.max_user_id}")
+        if not 0 <= score <= MAX_SCORE:
+            raise ValueError(f"score must be between 0 and {MAX_SCORE}")
+        if user_id >= len(self.scores):
+            self._grow_users(user_id)
+        old = self.scores[user_id]
+        if old == score:
+            return
+        if old == ABSENT:
+            self.count += 1
+        else:
+            self._discard(old << USER_BITS | user_id)
+        self._insert(score << USER_BITS | user_id)
+        self.scores[user_id] = score
+
+    def remove(self, user_id):
+        old = self.score(user_id)
+        if old is None:
+            return
+        self._discard(old << USER_BITS | user_id)
+        self.scores[user_id] = ABSENT
+        self.count -= 1
+
+    def incr(self, user_id, delta):
+        current = self.score(user_id)
+        self.set(user_id, (current or 0) + delta)
+
+    def add_gt(self, user_id, score):
+        """Set the score unless the user already has a higher one."""
+        current = self.score(user_id)
+        if current is None or score > current:
+            self.set(user_id, score)
+
+    def _grow_users(self, user_id):
+        capacity = max(1, len(self.scores))
+        while capacity <= user_id:
+            capacity *= 2
+        capacity = min(capacity, self.max_user_id + 1)
+        self.scores.extend(array("q", [ABSENT]) * (capacity - len(self.scores)))
+
+    # Order statistics
+
+    def position(self, user_id):
+        """0-based position from the top, or None if absent."""
+        score = self.score(user_id)
+        if score is None:
+            return None
+        key = score << USER_BITS | user_id
+        b = bisect_left(self.maxes, key)
+        return self.count - 1 - self._before(b) - bisect_left(self.blocks[b], key)
+
+    def top(self, start, stop):
+        """[(user_id, score)] for positions start..stop inclusive."""
+        stop = min(stop, self.count - 1)
+        if start > stop:
+            return []
+        b, i = self._locate(self.count - 1 - start)
+        rows = []
+        wanted = stop - start + 1
+        while True:
+            block = self.blocks[b]
+            rows.extend(
+                (key & USER_MASK, key >> USER_BITS)
+                for key in reversed(block[max(0, i + 1 - (wanted - len(rows))):i + 1])
+            )
+            if len(rows) == wanted:
+                return rows
+            b -= 1
+            i = len(self.blocks[b]) - 1
+
+    def entries(self):
+        """Every (user_id, score), one block at a time."""
+        for block in list(self.blocks):
+            yield [(key & USER_MASK, key >> USER_BITS) for key in block]
+
+    # Snapshots
+
+    def write_snapshot(self, path):
+        """
+        Write the engine to `path` atomically. The arrays are copied in one
+        synchronous step, so the snapshot is consistent; the returned callable
+        does the file I/O and can run in a thread.
+        """
+        keys = array("q")
+        for block in self.blocks:
+            keys.extend(block)
+        scores = self.scores[:]
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(scores), len(keys))
+
+        def write():
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(header)
+                scores.tofile(f)
+                keys.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+
+        return write
+
+    @classmethod
+    def read_snapshot(cls, path):
+        """Engine restored from a snapshot file, read through a memory map."""
+        engine = cls(user_capacity=1)
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, user_capacity, ranked = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a ranking snapshot")
+            offset = SNAPSHOT_HEADER.size
+
+            def take(length):
+                nonlocal offset
+                part = array("q")
+                end = offset + length * part.itemsize
+                with memoryview(mapped)[offset:end] as view:
+                    part.frombytes(view)
+                offset = end
+                return part
+
+            engine.scores = take(user_capacity)
+            keys = take(ranked)
+        engine.blocks = [keys[i:i + BLOCK_SIZE] for i in range(0, ranked, BLOCK_SIZE)]
+        engine.maxes = [block[-1] for block in engine.blocks]
+        engine.count = ranked
+        engine._reindex()
+        return engine
+
+
+def _power_of_two(n):
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+class EmbeddedScoreboard:
+    """
+    The global leaderboard held in this process by a RankEngine, with the
+    same interface as the Redis scoreboards in app/scoreboard.py.
+
+    It is per-process: every submission must reach the process that serves
+    ranks, so run a single worker. It replaces only the global sorted set:
+    Redis is still required for mode/window boards, the warm-up lock, rate
+    limits, submission dedup and cache invalidation. The board is filled from Postgres by the
+    cache warmer (`synced`); a snapshot written every RANK_SNAPSHOT_INTERVAL
+    lets a restarted process serve immediately from the snapshot (`ready`)
+    while that load catches it up.
+    """
+
+    sharded = False
+    # Not stored under GLOBAL_KEY on the primary Redis; submit paths call incr_many
+    on_primary = False
+    # Loaded per process rather than once into shared storage
+    local = True
+
+    def __init__(self, snapshot_path=RANK_SNAPSHOT_PATH, snapshot_interval=RANK_SNAPSHOT_INTERVAL):
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.engine = RankEngine()
+        self.ready = False
+        self.synced = False
+        self._task = None
+
+    async def start(self):
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            start = time.perf_counter()
+            try:
+                self.engine = await asyncio.to_thread(RankEngine.read_snapshot, self.snapshot_path)
+                self.ready = True
+                logger.info("Restored %d ranked users from %s in %.2fs", len(self.engine), self.snapshot_path, time.perf_counter() - start)
+            except Exception:
+                logger.exception("Could not restore ranking snapshot %s; loading from Postgres", self.snapshot_path)
+        if self.snapshot_path:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self.synced:
+                await self.snapshot()
+
+    def mark_synced(self):
+        self.ready = self.synced = True
+
+    async def snapshot(self):
+        start = time.perf_counter()
+        write = self.engine.write_snapshot(self.snapshot_path)
+        SNAPSHOT_SECONDS.observe(time.perf_counter() - start, "copy")
+        start = time.perf_counter()
+        await asyncio.to_thread(write)
+        SNAPSHOT_SECONDS.observe(time.perf_counter() - start, "write")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            # A partial load would overwrite a complete snapshot with fewer users
+            if not self.synced:
+                continue
+            try:
+                await self.snapshot()
+            except Exception:
+                logger.exception("Ranking snapshot failed")
+
+    async def incr_many(self, totals):
+        for uid, delta in totals.items():
+            self.engine.incr(uid, delta)
+
+    async def add_many(self, scores):
+        for i, (uid, score) in enumerate(scores.items(), start=1):
+            self.engine.add_gt(uid, score)
+            # Warm-up chunks are large; let requests run in between
+            if i % 2000 == 0:
+                await asyncio.sleep(0)
+
+    async def scores(self, user_ids):
+        return [self.engine.score(uid) for uid in user_ids]
+
+    async def compare_and_set(self, changes):
+        changed = 0
+        for uid, (expected, new) in changes.items():
+            if self.engine.score(uid) == expected:
+                if new is None:
+                    self.engine.remove(uid)
+                else:
+                    self.engine.set(uid, new)
+                changed += 1
+        return changed
+
+    async def scan(self, count):
+        chunk = []
+        for rows in self.engine.entries():
+            chunk.extend(rows)
+            if len(chunk) >= count:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def top(self, start, stop, after=None):
+        return self.engine.top(start, stop)
+
+    async def ranks(self, user_ids):
+        out = []
+        for uid in user_ids:
+            position = self.engine.position(uid)
+            out.append(None if position is None else (position + 1, self.engine.score(uid)))
+        return out
+
+    async def around(self, user_id, radius):
+        position = self.engine.position(user_id)
+        if position is None:
+            return None
+        start = max(0, position - radius)
+        return [(start + i + 1, uid, score) for i, (uid, score) in enumerate(self.engine.top(start, position + radius))]
+
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import time
+
+from redis.exceptions import RedisError
+from sqlalchemy import text
+
+from .cache import get_client
+from .database import engine
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# Width of a score bucket in leaderboard_score_buckets
+SCORE_BUCKET_WIDTH = int(os.getenv("SCORE_BUCKET_WIDTH", "100"))
+RANK_REFRESH_INTERVAL = float(os.getenv("RANK_REFRESH_INTERVAL", "300"))
+
+# leaderboard_score_buckets mirrored in Redis (bucket -> users), kept current
+# between refreshes by the submit paths (app/stats.py)
+HISTOGRAM_KEY = "leaderboard:score_histogram"
+# Present once the hash was seeded from leaderboard_score_buckets
+HISTOGRAM_LOADED_FIELD = "loaded"
+
+# Arbitrary constant identifying the rank job for pg_try_advisory_xact_lock
+RANK_JOB_LOCK_ID = 7310001
+
+REFRESH_SECONDS = histogram("rank_refresh_seconds", "Time to rebuild the score histogram", buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 300))
+
+REBUILD_BUCKETS_SQL = text("""
+    INSERT INTO leaderboard_score_buckets (bucket, user_count)
+    SELECT total_score / :width, COUNT(*) FROM leaderboard GROUP BY 1
+    RETURNING bucket, user_count
+""")
+
+# Rank = users in higher buckets (from the histogram) + users above the target
+# within its own bucket (a bounded range scan on idx_leaderboard_total_score).
+# The histogram is up to RANK_REFRESH_INTERVAL old, so such a rank is approximate;
+# until the histogram has been built once it is the exact COUNT(*) instead.
+# leaderboard.rank is not maintained and never read.
+DB_RANK_SQL = text("""
+    SELECT t.user_id, t.total_score,
+    CASE WHEN EXISTS (SELECT 1 FROM leaderboard_score_buckets) THEN
+        1 + COALESCE((SELECT SUM(b.user_count) FROM leaderboard_score_buckets b
+                      WHERE b.bucket > t.total_score / :width), 0)
+          + (SELECT COUNT(*) FROM leaderboard l
+             WHERE l.total_score > t.total_score AND l.total_score < (t.total_score / :width + 1) * :width)
+    ELSE
+        (SELECT COUNT(*) + 1 FROM leaderboard l WHERE l.total_score > t.total_score)
+    END AS rank,
+    EXISTS (SELECT 1 FROM leaderboard_score_buckets) AS approximate
+    FROM leaderboard t
+    WHERE t.user_id = ANY(:uids)
+""")
+
+
+async def fetch_db_ranks(db, user_ids):
+    """
+    Rank and score for each user id from Postgres: ({user_id: (rank, total_score)}, approximate).
+
+    `approximate` is True when the ranks came from the score histogram, whose
+    higher buckets may be off by whatever changed since the last refresh.
+    """
+    rows = (await db.execute(DB_RANK_SQL, {"uids": list(user_ids), "width": SCORE_BUCKET_WIDTH})).all()
+    return {row.user_id: (int(row.rank), row.total_score) for row in rows}, any(row.approximate for row in rows)
+
+
+async def refresh_ranks():
+    """
+    Rebuild the score histogram, then replace the Redis copy of it.
+
+    Only reads leaderboard (one aggregate scan), so submit upserts are never
+    blocked by it. Returns False without doing anything if another worker is
+    already running it.
+    """
+    async with engine.begin() as conn:
+        locked = await conn.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": RANK_JOB_LOCK_ID})
+        if not locked:
+            return False
+        start = time.perf_counter()
+        await conn.execute(text("DELETE FROM leaderboard_score_buckets"))
+        buckets = (await conn.execute(REBUILD_BUCKETS_SQL, {"width": SCORE_BUCKET_WIDTH})).all()
+    try:
+        await publish_histogram(buckets)
+    except RedisError:
+        logger.warning("Could not publish the score histogram to Redis", exc_info=True)
+    refresh_time = time.perf_counter() - start
+    logger.info("Rebuilt %d score buckets in %.1fs", len(buckets), refresh_time)
+    REFRESH_SECONDS.observe(refresh_time)
+    return True
+
+
+async def publish_histogram(buckets):
+    """
+    Replace the Redis histogram with rebuilt (bucket, user_count) rows.
+
+    Increments applied by submits between the rebuild and this write may be
+    lost or counted twice; the next refresh corrects them.
+    """
+    async with get_client().pipeline(transaction=True) as pipe:
+        pipe.delete(HISTOGRAM_KEY)
+        pipe.hset(HISTOGRAM_KEY, mapping={HISTOGRAM_LOADED_FIELD: 1, **{str(b.bucket): b.user_count for b in buckets}})
+        await pipe.execute()
+
+
+class RankMaintainer:
+    """Background task that runs refresh_ranks every RANK_REFRESH_INTERVAL seconds."""
+
+    def __init__(self, interval=RANK_REFRESH_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await refresh_ranks()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Rank refresh failed")
+            await asyncio.sleep(self.interval)
+
+
+rank_maintainer = RankMaintainer()
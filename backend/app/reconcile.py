@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from sqlalchemy import text
+
+from .cache import get_client
+from .database import engine
+from .metrics import counter, histogram
+from .scoreboard import scoreboard
+from .warmup import is_cache_ready
+from .write_behind import SUBMIT_MODE, stream_stats
+
+logger = logging.getLogger(__name__)
+
+# leaderboard rows compared per chunk (one keyset query + one ZMSCORE batch)
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "1000"))
+# Upper bound on the scan rate; 1M users take ~200s at the default
+RECONCILE_ROWS_PER_SECOND = float(os.getenv("RECONCILE_ROWS_PER_SECOND", "5000"))
+# Pause between full passes
+RECONCILE_PASS_INTERVAL = float(os.getenv("RECONCILE_PASS_INTERVAL", "600"))
+# Mismatches are re-checked after this long and repaired only if neither side moved,
+# so submissions between their Postgres commit and Redis update are not "repaired"
+RECONCILE_GRACE_SECONDS = float(os.getenv("RECONCILE_GRACE_SECONDS", "5"))
+
+# Only one worker scans at a time; the holder refreshes the lock every chunk
+LOCK_KEY = "leaderboard:reconcile:lock"
+LOCK_TTL = 60
+# Last user_id compared, so a restarted worker resumes the pass
+CURSOR_KEY = "leaderboard:reconcile:cursor"
+
+CHUNK_SQL = text("""
+    SELECT user_id, total_score FROM leaderboard
+    WHERE user_id > :after
+    ORDER BY user_id
+    LIMIT :limit
+""")
+SCORES_SQL = text("SELECT user_id, total_score FROM leaderboard WHERE user_id = ANY(:uids)")
+
+ROWS_SCANNED = counter("reconcile_rows_scanned_total", "leaderboard rows compared against Redis")
+MEMBERS_SCANNED = counter("reconcile_members_scanned_total", "Redis members checked for a leaderboard row")
+DRIFT = counter("reconcile_drift_total", "Users whose Redis score still differed from Postgres after the grace period", ("kind",))
+REPAIRED = counter("reconcile_repaired_total", "Drifted Redis scores overwritten with the Postgres value")
+CHUNK_SECONDS = histogram("reconcile_chunk_seconds", "Time to compare one chunk, excluding rate-limit sleeps")
+
+
+class Reconciler:
+    """
+    Background task that continuously compares leaderboard against the global
+    Redis board and repairs drift, e.g. from a crash between a batch's
+    Postgres commit and its ZINCRBY pipeline.
+
+    Rows are scanned in user_id order with keyset pagination and compared with
+    ZMSCORE per chunk; then the board itself is scanned for members with no
+    leaderboard row. A mismatch is re-read from both sides after
+    RECONCILE_GRACE_SECONDS; if neither value moved, Redis is set to the
+    Postgres value (or the member removed) with a compare-and-set script, so a
+    concurrent increment is never overwritten. The scan sleeps as needed to
+    stay under RECONCILE_ROWS_PER_SECOND.
+    """
+
+    def __init__(self, chunk_size=RECONCILE_CHUNK_SIZE, rows_per_second=RECONCILE_ROWS_PER_SECOND,
+                 pass_interval=RECONCILE_PASS_INTERVAL, grace=RECONCILE_GRACE_SECONDS):
+        self.chunk_size = chunk_size
+        self.rows_per_second = rows_per_second
+        self.pass_interval = pass_interval
+        self.grace = grace
+        self.token = uuid.uuid4().hex
+        self.passes = 0
+        self.last_pass_seconds = None
+        self.last_pass_drift = None
+        self._task = None
+
+    def stats(self):
+        return {
+            "passes": self.passes,
+            "rows_scanned": sum(ROWS_SCANNED.snapshot().values()),
+            "members_scanned": sum(MEMBERS_SCANNED.snapshot().values()),
+            "drift": {labels[0]: value for labels, value in DRIFT.snapshot().items()},
+            "repaired": sum(REPAIRED.snapshot().values()),
+            "last_pass_seconds": self.last_pass_seconds,
+            "last_pass_drift": self.last_pass_drift,
+        }
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _hold_lock(self, redis):
+        """Take or extend the scan lock. False if another worker holds it."""
+        if await redis.set(LOCK_KEY, self.token, nx=True, ex=LOCK_TTL):
+            return True
+        if await redis.get(LOCK_KEY) == self.token:
+            await redis.expire(LOCK_KEY, LOCK_TTL)
+            return True
+        return False
+
+    async def _writes_settled(self):
+        """In write-behind mode Redis legitimately runs ahead of Postgres until the stream is drained."""
+        if SUBMIT_MODE != "write_behind":
+            return True
+        stats = await stream_stats()
+        return not stats.get("lag") and not stats.get("pending")
+
+    async def reconcile_chunk(self, rows):
+        """Compare one chunk of (user_id, total_score) rows; returns the number of drifted users."""
+        user_ids = [row.user_id for row in rows]
+        suspects = {
+            uid: (db_score, cached)
+            for uid, db_score, cached in zip(user_ids, [row.total_score for row in rows], await scoreboard.scores(user_ids))
+            if cached != db_score
+        }
+        return await self.repair(suspects)
+
+    async def reconcile_members(self, members):
+        """Check one chunk of (user_id, score) read from Redis for users with no leaderboard row; returns the number drifted."""
+        async with engine.connect() as conn:
+            present = {row.user_id for row in await conn.execute(SCORES_SQL, {"uids": [uid for uid, _ in members]})}
+        return await self.repair({uid: (None, cached) for uid, cached in members if uid not in present})
+
+    async def repair(self, suspects):
+        """
+        Re-check {user_id: (postgres_score_or_None, redis_score_or_None)} after
+        the grace period and set Redis to the Postgres value where neither
+        moved. Returns the number of drifted users.
+        """
+        if not suspects:
+            return 0
+
+        await asyncio.sleep(self.grace)
+        if not await self._writes_settled():
+            return 0
+        async with engine.connect() as conn:
+            current = {row.user_id: row.total_score for row in await conn.execute(SCORES_SQL, {"uids": list(suspects)})}
+        cached_now = dict(zip(suspects, await scoreboard.scores(list(suspects))))
+
+        changes = {}
+        for uid, (db_score, cached) in suspects.items():
+            # Anything that moved is an in-flight write; the next pass will look again
+            if current.get(uid) == db_score and cached_now[uid] == cached:
+                changes[uid] = (cached, db_score)
+                DRIFT.inc("missing" if cached is None else "extra" if db_score is None else "mismatch")
+        if changes:
+            REPAIRED.inc(amount=await scoreboard.compare_and_set(changes))
+            logger.warning("Reconciler repaired %d drifted Redis scores", len(changes))
+        return len(changes)
+
+    async def run_pass(self):
+        """One full scan of leaderboard, then of the board. Returns False if another worker holds the lock."""
+        redis = get_client()
+        if not await self._hold_lock(redis):
+            return False
+        started = time.perf_counter()
+        drift = 0
+        after = int(await redis.get(CURSOR_KEY) or 0)
+        while True:
+            chunk_start = time.perf_counter()
+            async with engine.connect() as conn:
+                rows = (await conn.execute(CHUNK_SQL, {"after": after, "limit": self.chunk_size})).all()
+            if not rows:
+                break
+            drift += await self.reconcile_chunk(rows)
+            ROWS_SCANNED.inc(amount=len(rows))
+            after = rows[-1].user_id
+            await redis.set(CURSOR_KEY, after)
+            elapsed = time.perf_counter() - chunk_start
+            CHUNK_SECONDS.observe(elapsed)
+
+            # Rate limit: spread chunks so the scan never exceeds rows_per_second
+            await asyncio.sleep(max(0.0, len(rows) / self.rows_per_second - elapsed))
+            if not await self._hold_lock(redis):
+                return False
+
+        # Members in Redis with no leaderboard row, which the scan above cannot see.
+        # Not resumable: an interrupted pass starts this part over.
+        chunk_start = time.perf_counter()
+        async for members in scoreboard.scan(self.chunk_size):
+            drift += await self.reconcile_members(members)
+            MEMBERS_SCANNED.inc(amount=len(members))
+            elapsed = time.perf_counter() - chunk_start
+            CHUNK_SECONDS.observe(elapsed)
+            await asyncio.sleep(max(0.0, len(members) / self.rows_per_second - elapsed))
+            if not await self._hold_lock(redis):
+                return False
+            chunk_start = time.perf_counter()
+
+        await redis.delete(CURSOR_KEY)
+        self.passes += 1
+        self.last_pass_seconds = time.perf_counter() - started
+        self.last_pass_drift = drift
+        logger.info("Reconcile pass finished in %.1fs with %d drifted users", self.last_pass_seconds, drift)
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                # A partially loaded board is the warm-up's job, not drift
+                if await is_cache_ready(get_client()):
+                    await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reconcile pass failed")
+            await asyncio.sleep(self.pass_interval)
+
+
+reconciler = Reconciler()
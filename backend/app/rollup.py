@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import text
+
+from .database import engine
+from .metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# How often game_sessions rows past the watermark are folded into leaderboard_rollup
+LEADERBOARD_ROLLUP_INTERVAL = float(os.getenv("LEADERBOARD_ROLLUP_INTERVAL", "300"))
+# Upper bound on the game_sessions id range aggregated per transaction
+LEADERBOARD_ROLLUP_MAX_ROWS = int(os.getenv("LEADERBOARD_ROLLUP_MAX_ROWS", "5000000"))
+# How long to wait for writers that were in flight when the new watermark was read
+SETTLE_TIMEOUT = 30
+
+# Arbitrary constant identifying the roll-up job for pg_try_advisory_xact_lock
+ROLLUP_JOB_LOCK_ID = 7310002
+WATERMARK_NAME = "leaderboard"
+
+# The newest session id, and the xid horizon of the snapshot that saw it:
+# once every transaction below that horizon has ended, no row with a smaller
+# id can still appear.
+HORIZON_SQL = text("""
+    SELECT CAST(pg_snapshot_xmax(pg_current_snapshot()) AS text) AS xmax,
+           (SELECT COALESCE(MAX(id), 0) FROM game_sessions) AS max_id
+""")
+SETTLED_SQL = text("SELECT pg_snapshot_xmin(pg_current_snapshot()) >= CAST(:xmax AS xid8)")
+
+WATERMARK_SQL = text("""
+    SELECT last_session_id FROM leaderboard_rollup_watermark WHERE name = :name FOR UPDATE
+""")
+SET_WATERMARK_SQL = text("""
+    INSERT INTO leaderboard_rollup_watermark (name, last_session_id, updated_at)
+    VALUES (:name, :id, now())
+    ON CONFLICT (name) DO UPDATE SET last_session_id = EXCLUDED.last_session_id, updated_at = EXCLUDED.updated_at
+""")
+ADVANCE_SQL = text("""
+    INSERT INTO leaderboard_rollup (user_id, total_score)
+    SELECT user_id, SUM(score) FROM game_sessions
+    WHERE id > :after AND id <= :upto
+    GROUP BY user_id
+    ON CONFLICT (user_id)
+    DO UPDATE SET total_score = leaderboard_rollup.total_score + EXCLUDED.total_score
+""")
+# leaderboard = checkpointed totals + sessions past the watermark. Only rows
+# whose total actually differs are rewritten.
+REBUILD_SQL = text("""
+    INSERT INTO leaderboard (user_id, total_score, rank)
+    SELECT user_id, SUM(total_score), 0 FROM (
+        SELECT user_id, total_score FROM leaderboard_rollup
+        UNION ALL
+        SELECT user_id, score FROM game_sessions WHERE id > :after
+    ) AS totals
+    GROUP BY user_id
+    ON CONFLICT (user_id)
+    DO UPDATE SET total_score = EXCLUDED.total_score
+    WHERE leaderboard.total_score IS DISTINCT FROM EXCLUDED.total_score
+""")
+
+ROLLUP_ROWS = counter("rollup_sessions_total", "game_sessions ids folded into leaderboard_rollup")
+ROLLUP_SECONDS = histogram("rollup_advance_seconds", "Time to advance the leaderboard_rollup watermark", buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 300))
+
+
+async def settled_session_id():
+    """
+    Highest game_sessions.id below which every row is committed (or rolled
+    back), or None if writers did not finish within SETTLE_TIMEOUT. Ids are
+    allocated before commit, so MAX(id) alone can skip a slower transaction.
+    """
+    async with engine.connect() as conn:
+        row = (await conn.execute(HORIZON_SQL)).one()
+        await conn.commit()
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while True:
+            settled = await conn.scalar(SETTLED_SQL, {"xmax": row.xmax})
+            await conn.commit()
+            if settled:
+                return row.max_id
+            if time.monotonic() > deadline:
+                return None
+            await asyncio.sleep(0.1)
+
+
+async def get_watermark(conn):
+    return await conn.scalar(WATERMARK_SQL, {"name": WATERMARK_NAME}) or 0
+
+
+async def advance_rollup():
+    """
+    Fold settled game_sessions rows past the watermark into leaderboard_rollup,
+    LEADERBOARD_ROLLUP_MAX_ROWS ids per transaction. Returns the new watermark,
+    or None if another worker holds the job lock or writers did not settle.
+    """
+    upto = await settled_session_id()
+    if upto is None:
+        logger.warning("Roll-up skipped: in-flight writers did not finish within %ss", SETTLE_TIMEOUT)
+        return None
+    start = time.perf_counter()
+    while True:
+        async with engine.begin() as conn:
+            locked = await conn.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": ROLLUP_JOB_LOCK_ID})
+            if not locked:
+                return None
+            after = await get_watermark(conn)
+            if after >= upto:
+                break
+            step = min(upto, after + LEADERBOARD_ROLLUP_MAX_ROWS)
+            await conn.execute(ADVANCE_SQL, {"after": after, "upto": step})
+            await conn.execute(SET_WATERMARK_SQL, {"name": WATERMARK_NAME, "id": step})
+        ROLLUP_ROWS.inc(amount=step - after)
+        logger.info("Rolled game_sessions %d..%d into leaderboard_rollup", after + 1, step)
+    ROLLUP_SECONDS.observe(time.perf_counter() - start)
+    return upto
+
+
+async def rebuild_leaderboard():
+    """
+    Recompute leaderboard from leaderboard_rollup plus the sessions past the
+    watermark, without re-reading the full history. Returns the number of rows
+    whose total changed.
+
+    leaderboard is locked against writes for the duration. Submissions that
+    commit first are included in the new totals, and later ones add their
+    increments on top.
+    """
+    await advance_rollup()
+    async with engine.begin() as conn:
+        await conn.execute(text("LOCK TABLE leaderboard IN EXCLUSIVE MODE"))
+        after = await get_watermark(conn)
+        result = await conn.execute(REBUILD_SQL, {"after": after})
+    logger.info("Rebuilt leaderboard from roll-up at session %d (%d rows changed)", after, result.rowcount)
+    return result.rowcount
+
+
+class RollupMaintainer:
+    """Background task that advances the roll-up every LEADERBOARD_ROLLUP_INTERVAL seconds, keeping recovery cheap."""
+
+    def __init__(self, interval=LEADERBOARD_ROLLUP_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await advance_rollup()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Leaderboard roll-up failed")
+            await asyncio.sleep(self.interval)
+
+
+rollup_maintainer = RollupMaintainer()
@@ -0,0 +1,196 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from typing import Optional
+import hmac
+from ..schemas import (
+    BoardConfig, BoardCreate, BoardListResponse, BoardScoreCreate,
+    LeaderboardResponse, UserRank, RankBatchRequest, RankBatchResponse, AroundResponse,
+)
+from ..batcher import RejectedSubmission
+from ..boards import (
+    BOARD_ADMIN_TOKEN, BOARD_ID_RE, Board, board_batcher, board_registry, create_board, delete_board, ensure_loaded, list_boards,
+)
+from ..cache import get_redis, lookup_around, lookup_ranks
+from ..hot_cache import TOP_K, top_cache
+from ..encoding import VARY, encoded_response, negotiate
+from ..limits import READ_RATE_PER_IP, SUBMIT_RATE_PER_BOARD, SUBMIT_RATE_PER_IP, SUBMIT_RATE_PER_USER, client_ip, ranks_cost
+from .leaderboard import (
+    AROUND_RADIUS_MAX, CACHE_LOOKUPS, RANK_BATCH_MAX, STAGE_SECONDS, TOP_PAGE_MAX, TOP_STREAM_THRESHOLD,
+    decode_cursor, enforce_rate_limit, stream_top_page, top_page_response,
+)
+from redis.asyncio import Redis
+
+BOARD_PAGE_MAX = 1000
+
+router = APIRouter(
+    prefix="/api/boards",
+    tags=["boards"],
+)
+
+async def get_board(board_id: str):
+    """Configuration of the board in the path, from this worker's cache; 404 for unknown boards"""
+    board = await board_registry.get(board_id) if BOARD_ID_RE.match(board_id) else None
+    if board is None:
+        raise HTTPException(status_code=404, detail="Board not found")
+    return board
+
+async def require_admin(authorization: Optional[str] = Header(None)):
+    """Board creation and deletion need `Authorization: Bearer <BOARD_ADMIN_TOKEN>`; 403 while no token is configured"""
+    if not BOARD_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Board management is disabled")
+    if authorization is None or not hmac.compare_digest(authorization.encode(), f"Bearer {BOARD_ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin token", headers={"WWW-Authenticate": "Bearer"})
+
+async def get_board_key(redis: Redis, board: Board):
+    """Key of the board's sorted set, loaded from board_scores on first use"""
+    key = await ensure_loaded(redis, board)
+    if key is None:
+        raise HTTPException(status_code=503, detail="Board is being loaded, retry shortly", headers={"Retry-After": "1"})
+    return key
+
+@router.post("", response_model=BoardConfig, status_code=201, dependencies=[Depends(require_admin)])
+async def create(body: BoardCreate):
+    """Create a board. sort_order and aggregation are fixed for the board's lifetime"""
+    if not BOARD_ID_RE.match(body.board_id):
+        raise HTTPException(status_code=400, detail="board_id may only contain letters, digits, '-' and '_'")
+    board = await create_board(body.board_id, body.name, body.sort_order, body.aggregation)
+    if board is None:
+        raise HTTPException(status_code=409, detail="Board already exists")
+    return board.as_dict()
+
+@router.get("", response_model=BoardListResponse)
+async def get_boards(limit: int = Query(100, ge=1, le=BOARD_PAGE_MAX), cursor: Optional[str] = None):
+    """Boards ordered by board_id; pass the returned next_cursor as cursor for the next page"""
+    boards = await list_boards(cursor or "", limit)
+    return {
+        "boards": [board.as_dict() for board in boards],
+        "next_cursor": boards[-1].board_id if len(boards) == limit else None,
+    }
+
+@router.get("/{board_id}", response_model=BoardConfig)
+async def get_board_config(board: Board = Depends(get_board)):
+    return board.as_dict()
+
+@router.delete("/{board_id}", status_code=204, dependencies=[Depends(require_admin)])
+async def remove(board_id: str):
+    """Delete a board and all its scores"""
+    if not BOARD_ID_RE.match(board_id) or not await delete_board(board_id):
+        raise HTTPException(status_code=404, detail="Board not found")
+    return Response(status_code=204)
+
+@router.post("/{board_id}/submit")
+async def submit_board_score(item: BoardScoreCreate, request: Request, board: Board = Depends(get_board)):
+    # Per player, per client and per board, so one busy game cannot starve the others
+    await enforce_rate_limit("submit", [
+        (f"user:{item.user_id}", SUBMIT_RATE_PER_USER),
+        (f"ip:{client_ip(request)}", SUBMIT_RATE_PER_IP),
+        (f"board:{board.board_id}", SUBMIT_RATE_PER_BOARD),
+    ])
+    
+    try:
+        # Queued with every other board's submissions; returns once committed and applied to Redis
+        applied = await board_batcher.submit(board, item)
+        
+        if not applied:
+            return {"message": "Duplicate submission ignored", "duplicate": True}
+        return {"message": "Score submitted successfully", "duplicate": False}
+    except RejectedSubmission as e:
+        # Refused by Postgres on its own data; every other submission in its batch was applied
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{board_id}/top", response_model=LeaderboardResponse)
+async def get_board_top(
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(TOP_K, ge=1, le=TOP_PAGE_MAX),
+    cursor: Optional[str] = None,
+    board: Board = Depends(get_board),
+    redis: Redis = Depends(get_redis),
+):
+    if cursor:
+        # The cursor carries the rank of the last row served, i.e. the offset of the next page
+        offset = decode_cursor(cursor)[0]
+    
+    # Same per-worker first-page cache as /api/leaderboard/top, keyed by the board's sorted set
+    media_type = negotiate(request)
+    cacheable = offset == 0 and limit == TOP_K
+    if cacheable:
+        body = top_cache.get(board.key, media_type)
+        if body is not None:
+            CACHE_LOOKUPS.inc("board_top", "hot")
+            return Response(content=body, media_type=media_type, headers=VARY)
+    
+    key = await get_board_key(redis, board)
+    range_fn = redis.zrange if board.ascending else redis.zrevrange
+    
+    async def fetch(start, stop, after=None):
+        rows = await range_fn(key, start, stop, withscores=True)
+        return [(int(uid), int(score)) for uid, score in rows]
+    
+    CACHE_LOOKUPS.inc("board_top", "hit")
+    if limit > TOP_STREAM_THRESHOLD:
+        return stream_top_page(fetch, offset, limit)
+    with STAGE_SECONDS.time("board_top", "redis"):
+        rows = await fetch(offset, offset + limit - 1)
+    return top_page_response(rows, offset, limit, board.key if cacheable else None, media_type)
+
+@router.get("/{board_id}/rank/{user_id}", response_model=UserRank)
+async def get_board_rank(
+    user_id: int,
+    request: Request,
+    board: Board = Depends(get_board),
+    redis: Redis = Depends(get_redis),
+):
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)])
+    
+    key = await get_board_key(redis, board)
+    with STAGE_SECONDS.time("board_rank", "redis"):
+        [hit] = await lookup_ranks(redis, key, [user_id], ascending=board.ascending)
+    if hit is None:
+        raise HTTPException(status_code=404, detail="User has no score on this board")
+    rank, score = hit
+    return encoded_response({"user_id": user_id, "rank": rank, "total_score": score}, negotiate(request))
+
+@router.get("/{board_id}/around/{user_id}", response_model=AroundResponse)
+async def get_board_around(
+    user_id: int,
+    request: Request,
+    radius: int = Query(5, ge=0, le=AROUND_RADIUS_MAX),
+    board: Board = Depends(get_board),
+    redis: Redis = Depends(get_redis),
+):
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)])
+    
+    key = await get_board_key(redis, board)
+    with STAGE_SECONDS.time("board_around", "redis"):
+        rows = await lookup_around(redis, key, user_id, radius, ascending=board.ascending)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="User has no score on this board")
+    
+    return encoded_response({
+        "user_id": user_id,
+        "players": [{"user_id": uid, "total_score": total, "rank": rank} for rank, uid, total in rows],
+    }, negotiate(request))
+
+@router.post("/{board_id}/ranks", response_model=RankBatchResponse)
+async def get_board_ranks(
+    body: RankBatchRequest,
+    request: Request,
+    board: Board = Depends(get_board),
+    redis: Redis = Depends(get_redis),
+):
+    user_ids = list(dict.fromkeys(body.user_ids))
+    if len(user_ids) > RANK_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {RANK_BATCH_MAX} user_ids per request")
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)], ranks_cost(len(user_ids)))
+    
+    key = await get_board_key(redis, board)
+    with STAGE_SECONDS.time("board_ranks", "redis"):
+        hits = await lookup_ranks(redis, key, user_ids, ascending=board.ascending)
+    
+    found = {uid: hit for uid, hit in zip(user_ids, hits) if hit is not None}
+    return encoded_response({
+        "ranks": [{"user_id": uid, "rank": found[uid][0], "total_score": found[uid][1]} for uid in user_ids if uid in found],
+        "missing": [uid for uid in user_ids if uid not in found],
+    }, negotiate(request))
@@ -1,177 +1,623 @@
-from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional, Union
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
-from ..database import get_db, SessionLocal
-from ..models import User, GameSession, LeaderboardEntry
-from ..schemas import GameSessionCreate, LeaderboardResponse, UserRank
-from ..cache import get_redis
+from sqlalchemy import text
+from ..database import get_read_db
+from ..schemas import (
+    GameSessionCreate, LeaderboardResponse, UserRank, ApproxUserRank, RankBatchRequest, RankBatchResponse,
+    AroundResponse, HistoryResponse, StatsResponse,
+)
+from ..cache import get_redis, lookup_around, lookup_ranks
+from ..batcher import RejectedSubmission, submission_batcher
+from ..warmup import is_cache_ready
+from ..ranks import SCORE_BUCKET_WIDTH, fetch_db_ranks
+from ..write_behind import SUBMIT_MODE, write_behind_queue
+from ..windows import ALL_MODES, InvalidWindow, board_key, ensure_board, fetch_board_around, fetch_board_page
+from ..hot_cache import TOP_K, top_cache
+from ..live import top_broadcaster
+from ..scoreboard import scoreboard
+from ..stats import PERCENTILES, active_players, db_stats, score_distribution
+from ..metrics import counter, histogram
+from ..encoding import JSON_MEDIA_TYPE, VARY, dumps_json, encode, encoded_response, negotiate
+from ..limits import (
+    READ_RATE_PER_IP, SUBMIT_RATE_PER_IP, SUBMIT_RATE_PER_USER,
+    Overloaded, RateLimited, client_ip, db_admission, ranks_cost, rate_limiter,
+)
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from redis.asyncio import Redis
-import json
-import newrelic.agent
-import time
+from redis.exceptions import RedisError
+import math
+import os
+
+# Upper bound on user_ids per POST /ranks call
+RANK_BATCH_MAX = int(os.getenv("RANK_BATCH_MAX", "1000"))
+# Largest /top page; pages above TOP_STREAM_THRESHOLD are streamed in TOP_STREAM_CHUNK reads
+TOP_PAGE_MAX = int(os.getenv("TOP_PAGE_MAX", "10000"))
+TOP_STREAM_THRESHOLD = 1000
+TOP_STREAM_CHUNK = 1000
+# Deepest OFFSET the Postgres fallback accepts; deeper pages must use next_cursor
+DB_MAX_OFFSET = int(os.getenv("DB_MAX_OFFSET", "10000"))
+AROUND_RADIUS_MAX = 100
+HISTORY_PAGE_MAX = 200
+STATS_BINS_MAX = 200
+EPOCH = datetime(1970, 1, 1)
+
+# Time spent in Redis / Postgres by each endpoint; end-to-end latency is recorded by the HTTP middleware
+STAGE_SECONDS = histogram("leaderboard_stage_seconds", "Redis and Postgres time per endpoint", ("endpoint", "stage"))
+# result: hot (worker cache), hit (Redis), miss (Postgres fallback)
+CACHE_LOOKUPS = counter("leaderboard_cache_lookups_total", "Leaderboard reads by where they were answered", ("endpoint", "result"))
 
 router = APIRouter(
     prefix="/api/leaderboard",
     tags=["leaderboard"],
 )
 
+async def get_board_key(redis: Redis, mode: str, window: str, period: Optional[str]):
+    """Key of a per-mode/time-window board, rolled up from game_sessions on first use"""
+    try:
+        key = await ensure_board(redis, mode, window, period)
+    except InvalidWindow as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if key is None:
+        raise HTTPException(status_code=503, detail="Leaderboard is being rebuilt, retry shortly", headers={"Retry-After": "1"})
+    return key
+
+async def enforce_rate_limit(scope: str, limits: list, cost: int = 1):
+    """Charge the caller's token buckets; 429 with Retry-After once any is empty"""
+    try:
+        await rate_limiter.check(scope, limits, cost)
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+async def cache_ready(redis: Redis):
+    """is_cache_ready, with an unreachable Redis counted as not ready so reads take the Postgres fallback"""
+    try:
+        return await is_cache_ready(redis)
+    except RedisError:
+        return False
+
+@asynccontextmanager
+async def db_fallback_slot():
+    """Admission for a Postgres fallback read; 503 instead of queueing behind a saturated pool"""
+    try:
+        async with db_admission.slot():
+            yield
+    except Overloaded:
+        raise HTTPException(status_code=503, detail="Leaderboard database is busy, retry shortly", headers={"Retry-After": "1"})
+
+async def board_fallback(stage: str, fetch, *args):
+    """A mode/window board read summed from game_sessions while Redis is unreachable"""
+    CACHE_LOOKUPS.inc(stage, "miss")
+    async with db_fallback_slot():
+        with STAGE_SECONDS.time(stage, "db"):
+            return await fetch(*args)
+
+def encode_cursor(rank: int, score: int, user_id: int):
+    return f"{rank}:{score}:{user_id}"
+
+def decode_cursor(cursor: str):
+    """(rank, score, user_id) of the last row of the previous page"""
+    try:
+        rank, score, user_id = (int(part) for part in cursor.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return rank, score, user_id
+
+def encode_history_cursor(timestamp: datetime, session_id: int):
+    return f"{(timestamp - EPOCH) // timedelta(microseconds=1)}:{session_id}"
+
+def decode_history_cursor(cursor: str):
+    """(timestamp, id) of the last session of the previous page"""
+    try:
+        micros, session_id = (int(part) for part in cursor.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return EPOCH + timedelta(microseconds=micros), session_id
+
+def top_page_response(rows: list, offset: int, limit: int, cache_key: Optional[str] = None, media_type: str = JSON_MEDIA_TYPE):
+    """
+    Serialize a page of (user_id, score) rows once and return it as-is.
+    The first page is also kept in the worker's hot cache under cache_key.
+    """
+    result = [{"user_id": uid, "total_score": score, "rank": offset + i + 1} for i, (uid, score) in enumerate(rows)]
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(offset + len(rows), rows[-1][1], rows[-1][0])
+    body = encode({"top_players": result, "next_cursor": next_cursor}, media_type)
+    if cache_key is not None:
+        top_cache.put(cache_key, body, media_type)
+    return Response(content=body, media_type=media_type, headers=VARY)
+
+def stream_top_page(fetch, offset: int, limit: int, after: Optional[tuple] = None):
+    """
+    Stream a large page in TOP_STREAM_CHUNK-sized range reads, so memory and
+    time to first byte stay flat however deep or long the page is.
+    fetch(start, stop, after) returns (user_id, score) rows for 0-based ranks
+    start..stop; after is the (score, user_id) of the row at rank start-1 when
+    known (the cursor, then the last row streamed), for backends that seek.
+    Always JSON, which can be written before the row count is known.
+    """
+    async def body():
+        yield b'{"top_players":['
+        sent = 0
+        last = None
+        seek = after
+        while sent < limit:
+            count = min(TOP_STREAM_CHUNK, limit - sent)
+            rows = await fetch(offset + sent, offset + sent + count - 1, seek)
+            if rows:
+                # The chunk's rows without the enclosing brackets
+                chunk = dumps_json([
+                    {"user_id": uid, "total_score": score, "rank": offset + sent + i + 1}
+                    for i, (uid, score) in enumerate(rows)
+                ])[1:-1]
+                yield (b"," if sent else b"") + chunk
+                sent += len(rows)
+                last = rows[-1]
+                seek = (last[1], last[0])
+            if len(rows) < count:
+                break
+        next_cursor = encode_cursor(offset + sent, last[1], last[0]) if sent == limit else None
+        yield b'],"next_cursor":' + dumps_json(next_cursor) + b'}'
+    
+    return StreamingResponse(body(), media_type=JSON_MEDIA_TYPE)
+
 @router.post("/submit")
-@newrelic.agent.function_trace(name='submit_score', group='Leaderboard')
-async def submit_score(
-    item: GameSessionCreate, 
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    redis: Redis = Depends(get_redis)
-):
+async def submit_score(item: GameSessionCreate, request: Request):
+    if scoreboard.local and item.user_id > scoreboard.engine.max_user_id:
+        # The embedded engine's arrays are indexed by user_id; refuse before anything is written
+        raise HTTPException(status_code=422, detail=f"user_id above RANK_MAX_USER_ID ({scoreboard.engine.max_user_id})")
+    
+    # Per player and per client, checked before the submission is queued
+    await enforce_rate_limit("submit", [
+        (f"user:{item.user_id}", SUBMIT_RATE_PER_USER),
+        (f"ip:{client_ip(request)}", SUBMIT_RATE_PER_IP),
+    ])
+    
     try:
-        start_time = time.time()
-        
-        # Track custom event in New Relic
-        newrelic.agent.record_custom_event('ScoreSubmission', {
-            'user_id': item.user_id,
-            'score': item.score,
-            'game_mode': item.game_mode
-        })
-        
-        # 1. Insert Game Session (with timing)
-        db_start = time.time()
-        new_session = GameSession(user_id=item.user_id, score=item.score, game_mode=item.game_mode)
-        db.add(new_session)
-        
-        # 2. Update Leaderboard Table (Atomic increment/Insert)
-        stmt = text("""
-            INSERT INTO leaderboard (user_id, total_score, rank)
-            VALUES (:uid, :score, 0)
-            ON CONFLICT (user_id) 
-            DO UPDATE SET total_score = leaderboard.total_score + EXCLUDED.total_score
-        """)
-        await db.execute(stmt, {"uid": item.user_id, "score": item.score})
-        await db.commit()
-        
-        db_time = time.time() - db_start
-        newrelic.agent.record_custom_metric('Custom/Database/SubmitScore', db_time)
-        
-        # 3. Update Redis (Write-through/Write-back)
-        redis_start = time.time()
-        await redis.zincrby("leaderboard_scores", item.score, str(item.user_id))
-        redis_time = time.time() - redis_start
-        newrelic.agent.record_custom_metric('Custom/Redis/UpdateScore', redis_time)
-        
-        total_time = time.time() - start_time
-        newrelic.agent.record_custom_metric('Custom/Endpoint/SubmitScore/TotalTime', total_time)
+        if SUBMIT_MODE == "write_behind":
+            # Redis is primary: update the sorted set and append to the persist stream
+            applied = await write_behind_queue.submit(item)
+        else:
+            # Queue for the next micro-batch; returns once the batch is committed
+            # to Postgres (game_sessions + leaderboard) and applied to Redis.
+            applied = await submission_batcher.submit(item)
         
-        return {"message": "Score submitted successfully"}
+        if not applied:
+            # A retry of a submission_id that was already applied; succeed without counting it again
+            return {"message": "Duplicate submission ignored", "duplicate": True}
+        return {"message": "Score submitted successfully", "duplicate": False}
+    except RejectedSubmission as e:
+        # Refused by Postgres on its own data (e.g. unknown user_id); the rest of its batch was applied
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
-        await db.rollback()
-        
-        # Record error in New Relic
-        newrelic.agent.record_custom_event('ScoreSubmissionError', {
-            'user_id': item.user_id,
-            'error': str(e)
-        })
-        
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/top", response_model=LeaderboardResponse)
-@newrelic.agent.function_trace(name='get_top_users', group='Leaderboard')
-async def get_top_users(redis: Redis = Depends(get_redis), db: Session = Depends(get_db)):
-    start_time = time.time()
+async def get_top_users(
+    request: Request,
+    mode: str = ALL_MODES,
+    window: str = "all",
+    period: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(TOP_K, ge=1, le=TOP_PAGE_MAX),
+    cursor: Optional[str] = None,
+    redis: Redis = Depends(get_redis),
+    db: Session = Depends(get_read_db)
+):
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        # The cursor carries the rank of the last row served, i.e. the offset of the next page
+        offset = after[0]
+    
+    try:
+        cache_key = board_key(mode, window, period)
+    except InvalidWindow as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Try getting from Redis
-    redis_start = time.time()
-    top_users_raw = await redis.zrevrange("leaderboard_scores", 0, 9, withscores=True)
-    redis_time = time.time() - redis_start
-    newrelic.agent.record_custom_metric('Custom/Redis/GetTopUsers', redis_time)
+    # Serve this worker's pre-serialized copy of the first page while it is fresh (no Redis call, no validation)
+    media_type = negotiate(request)
+    cacheable = offset == 0 and limit == TOP_K
+    if cacheable:
+        body = top_cache.get(cache_key, media_type)
+        if body is not None:
+            CACHE_LOOKUPS.inc("top", "hot")
+            return Response(content=body, media_type=media_type, headers=VARY)
     
-    if top_users_raw:
+    if mode != ALL_MODES or window != "all":
+        # Per-mode / time-window board (e.g. lb:solo:week:2026-W42), served from Redis
+        try:
+            key = await get_board_key(redis, mode, window, period)
+            
+            async def fetch(start, stop, after=None):
+                rows = await redis.zrevrange(key, start, stop, withscores=True)
+                return [(int(uid), int(score)) for uid, score in rows]
+            
+            if limit > TOP_STREAM_THRESHOLD:
+                return stream_top_page(fetch, offset, limit)
+            with STAGE_SECONDS.time("top", "redis"):
+                rows = await fetch(offset, offset + limit - 1)
+        except RedisError:
+            # Redis unreachable - sum the board's window from game_sessions instead
+            rows = await board_fallback("top", fetch_board_page, db, mode, window, period, offset, limit)
+        return top_page_response(rows, offset, limit, cache_key if cacheable else None, media_type)
+    
+    # Sharded boards can only seek from a cursor; an offset page reads every shard from the top
+    if scoreboard.sharded and not after and offset > DB_MAX_OFFSET:
+        raise HTTPException(status_code=400, detail=f"Use next_cursor to page past offset {DB_MAX_OFFSET}")
+    seek = (after[1], after[2]) if after else None
+    
+    # Try getting from Redis (only once the full leaderboard is loaded)
+    top_users_raw = None
+    with STAGE_SECONDS.time("top", "redis"):
+        ready = await cache_ready(redis)
+        if ready:
+            if limit > TOP_STREAM_THRESHOLD:
+                return stream_top_page(scoreboard.top, offset, limit, seek)
+            try:
+                top_users_raw = await scoreboard.top(offset, offset + limit - 1, seek)
+            except RedisError:
+                ready = False
+    
+    # An empty page past the end of a loaded set is a valid answer, not a miss
+    if top_users_raw or (ready and offset > 0):
         # Cache hit
-        newrelic.agent.record_custom_metric('Custom/Cache/TopUsers/Hit', 1)
-        newrelic.agent.add_custom_attribute('cache_hit', True)
-        
-        # Format response
-        result = []
-        for i, (uid, score) in enumerate(top_users_raw):
-            result.append({"user_id": int(uid), "total_score": int(score), "rank": i + 1})
-        
-        total_time = time.time() - start_time
-        newrelic.agent.record_custom_metric('Custom/Endpoint/GetTopUsers/TotalTime', total_time)
-        
-        return {"top_players": result}
+        CACHE_LOOKUPS.inc("top", "hit")
+        return top_page_response(top_users_raw, offset, limit, cache_key if cacheable else None, media_type)
     
     # Cache miss - Fallback to DB
-    newrelic.agent.record_custom_metric('Custom/Cache/TopUsers/Miss', 1)
-    newrelic.agent.add_custom_attribute('cache_hit', False)
-    
-    db_start = time.time()
-    top_entries = await db.execute(text("SELECT user_id, total_score FROM leaderboard ORDER BY total_score DESC LIMIT 10"))
-    db_time = time.time() - db_start
-    newrelic.agent.record_custom_metric('Custom/Database/GetTopUsers', db_time)
-    
-    result = []
-    for i, row in enumerate(top_entries):
-        # Populate Redis for next time
-        await redis.zadd("leaderboard_scores", {str(row.user_id): row.total_score})
-        result.append({"user_id": row.user_id, "total_score": row.total_score, "rank": i + 1})
-    
-    total_time = time.time() - start_time
-    newrelic.agent.record_custom_metric('Custom/Endpoint/GetTopUsers/TotalTime', total_time)
-        
-    return {"top_players": result}
+    CACHE_LOOKUPS.inc("top", "miss")
+    
+    async with db_fallback_slot():
+        with STAGE_SECONDS.time("top", "db"):
+            if after:
+                # Keyset pagination: seek straight past the last (score, user_id) served
+                top_entries = await db.execute(text("""
+                    SELECT user_id, total_score FROM leaderboard
+                    WHERE (total_score, user_id) < (:score, :uid)
+                    ORDER BY total_score DESC, user_id DESC
+                    LIMIT :limit
+                """), {"score": after[1], "uid": after[2], "limit": limit})
+            elif offset <= DB_MAX_OFFSET:
+                top_entries = await db.execute(text("""
+                    SELECT user_id, total_score FROM leaderboard
+                    ORDER BY total_score DESC, user_id DESC
+                    LIMIT :limit OFFSET :offset
+                """), {"limit": limit, "offset": offset})
+            else:
+                raise HTTPException(status_code=400, detail=f"Use next_cursor to page past offset {DB_MAX_OFFSET}")
+    
+    # Redis is filled by the warm-up loader, not from partial query results
+    rows = [(row.user_id, row.total_score) for row in top_entries]
+    return top_page_response(rows, offset, limit, cache_key if cacheable else None, media_type)
+
+@router.get("/stream")
+async def stream_top_users():
+    """
+    Live global top 10 as server-sent events: a `snapshot` event on connect,
+    then `diff` events ({"changed": [...], "removed": [user_ids]}) whenever it changes.
+    """
+    if top_broadcaster.full():
+        raise HTTPException(status_code=503, detail="Too many live viewers on this worker, poll /top instead", headers={"Retry-After": "5"})
+    return StreamingResponse(
+        top_broadcaster.events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so each event is delivered as soon as it is written
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-@router.get("/rank/{user_id}", response_model=UserRank)
-@newrelic.agent.function_trace(name='get_user_rank', group='Leaderboard')
-async def get_user_rank(user_id: int, redis: Redis = Depends(get_redis), db: Session = Depends(get_db)):
-    start_time = time.time()
+@router.get("/history/{user_id}", response_model=HistoryResponse)
+async def get_user_history(
+    user_id: int,
+    request: Request,
+    limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """A user's game sessions, newest first, paged with next_cursor"""
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)])
+    
+    # Seek on (timestamp, id) through idx_game_sessions_user_timestamp. The plain
+    # timestamp bound prunes partitions newer than the cursor, and the ordered
+    # scan over monthly partitions stops as soon as the page is full.
+    with STAGE_SECONDS.time("history", "db"):
+        if cursor:
+            before, before_id = decode_history_cursor(cursor)
+            rows = (await db.execute(text("""
+                SELECT id, score, game_mode, timestamp FROM game_sessions
+                WHERE user_id = :uid AND timestamp <= :ts AND (timestamp, id) < (:ts, :id)
+                ORDER BY timestamp DESC, id DESC
+                LIMIT :limit
+            """), {"uid": user_id, "ts": before, "id": before_id, "limit": limit})).all()
+        else:
+            rows = (await db.execute(text("""
+                SELECT id, score, game_mode, timestamp FROM game_sessions
+                WHERE user_id = :uid
+                ORDER BY timestamp DESC, id DESC
+                LIMIT :limit
+            """), {"uid": user_id, "limit": limit})).all()
+    
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_history_cursor(rows[-1].timestamp, rows[-1].id)
+    return {
+        "user_id": user_id,
+        "sessions": [{"id": row.id, "score": row.score, "game_mode": row.game_mode, "timestamp": row.timestamp} for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+@router.get("/around/{user_id}", response_model=AroundResponse)
+async def get_around_user(
+    user_id: int,
+    request: Request,
+    radius: int = Query(5, ge=0, le=AROUND_RADIUS_MAX),
+    mode: str = ALL_MODES,
+    window: str = "all",
+    period: Optional[str] = None,
+    redis: Redis = Depends(get_redis),
+    db: Session = Depends(get_read_db)
+):
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)])
+    
+    hit = False
+    approximate = False
+    if mode != ALL_MODES or window != "all":
+        try:
+            key = await get_board_key(redis, mode, window, period)
+            with STAGE_SECONDS.time("around", "redis"):
+                rows = await lookup_around(redis, key, user_id, radius)
+        except RedisError:
+            rows = await board_fallback("around", fetch_board_around, db, mode, window, period, user_id, radius)
+        hit = True
+    elif await cache_ready(redis):
+        # Rank and neighbours in one script call (one round trip per shard in sharded mode)
+        with STAGE_SECONDS.time("around", "redis"):
+            try:
+                rows = await scoreboard.around(user_id, radius)
+                hit = True
+            except RedisError:
+                pass
+        if hit:
+            CACHE_LOOKUPS.inc("around", "hit")
     
-    # Add custom parameter for tracking
-    newrelic.agent.add_custom_attribute('lookup_user_id', user_id)
+    if not hit:
+        # Cache still loading or Redis unreachable - rank from Postgres, then seek above and below on (total_score, user_id)
+        CACHE_LOOKUPS.inc("around", "miss")
+        async with db_fallback_slot():
+            with STAGE_SECONDS.time("around", "db"):
+                found, approximate = await fetch_db_ranks(db, [user_id])
+                if user_id not in found:
+                    raise HTTPException(status_code=404, detail="User not found")
+                rank, score = found[user_id]
+                params = {"score": score, "uid": user_id, "radius": radius}
+                above = (await db.execute(text("""
+                    SELECT user_id, total_score FROM leaderboard
+                    WHERE (total_score, user_id) > (:score, :uid)
+                    ORDER BY total_score ASC, user_id ASC
+                    LIMIT :radius
+                """), params)).all()
+                below = (await db.execute(text("""
+                    SELECT user_id, total_score FROM leaderboard
+                    WHERE (total_score, user_id) < (:score, :uid)
+                    ORDER BY total_score DESC, user_id DESC
+                    LIMIT :radius
+                """), params)).all()
+        ordered = [(row.user_id, row.total_score) for row in reversed(above)] + [(user_id, score)] + [(row.user_id, row.total_score) for row in below]
+        first = rank - len(above)
+        rows = [(first + i, uid, total) for i, (uid, total) in enumerate(ordered)]
     
-    # Try Redis
-    redis_start = time.time()
-    rank = await redis.zrevrank("leaderboard_scores", str(user_id))
-    score = await redis.zscore("leaderboard_scores", str(user_id))
-    redis_time = time.time() - redis_start
-    newrelic.agent.record_custom_metric('Custom/Redis/GetUserRank', redis_time)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    body = {
+        "user_id": user_id,
+        "players": [{"user_id": uid, "total_score": total, "rank": rank} for rank, uid, total in rows],
+    }
+    if approximate:
+        body["approximate"] = True
+    return encoded_response(body, negotiate(request))
+
+def rank_entry(user_id, rank, score, approximate=False):
+    """One UserRank; `approximate` is only sent when set, so the common (Redis) response is unchanged"""
+    entry = {"user_id": user_id, "rank": rank, "total_score": score}
+    if approximate:
+        entry["approximate"] = True
+    return entry
+
+async def estimate_rank(user_id: int, redis: Redis, db: Session):
+    """Rank estimated from the score histogram, or None while the histogram is unavailable"""
+    try:
+        await score_distribution.refresh()
+    except RedisError:
+        return None
+    if not score_distribution.loaded:
+        return None
+    
+    # Only the user's score is looked up: no ZREVRANK, per-shard ZCOUNT or COUNT(*) over leaderboard
+    score = None
+    found = False
+    if await cache_ready(redis):
+        with STAGE_SECONDS.time("rank", "redis"):
+            try:
+                [score] = await scoreboard.scores([user_id])
+                found = True
+            except RedisError:
+                pass
+    if not found:
+        async with db_fallback_slot():
+            with STAGE_SECONDS.time("rank", "db"):
+                score = (await db.execute(
+                    text("SELECT total_score FROM leaderboard WHERE user_id = :uid"), {"uid": user_id},
+                )).scalar()
+    if score is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    CACHE_LOOKUPS.inc("rank", "estimate")
+    rank, lowest, highest = score_distribution.estimate(score)
+    return {
+        "user_id": user_id,
+        "rank": rank,
+        "total_score": score,
+        "rank_error": max(rank - lowest, highest - rank),
+        "percentile": score_distribution.percentile(rank),
+        "players": score_distribution.total,
+    }
+
+@router.get("/rank/{user_id}", response_model=Union[ApproxUserRank, UserRank])
+async def get_user_rank(
+    user_id: int,
+    request: Request,
+    mode: str = ALL_MODES,
+    window: str = "all",
+    period: Optional[str] = None,
+    approximate: bool = False,
+    redis: Redis = Depends(get_redis),
+    db: Session = Depends(get_read_db)
+):
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)])
     
-    if rank is not None and score is not None:
+    if approximate and mode == ALL_MODES and window == "all":
+        estimate = await estimate_rank(user_id, redis, db)
+        if estimate is not None:
+            return encoded_response(estimate, negotiate(request))
+    
+    if mode != ALL_MODES or window != "all":
+        try:
+            key = await get_board_key(redis, mode, window, period)
+            with STAGE_SECONDS.time("rank", "redis"):
+                [hit] = await lookup_ranks(redis, key, [user_id])
+        except RedisError:
+            rows = await board_fallback("rank", fetch_board_around, db, mode, window, period, user_id, 0)
+            hit = (rows[0][0], rows[0][2]) if rows else None
+        if hit is None:
+            raise HTTPException(status_code=404, detail="User has no score in this leaderboard")
+        rank, score = hit
+        return encoded_response({"user_id": user_id, "rank": rank, "total_score": score}, negotiate(request))
+    
+    # Try Redis (rank and score in one atomic script call)
+    hit = None
+    with STAGE_SECONDS.time("rank", "redis"):
+        if await cache_ready(redis):
+            try:
+                [hit] = await scoreboard.ranks([user_id])
+            except RedisError:
+                pass
+    
+    if hit is not None:
         # Cache hit
-        newrelic.agent.record_custom_metric('Custom/Cache/UserRank/Hit', 1)
-        newrelic.agent.add_custom_attribute('cache_hit', True)
-        
-        total_time = time.time() - start_time
-        newrelic.agent.record_custom_metric('Custom/Endpoint/GetUserRank/TotalTime', total_time)
-        
-        return {"user_id": user_id, "rank": rank + 1, "total_score": int(score)}
+        CACHE_LOOKUPS.inc("rank", "hit")
+        rank, score = hit
+        return encoded_response({"user_id": user_id, "rank": rank, "total_score": score}, negotiate(request))
         
     # Cache miss - Fallback to DB
-    newrelic.agent.record_custom_metric('Custom/Cache/UserRank/Miss', 1)
-    newrelic.agent.add_custom_attribute('cache_hit', False)
-    
-    # Calculate rank via DB (expensive query - track it carefully)
-    db_start = time.time()
-    result = await db.execute(text("""
-        SELECT total_score, 
-        (SELECT COUNT(*) + 1 FROM leaderboard l2 WHERE l2.total_score > l1.total_score) as rank
-        FROM leaderboard l1
-        WHERE user_id = :uid
-    """), {"uid": user_id})
-    db_time = time.time() - db_start
-    newrelic.agent.record_custom_metric('Custom/Database/GetUserRank', db_time)
-    
-    # Flag slow queries
-    if db_time > 0.1:  # 100ms threshold
-        newrelic.agent.record_custom_metric('Custom/SlowQuery/GetUserRank', db_time)
-        newrelic.agent.add_custom_attribute('slow_query', True)
-    
-    row = result.first()
-    if not row:
-        newrelic.agent.record_custom_event('UserNotFound', {'user_id': user_id})
+    CACHE_LOOKUPS.inc("rank", "miss")
+    
+    # Calculate rank via DB (score-bucket histogram + bounded range count)
+    async with db_fallback_slot():
+        with STAGE_SECONDS.time("rank", "db"):
+            found, approximate = await fetch_db_ranks(db, [user_id])
+    
+    if user_id not in found:
         raise HTTPException(status_code=404, detail="User not found")
+    rank, score = found[user_id]
          
-    # Update Redis
-    await redis.zadd("leaderboard_scores", {str(user_id): row.total_score})
+    # Update Redis; best effort, the rank was already answered from Postgres
+    try:
+        await scoreboard.add_many({user_id: score})
+    except RedisError:
+        pass
+    
+    return encoded_response(rank_entry(user_id, rank, score, approximate), negotiate(request))
+
+@router.get("/stats", response_model=StatsResponse)
+async def get_stats(request: Request, bins: int = Query(20, ge=1, le=STATS_BINS_MAX), db: Session = Depends(get_read_db)):
+    """Score distribution, percentiles and active players, without reading leaderboard"""
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)])
+    
+    distribution = score_distribution
+    try:
+        with STAGE_SECONDS.time("stats", "redis"):
+            await score_distribution.refresh()
+            active = await active_players()
+    except RedisError:
+        # Redis unreachable - the histogram as of the last rank refresh, active players counted from game_sessions
+        CACHE_LOOKUPS.inc("stats", "miss")
+        async with db_fallback_slot():
+            with STAGE_SECONDS.time("stats", "db"):
+                distribution, active = await db_stats(db)
+    if not distribution.loaded:
+        raise HTTPException(status_code=503, detail="Score histogram is being built, retry shortly", headers={"Retry-After": "5"})
+    
+    return {
+        "players": distribution.total,
+        "bucket_width": SCORE_BUCKET_WIDTH,
+        "percentiles": {f"p{p:g}": distribution.score_at(p) for p in PERCENTILES},
+        "distribution": distribution.bins(bins),
+        "active_players": active,
+    }
+
+@router.post("/ranks", response_model=RankBatchResponse)
+async def get_user_ranks(body: RankBatchRequest, request: Request, redis: Redis = Depends(get_redis), db: Session = Depends(get_read_db)):
+    user_ids = list(dict.fromkeys(body.user_ids))
+    if len(user_ids) > RANK_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {RANK_BATCH_MAX} user_ids per request")
+    await enforce_rate_limit("read", [(f"ip:{client_ip(request)}", READ_RATE_PER_IP)], ranks_cost(len(user_ids)))
+    
+    hits = None
+    if await cache_ready(redis):
+        # Resolve every user in one Redis round trip
+        with STAGE_SECONDS.time("ranks", "redis"):
+            try:
+                hits = await scoreboard.ranks(user_ids)
+            except RedisError:
+                pass
+    
+    if hits is None:
+        # Cache still loading or Redis unreachable - rank against Postgres in one query
+        CACHE_LOOKUPS.inc("ranks", "miss", amount=len(user_ids))
+        async with db_fallback_slot():
+            with STAGE_SECONDS.time("ranks", "db"):
+                found, approximate = await fetch_db_ranks(db, user_ids)
+        
+        return encoded_response({
+            "ranks": [rank_entry(uid, *found[uid], approximate) for uid in user_ids if uid in found],
+            "missing": [uid for uid in user_ids if uid not in found],
+        }, negotiate(request))
+    
+    found = {uid: hit for uid, hit in zip(user_ids, hits) if hit is not None}
+    approximate = set()
+    misses = [uid for uid in user_ids if uid not in found]
+    CACHE_LOOKUPS.inc("ranks", "hit", amount=len(found))
+    CACHE_LOOKUPS.inc("ranks", "miss", amount=len(misses))
+    
+    if misses:
+        # Load the missing scores with one query, cache them, then rank them in one more script call
+        async with db_fallback_slot():
+            with STAGE_SECONDS.time("ranks", "db"):
+                rows = (await db.execute(
+                    text("SELECT user_id, total_score FROM leaderboard WHERE user_id = ANY(:uids)"),
+                    {"uids": misses},
+                )).all()
+        
+        if rows:
+            loaded = [row.user_id for row in rows]
+            try:
+                await scoreboard.add_many({row.user_id: row.total_score for row in rows})
+                for uid, hit in zip(loaded, await scoreboard.ranks(loaded)):
+                    if hit is not None:
+                        found[uid] = hit
+            except RedisError:
+                # Redis went away mid-request: rank the loaded users against Postgres instead
+                async with db_fallback_slot():
+                    with STAGE_SECONDS.time("ranks", "db"):
+                        fallback, estimated = await fetch_db_ranks(db, loaded)
+                found.update(fallback)
+                if estimated:
+                    approximate.update(fallback)
     
-    total_time = time.time() - start_time
-    newrelic.agent.record_custom_metric('Custom/Endpoint/GetUserRank/TotalTime', total_time)
+    ranks = [rank_entry(uid, *found[uid], uid in approximate) for uid in user_ids if uid in found]
+    missing = [uid for uid in user_ids if uid not in found]
     
-    return {"user_id": user_id, "rank": row.rank, "total_score": row.total_score}
+    return encoded_response({"ranks": ranks, "missing": missing}, negotiate(request))
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import text
+
+from .cache import REDIS_MAX_CONNECTIONS, get_client, pool_stats
+from .database import DB_POOL_SIZE, engine
+from .metrics import NewRelicExporter, gauge, metrics_exporter
+from .warmup import is_cache_ready
+
+logger = logging.getLogger(__name__)
+
+NEW_RELIC_LICENSE_KEY = os.getenv("NEW_RELIC_LICENSE_KEY")
+NEW_RELIC_CONFIG_FILE = os.getenv("NEW_RELIC_CONFIG_FILE", os.path.join(os.path.dirname(__file__), "..", "newrelic.ini"))
+# Connections each worker opens during startup, so its first requests do not pay for connecting
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "4"))
+REDIS_POOL_WARM = int(os.getenv("REDIS_POOL_WARM", "4"))
+# Per-dependency timeout of a /readyz probe
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "1"))
+
+IMPORTED_AT = time.monotonic()
+
+
+def process_age():
+    """Seconds since this process was started (or forked), from /proc; since this module's import elsewhere."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesized command name; starttime is field 22, in clock ticks since boot
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - IMPORTED_AT
+
+
+def init_newrelic():
+    """
+    Start the New Relic agent in this worker when NEW_RELIC_LICENSE_KEY is
+    set. The agent is only imported then, and only after the fork: its
+    harvest thread does not survive one.
+    """
+    if not NEW_RELIC_LICENSE_KEY:
+        return
+    try:
+        import newrelic.agent
+
+        if os.path.exists(NEW_RELIC_CONFIG_FILE):
+            newrelic.agent.initialize(NEW_RELIC_CONFIG_FILE)
+        else:
+            newrelic.agent.initialize()
+        # Aggregated metrics are pushed once per METRICS_EXPORT_INTERVAL instead of per request
+        metrics_exporter.add(NewRelicExporter())
+        logger.info("New Relic agent initialized")
+    except Exception:
+        logger.exception("Failed to initialize New Relic")
+
+
+async def ping_postgres():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def ping_redis():
+    await get_client().ping()
+
+
+async def probe(check, timeout=READY_CHECK_TIMEOUT):
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), timeout)
+    except Exception as e:
+        return {"ok": False, "error": type(e).__name__}
+    return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+def db_pool_stats():
+    pool = engine.sync_engine.pool
+    return {"size": pool.size(), "idle": pool.checkedin(), "checked_out": pool.checkedout()}
+
+
+class Worker:
+    """
+    Startup timing and readiness of this worker process.
+
+    Cold start is split into boot (process start or fork until the startup
+    hook runs: interpreter and imports, near zero for a preforked worker),
+    startup (the hook itself) and, within it, warm_pools.
+    """
+
+    def __init__(self, db_warm=DB_POOL_WARM, redis_warm=REDIS_POOL_WARM):
+        self.db_warm = min(db_warm, DB_POOL_SIZE)
+        self.redis_warm = min(redis_warm, REDIS_MAX_CONNECTIONS)
+        self.phases = {}
+        self.started = False
+        self.draining = False
+        self._startup_began = None
+
+    def starting(self):
+        self.phases["boot"] = process_age()
+        self._startup_began = time.perf_counter()
+
+    def ready(self):
+        self.phases["startup"] = time.perf_counter() - self._startup_began
+        self.phases["total"] = self.phases["boot"] + self.phases["startup"]
+        self.started = True
+        logger.info(
+            "Worker %d ready in %.3fs (boot %.3fs, startup %.3fs, warm_pools %.3fs)", os.getpid(),
+            self.phases["total"], self.phases["boot"], self.phases["startup"], self.phases.get("warm_pools", 0.0),
+        )
+
+    def stopping(self):
+        self.draining = True
+
+    async def warm_pools(self):
+        """
+        Open the first connections of both pools concurrently. Each caller
+        holds its connection while the others connect, so the pools end up
+        with that many idle connections. Failures are logged, not raised:
+        /readyz reports the dependency until it is reachable.
+        """
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[ping_postgres() for _ in range(self.db_warm)],
+            *[ping_redis() for _ in range(self.redis_warm)],
+            return_exceptions=True,
+        )
+        for error in {type(r).__name__: r for r in results if isinstance(r, Exception)}.values():
+            logger.warning("Could not warm a connection pool: %r", error)
+        self.phases["warm_pools"] = time.perf_counter() - start
+
+    def liveness(self):
+        return {"status": "ok", "pid": os.getpid(), "uptime_seconds": round(process_age(), 3)}
+
+    async def readiness(self):
+        """(ready, report): started, not shutting down, and Postgres and Redis answering within READY_CHECK_TIMEOUT."""
+        postgres, redis = await asyncio.gather(probe(ping_postgres), probe(ping_redis))
+        db_pool, redis_pool = db_pool_stats(), pool_stats()
+        postgres["pool"] = {**db_pool, "warm": db_pool["idle"] + db_pool["checked_out"] >= self.db_warm}
+        redis["pool"] = {**redis_pool, "warm": redis_pool.get("created", 0) >= self.redis_warm}
+        ready = self.started and not self.draining and postgres["ok"] and redis["ok"]
+        return ready, {
+            "ready": ready,
+            "pid": os.getpid(),
+            "draining": self.draining,
+            "cold_start_seconds": {phase: round(seconds, 4) for phase, seconds in self.phases.items()},
+            "postgres": postgres,
+            "redis": redis,
+            # Informational: until the board is loaded, reads are served from Postgres
+            "leaderboard_cache_ready": await is_cache_ready(get_client()) if redis["ok"] else False,
+        }
+
+
+worker = Worker()
+
+
+def _cold_start():
+    return {(phase,): seconds for phase, seconds in worker.phases.items()}
+
+
+gauge("worker_cold_start_seconds", "Time from process start until this worker was ready, by phase", _cold_start, ("phase",))
@@ -1,13 +1,22 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Literal, Optional
+
+# Largest Postgres INT (user ids, scores and totals)
+INT4_MAX = 2**31 - 1
 
 class UserCreate(BaseModel):
     username: str
 
 class GameSessionCreate(BaseModel):
-    user_id: int
-    score: int
-    game_mode: str = "default"
+    # Checked here, so one out-of-range value is a 422 instead of failing the batch it is written with
+    user_id: int = Field(..., ge=1, le=INT4_MAX)
+    # Non-negative, so totals only grow (the embedded ranking engine and ZADD GT loads rely on it)
+    score: int = Field(..., ge=0, le=INT4_MAX)
+    # game_sessions.game_mode is VARCHAR(50)
+    game_mode: str = Field("default", max_length=50)
+    # Client-chosen idempotency key; a retry with the same id is applied at most once
+    submission_id: Optional[str] = Field(None, min_length=1, max_length=64)
 
 class LeaderboardEntry(BaseModel):
     user_id: int
@@ -21,6 +30,84 @@ class UserRank(BaseModel):
     user_id: int
     rank: int
     total_score: int
+    # Set when Redis was unavailable and the rank came from Postgres' periodically rebuilt score histogram
+    approximate: bool = False
+
+class ApproxUserRank(UserRank):
+    # rank is estimated from the score histogram; the true rank is within rank_error of it
+    approximate: bool = True
+    rank_error: int
+    percentile: float
+    players: int
 
 class LeaderboardResponse(BaseModel):
     top_players: list[LeaderboardEntry]
+    # Opaque keyset cursor for the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+class AroundResponse(BaseModel):
+    user_id: int
+    players: list[LeaderboardEntry]
+    # Ranks came from the Postgres fallback's score histogram (see UserRank)
+    approximate: bool = False
+
+class RankBatchRequest(BaseModel):
+    user_ids: list[int]
+
+class RankBatchResponse(BaseModel):
+    ranks: list[UserRank]
+    missing: list[int]
+
+class HistoryEntry(BaseModel):
+    id: int
+    score: int
+    game_mode: str
+    timestamp: datetime
+
+class HistoryResponse(BaseModel):
+    user_id: int
+    sessions: list[HistoryEntry]
+    # Opaque keyset cursor for older sessions; None on the last page
+    next_cursor: Optional[str] = None
+
+class ScoreBin(BaseModel):
+    min_score: int
+    max_score: int
+    players: int
+
+class StatsResponse(BaseModel):
+    players: int
+    bucket_width: int
+    # Score at each percentile, e.g. {"p50": 1200, "p99": 5400}
+    percentiles: dict[str, int]
+    distribution: list[ScoreBin]
+    # Distinct submitting players, e.g. {"today": 812, "last_7_days": 4210}
+    active_players: dict[str, int]
+
+class BoardCreate(BaseModel):
+    # Letters, digits, "-" and "_"; used in URLs and Redis keys
+    board_id: str = Field(..., min_length=1, max_length=64)
+    name: str = Field(..., min_length=1, max_length=255)
+    # desc: higher score wins; asc: lower score wins (e.g. fastest time)
+    sort_order: Literal["desc", "asc"] = "desc"
+    # sum: a player's scores add up; best: only their best score counts
+    aggregation: Literal["sum", "best"] = "sum"
+
+class BoardConfig(BaseModel):
+    board_id: str
+    name: str
+    sort_order: str
+    aggregation: str
+    created_at: datetime
+
+class BoardListResponse(BaseModel):
+    boards: list[BoardConfig]
+    # Pass as `cursor` for the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+class BoardScoreCreate(BaseModel):
+    user_id: int = Field(..., ge=1, le=INT4_MAX)
+    # Non-negative, so a player's standing only ever moves one way
+    score: int = Field(..., ge=0, le=INT4_MAX)
+    # Client-chosen idempotency key; a retry with the same id is applied at most once
+    submission_id: Optional[str] = Field(None, min_length=1, max_length=64)
@@ -0,0 +1,391 @@
+import asyncio
+import heapq
+import os
+import zlib
+from collections import defaultdict
+
+from redis import asyncio as redis
+
+from .cache import REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT, get_client, lookup_around, lookup_ranks
+from .metrics import gauge
+from .rank_engine import EmbeddedScoreboard
+
+# Comma-separated Redis URLs. When set, the global all-time leaderboard is
+# partitioned across these instances by user_id hash instead of one sorted set.
+REDIS_SHARD_URLS = [url.strip() for url in os.getenv("REDIS_SHARD_URLS", "").split(",") if url.strip()]
+# Where the global all-time leaderboard is ranked: "redis" (one sorted set, or
+# REDIS_SHARD_URLS) or "embedded" (in this process, see app/rank_engine.py)
+RANKING_BACKEND = os.getenv("RANKING_BACKEND", "redis")
+
+LEADERBOARD_KEY = "leaderboard_scores"
+
+# Sets each member's score only if its current score still equals the expected
+# one ("" = absent), so a repair never overwrites a concurrent ZINCRBY. A new
+# score of "" removes the member. Both sides are normalised to a number or nil
+# first: ZSCORE returns false for an absent member, which never equals nil.
+# ARGV: member, expected, new, member, expected, new, ... Returns the number set.
+COMPARE_AND_SET_LUA = """
+local changed = 0
+for i = 1, #ARGV, 3 do
+    local current = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    local cur = current and tonumber(current) or nil
+    if cur == tonumber(ARGV[i + 1]) then
+        if ARGV[i + 2] == '' then
+            redis.call('ZREM', KEYS[1], ARGV[i])
+        else
+            redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+        end
+        changed = changed + 1
+    end
+end
+return changed
+"""
+
+
+# position(key, score, member): number of entries ordered before (score, member)
+# in ZREVRANGE order (score, then member, both descending), whether or not the
+# member is in the set. Ties at `score` are binary-searched by rank, so it
+# costs O(log^2 n) however deep the entry is.
+POSITION_LUA = """
+local function position(key, score, member)
+    local lo = redis.call('ZCOUNT', key, '(' .. score, '+inf')
+    local hi = lo + redis.call('ZCOUNT', key, score, score)
+    while lo < hi do
+        local mid = math.floor((lo + hi) / 2)
+        if redis.call('ZREVRANGE', key, mid, mid)[1] > member then
+            lo = mid + 1
+        else
+            hi = mid
+        end
+    end
+    return lo
+end
+"""
+
+# Up to ARGV[3] entries strictly after (ARGV[1] score, ARGV[2] member) in
+# ZREVRANGE order, with scores: a keyset seek, as cheap on page 1000 as on page 1.
+SEEK_LUA = POSITION_LUA + """
+local start = position(KEYS[1], ARGV[1], ARGV[2])
+local first = redis.call('ZREVRANGE', KEYS[1], start, start, 'WITHSCORES')
+if first[1] == ARGV[2] and tonumber(first[2]) == tonumber(ARGV[1]) then
+    start = start + 1
+end
+return redis.call('ZREVRANGE', KEYS[1], start, start + tonumber(ARGV[3]) - 1, 'WITHSCORES')
+"""
+
+# position() of each (score, member) pair in ARGV: its 0-based rank on this
+# shard's slice of the board, summed over shards into the global rank
+POSITIONS_LUA = POSITION_LUA + """
+local out = {}
+for i = 1, #ARGV, 2 do
+    out[#out + 1] = position(KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return out
+"""
+
+# Neighbours of (ARGV[1] score, ARGV[2] member) on this shard: {position, up to
+# ARGV[3] entries just above it, up to ARGV[3] entries just below it}, with scores
+AROUND_SEEK_LUA = POSITION_LUA + """
+local pos = position(KEYS[1], ARGV[1], ARGV[2])
+local radius = tonumber(ARGV[3])
+local above, below = {}, {}
+if radius > 0 then
+    if pos > 0 then
+        above = redis.call('ZREVRANGE', KEYS[1], math.max(0, pos - radius), pos - 1, 'WITHSCORES')
+    end
+    local start = pos
+    local first = redis.call('ZREVRANGE', KEYS[1], start, start, 'WITHSCORES')
+    if first[1] == ARGV[2] and tonumber(first[2]) == tonumber(ARGV[1]) then
+        start = start + 1
+    end
+    below = redis.call('ZREVRANGE', KEYS[1], start, start + radius - 1, 'WITHSCORES')
+end
+return {pos, above, below}
+"""
+
+
+def _pairs(flat):
+    """(member, score) rows of a flat WITHSCORES reply."""
+    return [(flat[i], float(flat[i + 1])) for i in range(0, len(flat), 2)]
+
+
+def _merge_key(row):
+    # ZREVRANGE order across shards: score, then member, both descending
+    return row[1], row[0]
+
+
+def _cas_args(changes):
+    args = []
+    for uid, (expected, new) in changes.items():
+        args += [str(uid), "" if expected is None else expected, "" if new is None else new]
+    return args
+
+
+def shard_index(user_id, shard_count):
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+
+# Every backend provides: start(), close(), incr_many(), add_many(), scores(),
+# compare_and_set(), scan(), top(), ranks() and around(), plus three flags:
+#   sharded     spread over several Redis instances
+#   on_primary  stored under GLOBAL_KEY on the primary Redis, so submit paths
+#               update it in their own pipeline/script instead of incr_many()
+#   local       held per process, so each process loads it itself (app/warmup.py)
+
+
+class SingleKeyScoreboard:
+    """The global leaderboard as one sorted set on the primary Redis."""
+
+    sharded = False
+    on_primary = True
+    local = False
+
+    def __init__(self, client=None, key=LEADERBOARD_KEY):
+        self._client = client
+        self.key = key
+        self._cas_script = None
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def incr_many(self, totals):
+        """Apply {user_id: delta} increments."""
+        async with self.client.pipeline(transaction=False) as pipe:
+            for uid, delta in totals.items():
+                pipe.zincrby(self.key, delta, str(uid))
+            await pipe.execute()
+
+    async def add_many(self, scores):
+        """Set {user_id: score}, keeping any higher score already present."""
+        if scores:
+            await self.client.zadd(self.key, {str(uid): score for uid, score in scores.items()}, gt=True)
+
+    async def scores(self, user_ids):
+        """Score per user id, or None if absent."""
+        reply = await self.client.zmscore(self.key, [str(uid) for uid in user_ids])
+        return [None if score is None else int(score) for score in reply]
+
+    async def compare_and_set(self, changes):
+        """
+        Apply {user_id: (expected_score_or_None, new_score_or_None)} where the
+        current score still matches; a new score of None removes the user.
+        Returns the number set.
+        """
+        if not changes:
+            return 0
+        if self._cas_script is None:
+            self._cas_script = self.client.register_script(COMPARE_AND_SET_LUA)
+        return await self._cas_script(keys=[self.key], args=_cas_args(changes), client=self.client)
+
+    async def scan(self, count):
+        """Every (user_id, score) on the board, in chunks of about `count`, in no particular order."""
+        cursor = 0
+        while True:
+            cursor, rows = await self.client.zscan(self.key, cursor, count=count)
+            if rows:
+                yield [(int(uid), int(score)) for uid, score in rows]
+            if not cursor:
+                return
+
+    async def top(self, start, stop, after=None):
+        """
+        [(user_id, score)] for 0-based ranks start..stop inclusive, highest first.
+        `after` is the (score, user_id) of the entry at rank start-1, if known;
+        backends that cannot seek by rank use it instead of start.
+        """
+        rows = await self.client.zrevrange(self.key, start, stop, withscores=True)
+        return [(int(uid), int(score)) for uid, score in rows]
+
+    async def ranks(self, user_ids):
+        """(rank, score) per user id (1-based rank), or None if absent."""
+        return await lookup_ranks(self.client, self.key, user_ids)
+
+    async def around(self, user_id, radius):
+        """[(rank, user_id, score)] for up to `radius` users above and below, or None if absent."""
+        return await lookup_around(self.client, self.key, user_id, radius)
+
+
+class ShardedScoreboard:
+    """
+    The global leaderboard partitioned across several Redis instances.
+
+    Each user lives on shard crc32(user_id) % N. Top-K reads the first K
+    entries of every shard concurrently and merges them. A page after a
+    cursor seeks on every shard from the cursor's (score, user_id) and
+    merges one page per shard, so deep pages cost the same as the first;
+    only offset pages without a cursor read every shard from the top.
+
+    Ties are ordered by member, descending, as ZREVRANK and ZREVRANGE order
+    them, so rank, around and top agree on every user's position. A rank is
+    one plus the number of entries ordered before the user, summed from a
+    concurrent position lookup on every shard; around seeks from the same
+    position on every shard and merges the nearest entries.
+    """
+
+    sharded = True
+    on_primary = False
+    local = False
+
+    def __init__(self, urls, key=LEADERBOARD_KEY, max_connections=REDIS_MAX_CONNECTIONS):
+        self.urls = urls
+        self.key = key
+        self.max_connections = max_connections
+        self.shards = []
+        # (shard index, Lua source) -> registered script
+        self._scripts = {}
+
+    async def start(self):
+        self.shards = [
+            redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+                url, max_connections=self.max_connections, timeout=REDIS_POOL_TIMEOUT, decode_responses=True,
+            ))
+            for url in self.urls
+        ]
+        await asyncio.gather(*[shard.ping() for shard in self.shards])
+
+    async def close(self):
+        for shard in self.shards:
+            await shard.close()
+            await shard.connection_pool.disconnect()
+        self.shards = []
+        self._scripts = {}
+
+    def _group(self, user_ids):
+        groups = defaultdict(list)
+        for uid in user_ids:
+            groups[shard_index(uid, len(self.shards))].append(uid)
+        return groups
+
+    async def incr_many(self, totals):
+        async def incr(index, uids):
+            async with self.shards[index].pipeline(transaction=False) as pipe:
+                for uid in uids:
+                    pipe.zincrby(self.key, totals[uid], str(uid))
+                await pipe.execute()
+
+        await asyncio.gather(*[incr(index, uids) for index, uids in self._group(totals).items()])
+
+    async def add_many(self, scores):
+        await asyncio.gather(*[
+            self.shards[index].zadd(self.key, {str(uid): scores[uid] for uid in uids}, gt=True)
+            for index, uids in self._group(scores).items()
+        ])
+
+    async def scores(self, user_ids):
+        groups = self._group(user_ids)
+        replies = await asyncio.gather(*[
+            self.shards[index].zmscore(self.key, [str(uid) for uid in uids]) for index, uids in groups.items()
+        ])
+        found = {}
+        for uids, reply in zip(groups.values(), replies):
+            for uid, score in zip(uids, reply):
+                if score is not None:
+                    found[uid] = int(score)
+        return [found.get(uid) for uid in user_ids]
+
+    async def compare_and_set(self, changes):
+        counts = await asyncio.gather(*[
+            self._script(index, COMPARE_AND_SET_LUA)(keys=[self.key], args=_cas_args({uid: changes[uid] for uid in uids}))
+            for index, uids in self._group(changes).items()
+        ])
+        return sum(counts)
+
+    async def scan(self, count):
+        for shard in self.shards:
+            cursor = 0
+            while True:
+                cursor, rows = await shard.zscan(self.key, cursor, count=count)
+                if rows:
+                    yield [(int(uid), int(score)) for uid, score in rows]
+                if not cursor:
+                    break
+
+    def _script(self, index, source):
+        script = self._scripts.get((index, source))
+        if script is None:
+            script = self._scripts[(index, source)] = self.shards[index].register_script(source)
+        return script
+
+    async def top(self, start, stop, after=None):
+        if after is not None:
+            # Seek past the previous entry on every shard; the page is among their first stop-start+1 entries
+            count = stop - start + 1
+            score, uid = after
+            per_shard = await asyncio.gather(*[
+                self._script(index, SEEK_LUA)(keys=[self.key], args=[score, str(uid), count])
+                for index in range(len(self.shards))
+            ])
+            rows = (row for flat in per_shard for row in _pairs(flat))
+            return [(int(uid), int(score)) for uid, score in heapq.nlargest(count, rows, key=_merge_key)]
+        # Every shard must contribute its own first stop+1 entries to cover the global range
+        per_shard = await asyncio.gather(*[
+            shard.zrevrange(self.key, 0, stop, withscores=True) for shard in self.shards
+        ])
+        merged = heapq.nlargest(stop + 1, (row for rows in per_shard for row in rows), key=_merge_key)
+        return [(int(uid), int(score)) for uid, score in merged[start:]]
+
+    async def ranks(self, user_ids):
+        # 1. Scores from each user's own shard
+        groups = self._group(user_ids)
+        replies = await asyncio.gather(*[
+            self.shards[index].zmscore(self.key, [str(uid) for uid in uids]) for index, uids in groups.items()
+        ])
+        scores = {}
+        for uids, reply in zip(groups.values(), replies):
+            for uid, score in zip(uids, reply):
+                if score is not None:
+                    scores[uid] = int(score)
+        found = list(scores)
+        if not found:
+            return [None] * len(user_ids)
+
+        # 2. Entries ordered before each user, counted on every shard concurrently in one script call each
+        args = [arg for uid in found for arg in (scores[uid], str(uid))]
+        positions = await asyncio.gather(*[
+            self._script(index, POSITIONS_LUA)(keys=[self.key], args=args) for index in range(len(self.shards))
+        ])
+        ranks = {uid: (1 + sum(shard[i] for shard in positions), scores[uid]) for i, uid in enumerate(found)}
+        return [ranks.get(uid) for uid in user_ids]
+
+    async def around(self, user_id, radius):
+        [score] = await self.scores([user_id])
+        if score is None:
+            return None
+        # Every shard returns its position of the user and its `radius` nearest entries on each side
+        replies = await asyncio.gather(*[
+            self._script(index, AROUND_SEEK_LUA)(keys=[self.key], args=[score, str(user_id), radius])
+            for index in range(len(self.shards))
+        ])
+        rank = 1 + sum(int(reply[0]) for reply in replies)
+        # Nearest above: the lowest-ordered of the entries above; nearest below: the highest-ordered below
+        above = heapq.nsmallest(radius, (row for reply in replies for row in _pairs(reply[1])), key=_merge_key)
+        below = heapq.nlargest(radius, (row for reply in replies for row in _pairs(reply[2])), key=_merge_key)
+        rows = above[::-1] + [(str(user_id), score)] + below
+        first = rank - len(above)
+        return [(first + i, int(uid), int(score)) for i, (uid, score) in enumerate(rows)]
+
+
+def create_scoreboard():
+    if RANKING_BACKEND == "embedded":
+        return EmbeddedScoreboard()
+    if RANKING_BACKEND != "redis":
+        raise ValueError(f"Unknown RANKING_BACKEND: {RANKING_BACKEND}")
+    return ShardedScoreboard(REDIS_SHARD_URLS) if REDIS_SHARD_URLS else SingleKeyScoreboard()
+
+
+scoreboard = create_scoreboard()
+
+if scoreboard.local:
+    gauge(
+        "rank_engine",
+        "Users held and bytes used by the embedded ranking engine",
+        lambda: {("users",): len(scoreboard.engine), ("bytes",): scoreboard.engine.memory_bytes()},
+        ("stat",),
+    )
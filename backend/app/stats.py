@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from .cache import get_client
+from .ranks import HISTOGRAM_KEY, HISTOGRAM_LOADED_FIELD, SCORE_BUCKET_WIDTH
+
+# How stale a worker's copy of the score histogram may be when estimating ranks
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", "1"))
+# Days of daily active-player HyperLogLogs counted by /stats
+ACTIVE_PLAYERS_DAYS = int(os.getenv("ACTIVE_PLAYERS_DAYS", "7"))
+
+# One HyperLogLog of submitting user_ids per UTC day (~12KB each, ~0.8% error)
+ACTIVE_KEY_PREFIX = "leaderboard:active"
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_of(score):
+    # Same as total_score / width in Postgres (integer division truncates)
+    return int(score / SCORE_BUCKET_WIDTH)
+
+
+def active_key(day):
+    return f"{ACTIVE_KEY_PREFIX}:{day.isoformat()}"
+
+
+def histogram_deltas(moves):
+    """{bucket: user count change} for [(old_total or None if new, new_total)]."""
+    deltas = defaultdict(int)
+    for old, new in moves:
+        if old is not None:
+            if bucket_of(old) == bucket_of(new):
+                continue
+            deltas[bucket_of(old)] -= 1
+        deltas[bucket_of(new)] += 1
+    return {bucket: delta for bucket, delta in deltas.items() if delta}
+
+
+def queue_stats(pipe, moves, user_ids, now):
+    """
+    Queue the histogram and active-player updates for a committed batch on a
+    Redis pipeline. `moves` are the (old, new) leaderboard totals the batch
+    produced, as returned by the submit statements.
+    """
+    for bucket, delta in histogram_deltas(moves).items():
+        pipe.hincrby(HISTOGRAM_KEY, bucket, delta)
+    if user_ids:
+        key = active_key(now.date())
+        pipe.pfadd(key, *user_ids)
+        expire_at = datetime.combine(now.date(), datetime.min.time()) + timedelta(days=ACTIVE_PLAYERS_DAYS + 1)
+        pipe.expireat(key, expire_at)
+
+
+async def record_stats(moves, user_ids, now):
+    async with get_client().pipeline(transaction=False) as pipe:
+        queue_stats(pipe, moves, user_ids, now)
+        await pipe.execute()
+
+
+async def active_players(now=None):
+    """Distinct submitting players today and over the last ACTIVE_PLAYERS_DAYS days."""
+    today = (now or datetime.utcnow()).date()
+    keys = [active_key(today - timedelta(days=i)) for i in range(ACTIVE_PLAYERS_DAYS)]
+    async with get_client().pipeline(transaction=False) as pipe:
+        pipe.pfcount(keys[0])
+        pipe.pfcount(*keys)
+        day, window = await pipe.execute()
+    return {"today": day, f"last_{ACTIVE_PLAYERS_DAYS}_days": window}
+
+
+async def db_stats(db, now=None):
+    """
+    (ScoreDistribution, active players) from Postgres, for /stats while Redis is
+    unreachable: the histogram as of the last rank refresh, and exact distinct
+    counts over the game_sessions partitions of the last ACTIVE_PLAYERS_DAYS days.
+    """
+    distribution = ScoreDistribution()
+    rows = (await db.execute(text("SELECT bucket, user_count FROM leaderboard_score_buckets"))).all()
+    distribution.load([(row.bucket, row.user_count) for row in rows], loaded=bool(rows))
+
+    today = datetime.combine((now or datetime.utcnow()).date(), datetime.min.time())
+    day, window = (await db.execute(text("""
+        SELECT COUNT(DISTINCT user_id) FILTER (WHERE timestamp >= :today), COUNT(DISTINCT user_id)
+        FROM game_sessions WHERE timestamp >= :since
+    """), {"today": today, "since": today - timedelta(days=ACTIVE_PLAYERS_DAYS - 1)})).one()
+    return distribution, {"today": day, f"last_{ACTIVE_PLAYERS_DAYS}_days": window}
+
+
+class ScoreDistribution:
+    """
+    This worker's copy of the Redis score histogram, as cumulative counts.
+
+    It is re-read (one HGETALL) at most every STATS_REFRESH_INTERVAL seconds,
+    so estimating a rank or a percentile costs a bisect and no Redis call.
+    Users are assumed to be spread evenly over the width of their bucket; the
+    true rank is always within the bounds returned with an estimate.
+    """
+
+    def __init__(self, max_age=STATS_REFRESH_INTERVAL):
+        self.max_age = max_age
+        self.loaded = False
+        self.total = 0
+        # Ascending buckets holding users, their counts, and users in strictly higher buckets
+        self.buckets = []
+        self.counts = []
+        self.above = []
+        self._fetched_at = None
+        self._lock = asyncio.Lock()
+
+    def _fresh(self):
+        return self._fetched_at is not None and time.monotonic() - self._fetched_at < self.max_age
+
+    async def refresh(self):
+        if self._fresh():
+            return
+        async with self._lock:
+            if self._fresh():
+                return
+            raw = await get_client().hgetall(HISTOGRAM_KEY)
+            self._fetched_at = time.monotonic()
+            self.load(
+                [(int(bucket), int(count)) for bucket, count in raw.items() if bucket != HISTOGRAM_LOADED_FIELD],
+                loaded=HISTOGRAM_LOADED_FIELD in raw,
+            )
+
+    def load(self, rows, loaded=True):
+        """Replace the histogram with (bucket, user_count) rows."""
+        self.loaded = loaded
+        rows = sorted((bucket, count) for bucket, count in rows if count > 0)
+        self.buckets = [bucket for bucket, _ in rows]
+        self.counts = [count for _, count in rows]
+        self.above = [0] * len(rows)
+        higher = 0
+        for i in range(len(rows) - 1, -1, -1):
+            self.above[i] = higher
+            higher += self.counts[i]
+        self.total = higher
+
+    def estimate(self, score):
+        """(estimated rank, lowest possible rank, highest possible rank) of a score."""
+        bucket = bucket_of(score)
+        i = bisect.bisect_left(self.buckets, bucket)
+        if i < len(self.buckets) and self.buckets[i] == bucket:
+            higher, tied = self.above[i], self.counts[i]
+        else:
+            higher, tied = (self.above[i] + self.counts[i] if i < len(self.buckets) else 0), 0
+        if tied <= 1:
+            return higher + 1, higher + 1, higher + 1
+        # Share of the bucket's width above the score
+        above_share = ((bucket + 1) * SCORE_BUCKET_WIDTH - 1 - score) / SCORE_BUCKET_WIDTH
+        rank = higher + 1 + round((tied - 1) * min(1.0, max(0.0, above_share)))
+        return rank, higher + 1, higher + tied
+
+    def percentile(self, rank):
+        """Percentage of players ranked at or below `rank`."""
+        if not self.total:
+            return 100.0
+        return round(100 * (self.total - min(rank, self.total) + 1) / self.total, 3)
+
+    def score_at(self, percentile):
+        """Score below which `percentile`% of players fall, interpolated within its bucket."""
+        target = self.total * percentile / 100
+        below = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            if below + count >= target:
+                return int((bucket + (target - below) / count) * SCORE_BUCKET_WIDTH)
+            below += count
+        return (self.buckets[-1] + 1) * SCORE_BUCKET_WIDTH if self.buckets else 0
+
+    def bins(self, count):
+        """Users per score range, merging buckets into at most `count` equal ranges."""
+        if not self.buckets:
+            return []
+        first, last = self.buckets[0], self.buckets[-1]
+        span = max(1, -(-(last - first + 1) // count))
+        merged = defaultdict(int)
+        for bucket, users in zip(self.buckets, self.counts):
+            merged[(bucket - first) // span] += users
+        return [
+            {
+                "min_score": (first + i * span) * SCORE_BUCKET_WIDTH,
+                "max_score": (first + (i + 1) * span) * SCORE_BUCKET_WIDTH - 1,
+                "players": users,
+            }
+            for i, users in sorted(merged.items())
+        ]
+
+
+score_distribution = ScoreDistribution()
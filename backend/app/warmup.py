@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from sqlalchemy import text
+
+from .cache import get_client
+from .database import engine
+from .scoreboard import scoreboard
+from .metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# Set once the sorted set holds every leaderboard row; shared by all workers.
+READY_KEY = "leaderboard_scores:ready"
+# Held by the worker that is loading, so workers don't all stream the table at once.
+LOCK_KEY = "leaderboard_scores:warmup_lock"
+
+WARMUP_CHUNK_SIZE = int(os.getenv("WARMUP_CHUNK_SIZE", "20000"))
+WARMUP_LOCK_TTL = int(os.getenv("WARMUP_LOCK_TTL", "600"))
+# How often each worker checks that the cache is still loaded (e.g. after a Redis flush).
+WARMUP_CHECK_INTERVAL = float(os.getenv("WARMUP_CHECK_INTERVAL", "10"))
+
+WARMUP_SECONDS = histogram("warmup_load_seconds", "Time to load the leaderboard into Redis", buckets=(1, 5, 15, 30, 60, 120, 300, 600))
+WARMUP_ROWS = counter("warmup_rows_total", "Leaderboard rows loaded into Redis by warm-up")
+
+_ready = False
+
+
+async def is_cache_ready(redis):
+    """
+    True once the full leaderboard has been loaded into Redis.
+
+    Until then reads must go to Postgres, because a partially loaded sorted set
+    returns wrong top lists and ranks. The flag is cached in-process once seen,
+    so the steady state costs no extra round trip. An in-process scoreboard
+    is ready once it holds a snapshot or a full load.
+    """
+    global _ready
+    if scoreboard.local:
+        return scoreboard.ready
+    if not _ready:
+        _ready = bool(await redis.exists(READY_KEY))
+    return _ready
+
+
+async def copy_leaderboard():
+    """
+    Stream the whole leaderboard table into the scoreboard. Returns the row count.
+
+    Rows come from a server-side cursor in chunks of WARMUP_CHUNK_SIZE; each
+    chunk is written with one add_many (ZADD GT in Redis) while the next chunk
+    is fetched. add_many keeps any higher score already written by a
+    concurrent submit (scores only grow), so the load can run while the API
+    is serving writes.
+    """
+    loaded = 0
+    pending = None
+    async with engine.connect() as conn:
+        result = await conn.stream(
+            text("SELECT user_id, total_score FROM leaderboard"),
+            execution_options={"yield_per": WARMUP_CHUNK_SIZE},
+        )
+        async for rows in result.partitions(WARMUP_CHUNK_SIZE):
+            if pending is not None:
+                await pending
+            pending = asyncio.create_task(
+                scoreboard.add_many({row.user_id: row.total_score for row in rows})
+            )
+            loaded += len(rows)
+    if pending is not None:
+        await pending
+    return loaded
+
+
+async def load_leaderboard():
+    """
+    Load the whole leaderboard into the scoreboard and mark it ready.
+
+    Returns False if another worker holds the load lock. An in-process
+    scoreboard is loaded by every process, without the lock or shared flag.
+    """
+    start = time.perf_counter()
+    if scoreboard.local:
+        loaded = await copy_leaderboard()
+        scoreboard.mark_synced()
+    else:
+        redis = get_client()
+        token = uuid.uuid4().hex
+        if not await redis.set(LOCK_KEY, token, nx=True, ex=WARMUP_LOCK_TTL):
+            return False
+        try:
+            loaded = await copy_leaderboard()
+            await redis.set(READY_KEY, 1)
+        finally:
+            if await redis.get(LOCK_KEY) == token:
+                await redis.delete(LOCK_KEY)
+
+    load_time = time.perf_counter() - start
+    logger.info("Loaded %d leaderboard rows into the scoreboard in %.1fs", loaded, load_time)
+    WARMUP_ROWS.inc(amount=loaded)
+    WARMUP_SECONDS.observe(load_time)
+    return True
+
+
+class CacheWarmer:
+    """Background task that (re)loads the scoreboard whenever it is not marked ready."""
+
+    def __init__(self, check_interval=WARMUP_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        global _ready
+        while True:
+            try:
+                redis = get_client()
+                if scoreboard.local:
+                    # Once per process; a snapshot-restored board keeps serving meanwhile
+                    if not scoreboard.synced:
+                        await load_leaderboard()
+                elif not await redis.exists(READY_KEY):
+                    _ready = False
+                    await load_leaderboard()
+                    await is_cache_ready(redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Leaderboard cache warm-up failed")
+            await asyncio.sleep(self.check_interval)
+
+
+cache_warmer = CacheWarmer()
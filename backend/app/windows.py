@@ -0,0 +1,221 @@
+import logging
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from .database import engine
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = "leaderboard_scores"
+ALL_MODES = "all"
+WINDOWS = ("all", "day", "week", "season")
+
+SEASON_EPOCH = date.fromisoformat(os.getenv("SEASON_EPOCH", "2025-01-01"))
+SEASON_LENGTH_DAYS = int(os.getenv("SEASON_LENGTH_DAYS", "90"))
+# How long a day/week/season board stays in Redis after its window closes
+WINDOW_RETENTION_SECONDS = int(os.getenv("WINDOW_RETENTION_SECONDS", str(7 * 86400)))
+# TTL for boards of closed windows that are rolled up again on request
+WINDOW_ROLLUP_TTL_SECONDS = int(os.getenv("WINDOW_ROLLUP_TTL_SECONDS", "3600"))
+WINDOW_ROLLUP_CHUNK_SIZE = int(os.getenv("WINDOW_ROLLUP_CHUNK_SIZE", "20000"))
+# How long a worker trusts that a board is loaded before checking its marker again
+LOADED_CHECK_TTL_SECONDS = 60
+
+ROLLUP_SECONDS = histogram("window_rollup_seconds", "Time to roll a board up from game_sessions", ("window",), buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 300))
+
+# {board key: monotonic time until which it is known to be loaded}
+_loaded_boards = {}
+
+# A board's totals from the game_sessions in its window, ranked as ZREVRANGE orders
+# them (score, then user_id, descending); the Postgres fallback while Redis is unreachable
+RANKED_SESSIONS_SQL = """
+    WITH ranked AS (
+        SELECT user_id, SUM(score) AS total_score,
+               ROW_NUMBER() OVER (ORDER BY SUM(score) DESC, user_id DESC) AS rank
+        FROM game_sessions {where} GROUP BY user_id
+    )
+"""
+
+
+class InvalidWindow(ValueError):
+    pass
+
+
+def current_period(window, now=None):
+    """Label of the window containing `now` (UTC): 2026-10-16, 2026-W42, S8."""
+    now = now or datetime.utcnow()
+    if window == "day":
+        return now.date().isoformat()
+    if window == "week":
+        year, week, _ = now.isocalendar()
+        return f"{year}-W{week:02d}"
+    if window == "season":
+        return f"S{(now.date() - SEASON_EPOCH).days // SEASON_LENGTH_DAYS + 1}"
+    return None
+
+
+def period_range(window, period):
+    """[start, end) datetimes of a period label. Raises InvalidWindow for malformed labels."""
+    try:
+        if window == "day":
+            start = datetime.combine(date.fromisoformat(period), datetime.min.time())
+            return start, start + timedelta(days=1)
+        if window == "week":
+            year, week = period.split("-W")
+            start = datetime.fromisocalendar(int(year), int(week), 1)
+            return start, start + timedelta(weeks=1)
+        if window == "season":
+            number = int(period.lstrip("S"))
+            if number < 1:
+                raise ValueError(period)
+            start = datetime.combine(SEASON_EPOCH + timedelta(days=(number - 1) * SEASON_LENGTH_DAYS), datetime.min.time())
+            return start, start + timedelta(days=SEASON_LENGTH_DAYS)
+    except ValueError:
+        raise InvalidWindow(f"Invalid {window} period: {period}")
+    return None, None
+
+
+def board_key(mode, window, period=None):
+    """Redis key of a board. The all-modes, all-time board is the original global sorted set."""
+    if window not in WINDOWS:
+        raise InvalidWindow(f"Unknown window: {window}")
+    if window == "all":
+        return GLOBAL_KEY if mode == ALL_MODES else f"lb:{mode}:all"
+    return f"lb:{mode}:{window}:{period or current_period(window)}"
+
+
+def board_expire_at(window, period):
+    """Unix time a board key should expire at, or None for all-time boards."""
+    if window == "all":
+        return None
+    _, end = period_range(window, period)
+    expire_at = (end - datetime(1970, 1, 1)).total_seconds() + WINDOW_RETENTION_SECONDS
+    # Closed windows rebuilt on request are kept for a short while only
+    return int(max(expire_at, time.time() + WINDOW_ROLLUP_TTL_SECONDS))
+
+
+def submit_boards(game_mode, now):
+    """(key, expire_at) of every board a submission in `game_mode` at `now` must update."""
+    boards = {}
+    for mode in dict.fromkeys((game_mode, ALL_MODES)):
+        for window in WINDOWS:
+            period = current_period(window, now)
+            boards[board_key(mode, window, period)] = board_expire_at(window, period)
+    return boards
+
+
+def sessions_filter(mode, window, period):
+    """WHERE clause and parameters selecting the game_sessions a board is summed from."""
+    conditions, params = [], {}
+    if mode != ALL_MODES:
+        conditions.append("game_mode = :mode")
+        params["mode"] = mode
+    if window != "all":
+        conditions.append("timestamp >= :start AND timestamp < :end")
+        params["start"], params["end"] = period_range(window, period)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+async def rollup_board(redis, mode, window, period):
+    """
+    Rebuild a board from game_sessions and mark it loaded.
+
+    Aggregates only the sessions inside the window, which touches only the
+    monthly game_sessions partitions it overlaps and their timestamp BRIN
+    indexes, and writes them with chunked ZADD GT, so
+    increments already applied by concurrent submits are kept. Returns False if
+    another worker is already rolling the board up.
+    """
+    key = board_key(mode, window, period)
+    lock_key = f"{key}:rollup_lock"
+    token = uuid.uuid4().hex
+    if not await redis.set(lock_key, token, nx=True, ex=300):
+        return False
+
+    start_time = time.perf_counter()
+    where, params = sessions_filter(mode, window, period)
+
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(
+                text(f"SELECT user_id, SUM(score) AS total_score FROM game_sessions {where} GROUP BY user_id"),
+                params,
+                execution_options={"yield_per": WINDOW_ROLLUP_CHUNK_SIZE},
+            )
+            async for rows in result.partitions(WINDOW_ROLLUP_CHUNK_SIZE):
+                await redis.zadd(key, {str(row.user_id): int(row.total_score) for row in rows}, gt=True)
+        expire_at = board_expire_at(window, period)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"{key}:loaded", 1)
+            if expire_at:
+                pipe.expireat(key, expire_at)
+                pipe.expireat(f"{key}:loaded", expire_at)
+            await pipe.execute()
+    finally:
+        if await redis.get(lock_key) == token:
+            await redis.delete(lock_key)
+
+    rollup_time = time.perf_counter() - start_time
+    logger.info("Rolled up %s from game_sessions in %.1fs", key, rollup_time)
+    ROLLUP_SECONDS.observe(rollup_time, window)
+    return True
+
+
+async def ensure_board(redis, mode, window, period=None):
+    """
+    Key of a mode/window board, rolling it up from game_sessions if it is not loaded.
+
+    Returns None while another worker is rolling the board up. Raises
+    InvalidWindow for unknown windows or malformed periods.
+    """
+    period = period or current_period(window)
+    key = board_key(mode, window, period)
+    if window != "all":
+        period_range(window, period)
+    if _loaded_boards.get(key, 0) > time.monotonic():
+        return key
+    if not await redis.exists(f"{key}:loaded"):
+        if not await rollup_board(redis, mode, window, period):
+            return None
+    _loaded_boards[key] = time.monotonic() + LOADED_CHECK_TTL_SECONDS
+    return key
+
+
+async def fetch_board_page(db, mode, window, period, offset, limit):
+    """
+    [(user_id, total_score)] of a board from `offset`, summed from game_sessions.
+
+    For reads while Redis is unreachable. Aggregates only the sessions in the
+    window, like rollup_board, without loading anything into Redis. Raises
+    InvalidWindow for malformed periods.
+    """
+    period = period or current_period(window)
+    where, params = sessions_filter(mode, window, period)
+    rows = await db.execute(text(RANKED_SESSIONS_SQL.format(where=where) + """
+        SELECT user_id, total_score FROM ranked WHERE rank > :offset ORDER BY rank LIMIT :limit
+    """), {**params, "offset": offset, "limit": limit})
+    return [(row.user_id, int(row.total_score)) for row in rows]
+
+
+async def fetch_board_around(db, mode, window, period, user_id, radius):
+    """
+    [(rank, user_id, total_score)] for a user and up to `radius` players either
+    side on a board, summed from game_sessions, or None if the user has no
+    sessions in it. Same use and cost as fetch_board_page.
+    """
+    period = period or current_period(window)
+    where, params = sessions_filter(mode, window, period)
+    rows = (await db.execute(text(RANKED_SESSIONS_SQL.format(where=where) + """
+        SELECT r.rank, r.user_id, r.total_score
+        FROM ranked r, (SELECT rank FROM ranked WHERE user_id = :uid) target
+        WHERE r.rank BETWEEN target.rank - :radius AND target.rank + :radius
+        ORDER BY r.rank
+    """), {**params, "uid": user_id, "radius": radius})).all()
+    if not rows:
+        return None
+    return [(int(row.rank), row.user_id, int(row.total_score)) for row in rows]
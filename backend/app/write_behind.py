@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+
+from redis.exceptions import ResponseError
+from sqlalchemy import text
+
+from .cache import get_client
+from .database import engine
+from .schemas import GameSessionCreate
+from .windows import GLOBAL_KEY, submit_boards
+from .scoreboard import scoreboard
+from .hot_cache import INVALIDATION_CHANNEL, TOP_K
+from .metrics import SIZE_BUCKETS, histogram
+from .batcher import DUPLICATES, REJECTED, persist_isolated
+from .stats import record_stats
+
+logger = logging.getLogger(__name__)
+
+# "batched" persists to Postgres before acknowledging (see batcher.py);
+# "write_behind" acknowledges after the Redis update and persists asynchronously.
+SUBMIT_MODE = os.getenv("SUBMIT_MODE", "batched")
+
+STREAM_KEY = "leaderboard:submissions"
+CONSUMER_GROUP = "leaderboard-persist"
+# Entries Postgres refused on their own data (e.g. a user_id with no users row), moved out of STREAM_KEY
+DEAD_LETTER_KEY = "leaderboard:submissions:dead"
+DEAD_LETTER_MAXLEN = int(os.getenv("WRITE_BEHIND_DEAD_LETTER_MAXLEN", "100000"))
+
+# Approximate number of entries kept in the stream; this bounds how far back a replay can go.
+WRITE_BEHIND_STREAM_MAXLEN = int(os.getenv("WRITE_BEHIND_STREAM_MAXLEN", "1000000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "1000"))
+WRITE_BEHIND_BLOCK_MS = int(os.getenv("WRITE_BEHIND_BLOCK_MS", "1000"))
+# Entries delivered to a consumer that has not acked them for this long are re-claimed.
+WRITE_BEHIND_CLAIM_IDLE_MS = int(os.getenv("WRITE_BEHIND_CLAIM_IDLE_MS", "30000"))
+
+PERSIST_SECONDS = histogram("write_behind_persist_seconds", "Time to persist and ack one stream batch")
+PERSIST_BATCH_SIZE = histogram("write_behind_batch_size", "Stream entries per persisted batch", buckets=SIZE_BUCKETS)
+
+# Client submission_ids are remembered for at least this long, in time-bucketed
+# sets that expire on their own, so memory is bounded by the submit rate times the window.
+SUBMIT_DEDUP_WINDOW_SECONDS = int(os.getenv("SUBMIT_DEDUP_WINDOW_SECONDS", "3600"))
+SUBMIT_DEDUP_BUCKETS = int(os.getenv("SUBMIT_DEDUP_BUCKETS", "6"))
+DEDUP_KEY_PREFIX = "leaderboard:dedup"
+
+# Checks the submission_id against the dedup buckets, then updates every board
+# of the submission and appends it to the stream, all atomically. A board's key
+# is published on the top-K invalidation channel when the new score reaches
+# that board's K-th score. Returns false for a duplicate.
+# KEYS: stream, n dedup sets (current bucket first), board zsets...
+# ARGV: user_id, score, game_mode, timestamp, maxlen, submission_id, K,
+# invalidation channel, n, current bucket expire-at, then one expire-at per board (0 = never).
+SUBMIT_LUA = """
+local n = tonumber(ARGV[9])
+if n > 0 then
+    for i = 3, n + 1 do
+        if redis.call('SISMEMBER', KEYS[i], ARGV[6]) == 1 then
+            return false
+        end
+    end
+    if redis.call('SADD', KEYS[2], ARGV[6]) == 0 then
+        return false
+    end
+    redis.call('EXPIREAT', KEYS[2], ARGV[10])
+end
+local k = tonumber(ARGV[7])
+for i = n + 2, #KEYS do
+    local score = tonumber(redis.call('ZINCRBY', KEYS[i], ARGV[2], ARGV[1]))
+    local expire_at = tonumber(ARGV[9 + i - n])
+    if expire_at > 0 then
+        redis.call('EXPIREAT', KEYS[i], expire_at)
+    end
+    local kth = redis.call('ZREVRANGE', KEYS[i], k - 1, k - 1, 'WITHSCORES')
+    if #kth == 0 or score >= tonumber(kth[2]) then
+        redis.call('PUBLISH', ARGV[8], KEYS[i])
+    end
+end
+return redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[5], '*',
+    'sid', ARGV[6], 'uid', ARGV[1], 'score', ARGV[2], 'mode', ARGV[3], 'ts', ARGV[4])
+"""
+
+# One statement per batch: claim the submission_ids in game_session_submissions
+# (game_sessions is partitioned, so it cannot hold the unique constraint),
+# insert only the sessions whose id was not claimed before, and add only the
+# newly inserted scores to leaderboard. Redelivered entries are therefore
+# applied at most once. Returns each updated user's total before (NULL for a
+# new row) and after.
+PERSIST_SQL = text("""
+    WITH batch AS (
+        SELECT * FROM unnest(
+            CAST(:sids AS varchar[]), CAST(:uids AS int[]), CAST(:scores AS int[]),
+            CAST(:modes AS varchar[]), CAST(:tss AS timestamp[])
+        ) AS b(submission_id, user_id, score, game_mode, timestamp)
+    ),
+    claimed AS (
+        INSERT INTO game_session_submissions (submission_id, created_at)
+        SELECT submission_id, timestamp FROM batch
+        ON CONFLICT (submission_id) DO NOTHING
+        RETURNING submission_id
+    ),
+    inserted AS (
+        INSERT INTO game_sessions (submission_id, user_id, score, game_mode, timestamp)
+        SELECT submission_id, user_id, score, game_mode, timestamp FROM batch
+        WHERE submission_id IN (SELECT submission_id FROM claimed)
+        RETURNING user_id, score
+    ),
+    totals AS (
+        SELECT user_id, SUM(score) AS delta FROM inserted GROUP BY user_id
+    ),
+    upserted AS (
+        INSERT INTO leaderboard (user_id, total_score, rank)
+        SELECT user_id, delta, 0 FROM totals ORDER BY user_id
+        ON CONFLICT (user_id)
+        DO UPDATE SET total_score = leaderboard.total_score + EXCLUDED.total_score
+        RETURNING user_id, total_score, xmax = 0 AS created
+    )
+    SELECT u.user_id, CASE WHEN u.created THEN NULL ELSE u.total_score - t.delta END AS old_total, u.total_score AS new_total
+    FROM upserted u JOIN totals t USING (user_id)
+""")
+
+
+def dedup_keys(now=None):
+    """Dedup set keys to check, current bucket first, and the current bucket's expire-at."""
+    bucket_seconds = max(1, SUBMIT_DEDUP_WINDOW_SECONDS // max(1, SUBMIT_DEDUP_BUCKETS))
+    bucket = int((now if now is not None else time.time()) // bucket_seconds)
+    # One extra bucket so an id is always remembered for the full window
+    keys = [f"{DEDUP_KEY_PREFIX}:{bucket - i}" for i in range(SUBMIT_DEDUP_BUCKETS + 1)]
+    return keys, (bucket + 1) * bucket_seconds + SUBMIT_DEDUP_WINDOW_SECONDS
+
+
+async def persist_entries(conn, entries):
+    """
+    Write stream entries ([(entry_id, fields), ...]) to Postgres. Safe to call with already-persisted entries.
+    Returns [(user_id, old_total, new_total)] for the leaderboard rows changed.
+    """
+    if not entries:
+        return []
+    fields = [f for _, f in entries]
+    rows = await conn.execute(PERSIST_SQL, {
+        "sids": [f["sid"] for f in fields],
+        "uids": [int(f["uid"]) for f in fields],
+        "scores": [int(f["score"]) for f in fields],
+        "modes": [f["mode"] for f in fields],
+        "tss": [datetime.fromisoformat(f["ts"]) for f in fields],
+    })
+    return [(row.user_id, row.old_total, row.new_total) for row in rows]
+
+
+class WriteBehindQueue:
+    """
+    Submit path and background persister for write-behind mode.
+
+    Submissions are acknowledged once the sorted set and the stream are
+    updated. Every worker joins the same consumer group, drains the stream in
+    batches into Postgres, and acks entries only after they are committed, so
+    delivery is at-least-once and made idempotent by submission_id. An entry
+    Postgres refuses is split out of its batch, copied to DEAD_LETTER_KEY and
+    acked, so it cannot hold back the entries claimed with it.
+    """
+
+    def __init__(self):
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._submit_script = None
+        self._task = None
+
+    async def start(self):
+        redis = get_client()
+        self._submit_script = redis.register_script(SUBMIT_LUA)
+        try:
+            # Start from the beginning so entries written before the group existed are persisted too
+            await redis.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, item: GameSessionCreate):
+        """Apply a submission to Redis and queue it for Postgres. Returns False for a duplicate submission_id."""
+        now = datetime.utcnow()
+        boards = submit_boards(item.game_mode, now)
+        if not scoreboard.on_primary:
+            # The global board lives on the shards and is updated after the
+            # script; it is not atomic with the stream append.
+            del boards[GLOBAL_KEY]
+        keys, dedup_expire_at = dedup_keys() if item.submission_id else ([], 0)
+        applied = await self._submit_script(
+            keys=[STREAM_KEY, *keys, *boards],
+            args=[
+                item.user_id, item.score, item.game_mode,
+                now.isoformat(), WRITE_BEHIND_STREAM_MAXLEN, item.submission_id or uuid.uuid4().hex,
+                TOP_K, INVALIDATION_CHANNEL, len(keys), dedup_expire_at,
+                *[expire_at or 0 for expire_at in boards.values()],
+            ],
+        )
+        if not applied:
+            DUPLICATES.inc("write_behind")
+            return False
+        if not scoreboard.on_primary:
+            await scoreboard.incr_many({item.user_id: item.score})
+            await get_client().publish(INVALIDATION_CHANNEL, GLOBAL_KEY)
+        return True
+
+    async def _run(self):
+        redis = get_client()
+        last_claim = 0.0
+        while True:
+            try:
+                entries = []
+                # Take over entries left pending by consumers that died before acking
+                if time.monotonic() - last_claim > WRITE_BEHIND_CLAIM_IDLE_MS / 1000:
+                    last_claim = time.monotonic()
+                    claimed = await redis.xautoclaim(
+                        STREAM_KEY, CONSUMER_GROUP, self.consumer,
+                        min_idle_time=WRITE_BEHIND_CLAIM_IDLE_MS, count=WRITE_BEHIND_BATCH_SIZE,
+                    )
+                    entries = [e for e in claimed[1] if e[1]]
+                if not entries:
+                    reply = await redis.xreadgroup(
+                        CONSUMER_GROUP, self.consumer, {STREAM_KEY: ">"},
+                        count=WRITE_BEHIND_BATCH_SIZE, block=WRITE_BEHIND_BLOCK_MS,
+                    )
+                    entries = reply[0][1] if reply else []
+                if not entries:
+                    continue
+
+                with PERSIST_SECONDS.time():
+                    dead = []
+                    changed = await persist_isolated(self._persist, entries, lambda entry, error: dead.append((entry, error)))
+                    if dead:
+                        await self._dead_letter(redis, dead)
+                    await redis.xack(STREAM_KEY, CONSUMER_GROUP, *[entry_id for entry_id, _ in entries])
+                PERSIST_BATCH_SIZE.observe(len(entries))
+                if changed:
+                    # Only newly persisted sessions move the histogram, so redelivery does not skew it
+                    await record_stats(
+                        [(old, new) for _, old, new in changed], [uid for uid, _, _ in changed], datetime.utcnow(),
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Unacked entries stay pending and are re-claimed after WRITE_BEHIND_CLAIM_IDLE_MS
+                logger.exception("Write-behind persist failed")
+                await asyncio.sleep(1)
+
+    @staticmethod
+    async def _persist(entries):
+        async with engine.begin() as conn:
+            return await persist_entries(conn, entries)
+
+    @staticmethod
+    async def _dead_letter(redis, dead):
+        """
+        Keep refused entries, with the stream id and the error, for inspection
+        or a manual replay. Their scores are already in the sorted sets; the
+        reconciler brings those back to the Postgres totals.
+        """
+        async with redis.pipeline(transaction=False) as pipe:
+            for (entry_id, fields), error in dead:
+                logger.warning("Write-behind entry %s refused by Postgres, moved to %s: %s", entry_id, DEAD_LETTER_KEY, error.orig)
+                pipe.xadd(
+                    DEAD_LETTER_KEY, {**fields, "entry_id": entry_id, "error": str(error.orig)[:500]},
+                    maxlen=DEAD_LETTER_MAXLEN, approximate=True,
+                )
+            await pipe.execute()
+        REJECTED.inc("write_behind", amount=len(dead))
+
+
+async def stream_stats():
+    """Consumer-group lag: entries not yet delivered ("lag") and delivered but not acked ("pending")."""
+    redis = get_client()
+    stats = {"mode": SUBMIT_MODE, "length": await redis.xlen(STREAM_KEY), "dead_letter_length": await redis.xlen(DEAD_LETTER_KEY)}
+    for group in await redis.xinfo_groups(STREAM_KEY):
+        if group["name"] == CONSUMER_GROUP:
+            stats["lag"] = group.get("lag")
+            stats["pending"] = group["pending"]
+            stats["last_delivered_id"] = group["last-delivered-id"]
+    return stats
+
+
+write_behind_queue = WriteBehindQueue()
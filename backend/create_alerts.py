@@ -15,7 +15,6 @@ Usage:
 
 import os
 import requests
-import json
 
 # Configuration
 API_KEY = os.getenv("NEW_RELIC_API_KEY")
@@ -141,10 +140,10 @@ def main():
     if policy_id:
         create_nrql_condition(
             policy_id=policy_id,
-            condition_name="Slow Query Count > 10",
-            nrql_query="SELECT count(newrelic.timeslice.value) FROM Metric WHERE metricTimesliceName = 'Custom/SlowQuery/GetUserRank'",
+            condition_name="Avg DB Rank Lookup > 100ms",
+            nrql_query="SELECT average(newrelic.timeslice.value) FROM Metric WHERE metricTimesliceName = 'Custom/leaderboard_stage_seconds/rank/db'",
             threshold_duration=300,  # 5 minutes
-            threshold_value=10,
+            threshold_value=0.1,
             operator="ABOVE"
         )
     
@@ -155,7 +154,7 @@ def main():
         create_nrql_condition(
             policy_id=policy_id,
             condition_name="Cache Hit Rate < 70%",
-            nrql_query="SELECT (sum(Custom/Cache/TopUsers/Hit) / (sum(Custom/Cache/TopUsers/Hit) + sum(Custom/Cache/TopUsers/Miss))) * 100 FROM Metric",
+            nrql_query="SELECT (sum(Custom/leaderboard_cache_lookups_total/top/hit) / (sum(Custom/leaderboard_cache_lookups_total/top/hit) + sum(Custom/leaderboard_cache_lookups_total/top/miss))) * 100 FROM Metric",
             threshold_duration=300,  # 5 minutes
             threshold_value=70,
             operator="BELOW"
@@ -1,3 +1,5 @@
+-- Schema only; seed data with `python seed.py load` (run by the `seed` compose service)
+
 -- Create Users table
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -5,13 +7,43 @@ CREATE TABLE IF NOT EXISTS users (
     join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Create Game Sessions table
+-- Create Game Sessions table, range-partitioned by month on timestamp.
+-- Primary and unique keys must include the partition key, so submission_id
+-- uniqueness lives in game_session_submissions instead.
 CREATE TABLE IF NOT EXISTS game_sessions (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
+    submission_id VARCHAR(64),
     user_id INT REFERENCES users(id) ON DELETE CASCADE,
     score INT NOT NULL,
     game_mode VARCHAR(50) NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Monthly partitions covering the seeded year and the next few months;
+-- the API keeps creating them ahead of time (app/partitions.py)
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', now() - interval '12 months'),
+            date_trunc('month', now() + interval '3 months'),
+            interval '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF game_sessions FOR VALUES FROM (%L) TO (%L)',
+            'game_sessions_p' || to_char(month, 'YYYY_MM'), month, (month + interval '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+-- submission_ids already persisted (client retries and stream redeliveries are skipped)
+CREATE TABLE IF NOT EXISTS game_session_submissions (
+    submission_id VARCHAR(64) PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create Leaderboard table
@@ -19,46 +51,60 @@ CREATE TABLE IF NOT EXISTS leaderboard (
     id SERIAL PRIMARY KEY,
     user_id INT REFERENCES users(id) ON DELETE CASCADE UNIQUE,
     total_score INT NOT NULL,
+    -- Not maintained; ranks are computed on read (backend/app/ranks.py)
     rank INT
 );
 
--- Add indexes for optimization
-CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
-CREATE INDEX IF NOT EXISTS idx_game_sessions_user_id ON game_sessions(user_id);
-CREATE INDEX IF NOT EXISTS idx_leaderboard_total_score ON leaderboard(total_score DESC);
+-- Score histogram (users per total_score bucket), rebuilt periodically by the rank job
+CREATE TABLE IF NOT EXISTS leaderboard_score_buckets (
+    bucket INT PRIMARY KEY,
+    user_count INT NOT NULL
+);
 
--- SEED DATA (Only runs if DB is fresh)
--- 1. Populate Users Table with 1 Million Records
--- This might take a few seconds/minutes
-DO $$
-BEGIN
-    IF NOT EXISTS (SELECT 1 FROM users LIMIT 1) THEN
-        INSERT INTO users (username) 
-        SELECT 'user_' || generate_series(1, 1000000);
-    END IF;
-END $$;
+-- Per-user totals over game_sessions up to a watermark, advanced incrementally;
+-- leaderboard can be rebuilt from it plus the newer sessions (app/rollup.py)
+CREATE TABLE IF NOT EXISTS leaderboard_rollup (
+    user_id INT PRIMARY KEY,
+    total_score BIGINT NOT NULL
+);
 
--- 2. Populate Game Sessions with 5 Million Random Records
-DO $$
-BEGIN
-    IF NOT EXISTS (SELECT 1 FROM game_sessions LIMIT 1) THEN
-        INSERT INTO game_sessions (user_id, score, game_mode, timestamp)
-        SELECT 
-            floor(random() * 1000000 + 1)::int,
-            floor(random() * 1000 + 10)::int,
-            CASE WHEN random() > 0.5 THEN 'solo' ELSE 'team' END,
-            NOW() - (random() * (interval '365 days'))
-        FROM generate_series(1, 5000000);
-    END IF;
-END $$;
+CREATE TABLE IF NOT EXISTS leaderboard_rollup_watermark (
+    name VARCHAR(64) PRIMARY KEY,
+    last_session_id BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
 
--- 3. Populate Initial Leaderboard from Sessions
-DO $$
-BEGIN
-    IF NOT EXISTS (SELECT 1 FROM leaderboard LIMIT 1) THEN
-        INSERT INTO leaderboard (user_id, total_score, rank)
-        SELECT user_id, SUM(score) as total_score, 0
-        FROM game_sessions
-        GROUP BY user_id;
-    END IF;
-END $$;
+-- Boards of other games (/api/boards/{board_id}): ranking direction and how scores combine
+CREATE TABLE IF NOT EXISTS boards (
+    board_id VARCHAR(64) PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    sort_order VARCHAR(4) NOT NULL DEFAULT 'desc',
+    aggregation VARCHAR(4) NOT NULL DEFAULT 'sum',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One row per player per board; the primary key doubles as the per-board scan used to load Redis
+CREATE TABLE IF NOT EXISTS board_scores (
+    board_id VARCHAR(64) NOT NULL,
+    user_id INT NOT NULL,
+    score BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (board_id, user_id)
+);
+
+-- submission_ids already persisted per board (a board's ids never collide with another board's)
+CREATE TABLE IF NOT EXISTS board_submissions (
+    board_id VARCHAR(64) NOT NULL,
+    submission_id VARCHAR(64) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (board_id, submission_id)
+);
+
+-- Add indexes for optimization
+CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+CREATE INDEX IF NOT EXISTS idx_game_sessions_user_timestamp ON game_sessions(user_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_game_sessions_timestamp_brin ON game_sessions USING brin (timestamp);
+CREATE INDEX IF NOT EXISTS idx_game_session_submissions_created_brin ON game_session_submissions USING brin (created_at);
+CREATE INDEX IF NOT EXISTS idx_board_submissions_created_brin ON board_submissions USING brin (created_at);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_total_score ON leaderboard(total_score DESC);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_score_user ON leaderboard(total_score DESC, user_id DESC);
@@ -0,0 +1,44 @@
+"""
+Production Server
+
+Imports the app once, binds the port and forks one single-process uvicorn
+worker per CPU (WEB_CONCURRENCY overrides the count). Workers share nothing
+but the listening socket; each keeps its own connection pools and background
+tasks. Exited workers are replaced; SIGTERM drains and stops them all, and
+SIGTTIN/SIGTTOU add or remove a worker.
+
+With RANKING_BACKEND=embedded the global board lives in the worker's
+memory, so a single worker is run whatever WEB_CONCURRENCY says.
+
+No schema work is done here: run `python migrate.py` first.
+
+Usage:
+    python serve.py
+    python serve.py --workers 8 --port 8000
+"""
+
+import argparse
+import logging
+import time
+
+from app.prefork import WEB_CONCURRENCY, serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API in a preforked pool of worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="Worker processes (0: one per CPU)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+    started = time.perf_counter()
+    # Imported before forking, so workers start with every module loaded
+    from app.main import app, max_workers
+    logging.getLogger("serve").info("Imported the app in %.2fs", time.perf_counter() - started)
+    serve(app, args.host, args.port, args.workers, args.log_level, max_workers())
+
+
+if __name__ == "__main__":
+    main()
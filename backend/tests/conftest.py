@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Tests import the app as `app.*`, the way serve.py and migrate.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Database tests run against TEST_DATABASE_URL, or a throwaway Postgres started
+# with pgserver on first use. Set before any app module creates its engine.
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+PGDATA = None
+if not TEST_DATABASE_URL:
+    PGDATA = os.path.join(tempfile.gettempdir(), f"leaderboard-test-pg-{os.getpid()}")
+    TEST_DATABASE_URL = f"postgresql+asyncpg://postgres@/postgres?host={PGDATA}"
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+def run_async(coro):
+    """Run `coro` on a new event loop, closing the pooled connections bound to it afterwards."""
+    from app.database import engine
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope="session")
+def database():
+    """A migrated database, shared by the session; tests clean up the rows they use."""
+    server = None
+    if PGDATA:
+        import pgserver
+        server = pgserver.get_server(PGDATA, cleanup_mode="delete")
+    from app.migrations import migrate
+    run_async(migrate())
+    yield TEST_DATABASE_URL
+    if server is not None:
+        server.cleanup()
+
+
+@pytest.fixture
+def run():
+    return run_async
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """An in-memory Redis (with Lua) as the process-wide client."""
+    from fakeredis import aioredis
+    from app import cache
+
+    client = aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(cache, "_client", client)
+    monkeypatch.setattr(cache, "_scripts", {})
+    return client
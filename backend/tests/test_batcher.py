@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.batcher import NO_PARTITION, is_data_error, persist_isolated, rejection, sqlstate
+from app.database import engine
+
+
+def refused(code):
+    return DBAPIError("INSERT ...", {}, SimpleNamespace(sqlstate=code))
+
+
+def test_isolates_refused_items():
+    statements = []
+
+    async def persist(items):
+        statements.append(list(items))
+        if 3 in items or 6 in items:
+            raise refused("23503")
+        return items
+
+    rejected = []
+    applied = asyncio.run(persist_isolated(persist, list(range(8)), lambda item, error: rejected.append((item, error))))
+    assert applied == [0, 1, 2, 4, 5, 7]
+    assert [item for item, _ in rejected] == [3, 6]
+    assert rejection(rejected[0][1]).status_code == 404
+    assert rejection(refused("22003")).status_code == 422
+    # One bad item costs O(log n) extra statements
+    assert len(statements) < 8 + 2 * 3
+
+
+@pytest.mark.parametrize("code", ["23514", "08006", "57014"])
+def test_server_errors_fail_the_batch(code):
+    """A missing partition (23514), a dropped connection or a timeout is not the submission's fault."""
+    async def persist(items):
+        raise refused(code)
+
+    rejected = []
+    with pytest.raises(DBAPIError):
+        asyncio.run(persist_isolated(persist, [1, 2, 3], lambda item, error: rejected.append(item)))
+    assert rejected == []
+
+
+def test_missing_partition_is_not_a_data_error(database, run):
+    async def test():
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO game_sessions (user_id, score, game_mode, timestamp) VALUES (1, 10, 'solo', '2999-01-01')"
+            ))
+
+    with pytest.raises(DBAPIError) as error:
+        run(test())
+    assert sqlstate(error.value) == NO_PARTITION
+    assert not is_data_error(error.value)
@@ -0,0 +1,136 @@
+"""
+In-process API benchmarks, so latency regressions show up before deploy.
+
+The full app (startup hook, batchers, hot cache, background tasks) runs in this
+process behind httpx's ASGI transport, against the test database and an
+in-memory Redis, so there is no uvicorn or network hop in the measurement.
+Every benchmark user has a `users` row and a score before anything is timed.
+
+    python -m pytest tests/test_benchmarks.py --benchmark-only --benchmark-autosave
+    # later, fails if any endpoint's mean regressed by more than 20%
+    python -m pytest tests/test_benchmarks.py --benchmark-only --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+
+import asyncio
+import random
+import uuid
+
+import httpx
+import pytest
+from fakeredis import aioredis
+from sqlalchemy import text
+
+from app import cache, main
+from app.database import engine
+from app.limits import rate_limiter
+from app.warmup import is_cache_ready
+
+API_PREFIX = "/api/leaderboard"
+# Clear of the ids the other database tests use
+FIRST_USER = 800001
+USERS = 2000
+
+
+def scenarios(rng):
+    def uid():
+        return rng.randint(FIRST_USER, FIRST_USER + USERS - 1)
+
+    return {
+        "submit": lambda: ("POST", "/submit", {"user_id": uid(), "score": rng.randint(10, 1000), "game_mode": "solo"}),
+        # Same as submit plus a submission_id; the difference is the dedup overhead
+        "submit_idempotent": lambda: ("POST", "/submit", {
+            "user_id": uid(), "score": rng.randint(10, 1000), "game_mode": "solo", "submission_id": f"bench-{uuid.uuid4().hex}",
+        }),
+        "top": lambda: ("GET", "/top", None),
+        "top_page": lambda: ("GET", f"/top?offset={rng.randint(0, USERS // 2)}&limit=100", None),
+        "rank": lambda: ("GET", f"/rank/{uid()}", None),
+        "around": lambda: ("GET", f"/around/{uid()}?radius=5", None),
+        "ranks": lambda: ("POST", "/ranks", {"user_ids": [uid() for _ in range(100)]}),
+    }
+
+
+async def seed(client, concurrency=16):
+    """Create the benchmark users, then give each a score through the API so reads hit populated boards."""
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO users (id, username) SELECT g, 'bench-' || g FROM generate_series(CAST(:first AS int), CAST(:last AS int)) g ON CONFLICT DO NOTHING"
+        ), {"first": FIRST_USER, "last": FIRST_USER + USERS - 1})
+
+    rng = random.Random(7)
+    pending = iter(range(FIRST_USER, FIRST_USER + USERS))
+
+    async def worker():
+        for uid in pending:
+            response = await client.post("/submit", json={"user_id": uid, "score": rng.randint(10, 5000), "game_mode": "solo"})
+            assert response.status_code == 200, response.text
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+async def cleanup():
+    uids = list(range(FIRST_USER, FIRST_USER + USERS))
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM game_session_submissions WHERE submission_id LIKE 'bench-%'"))
+        for table, column in (("game_sessions", "user_id"), ("leaderboard_rollup", "user_id"), ("leaderboard", "user_id"), ("users", "id")):
+            await conn.execute(text(f"DELETE FROM {table} WHERE {column} = ANY(:uids)"), {"uids": uids})
+
+
+@pytest.fixture(scope="module")
+def api(database):
+    """A started app and a client for it, on one event loop that every benchmark round runs on."""
+    async def init_redis():
+        cache._client = aioredis.FakeRedis(decode_responses=True)
+
+    async def close_redis():
+        await cache._client.aclose()
+        cache._client = None
+
+    loop = asyncio.new_event_loop()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(main, "init_redis", init_redis)
+        patch.setattr(main, "close_redis", close_redis)
+        patch.setattr(cache, "_scripts", {})
+        # Every in-process request comes from one client address; measure the endpoints, not the per-IP limit
+        patch.setattr(rate_limiter, "enabled", False)
+
+        async def start():
+            await main.app.router.startup()
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url=f"http://bench{API_PREFIX}")
+
+        async def prepare(client):
+            await seed(client)
+            while not await is_cache_ready(cache.get_client()):
+                await asyncio.sleep(0.05)
+
+        async def stop(client):
+            try:
+                await client.aclose()
+                await main.app.router.shutdown()
+            finally:
+                await cleanup()
+                await engine.dispose()
+
+        client = loop.run_until_complete(start())
+        try:
+            loop.run_until_complete(prepare(client))
+            yield loop, client
+        finally:
+            loop.run_until_complete(stop(client))
+            loop.close()
+
+
+@pytest.mark.parametrize("scenario", list(scenarios(random.Random())))
+def test_endpoint(benchmark, api, scenario):
+    loop, client = api
+    make_request = scenarios(random.Random(42))[scenario]
+    failures = []
+
+    def request():
+        method, path, payload = make_request()
+        response = loop.run_until_complete(client.request(method, path, json=payload))
+        if response.status_code != 200:
+            failures.append((path, response.status_code, response.text))
+
+    benchmark.group = "api"
+    benchmark(request)
+    assert failures == []
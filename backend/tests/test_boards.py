@@ -0,0 +1,188 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import text
+
+from app.boards import board_batcher, board_registry
+from app.database import engine
+from app.routers import boards
+
+app = FastAPI()
+app.include_router(boards.router)
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+def client_for(headers=None):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", headers=headers)
+
+
+@pytest.fixture
+def api(database, redis, monkeypatch):
+    """Call `test(client)` against the boards router with the board batcher running; the client is an admin."""
+    monkeypatch.setattr(boards, "BOARD_ADMIN_TOKEN", ADMIN_TOKEN)
+
+    async def call(test):
+        await board_batcher.start()
+        try:
+            async with client_for({"Authorization": f"Bearer {ADMIN_TOKEN}"}) as client:
+                return await test(client)
+        finally:
+            await board_batcher.stop()
+            board_registry._entries.clear()
+    return call
+
+
+def new_board_id():
+    return f"test-{uuid.uuid4().hex[:12]}"
+
+
+async def count(sql, **params):
+    async with engine.connect() as conn:
+        return (await conn.execute(text(sql), params)).scalar()
+
+
+def test_create_submit_and_delete(api, run):
+    board_id = new_board_id()
+
+    async def test(client):
+        response = await client.post("/api/boards", json={"board_id": board_id, "name": "Test"})
+        assert response.status_code == 201
+        assert response.json()["aggregation"] == "sum"
+        assert (await client.post("/api/boards", json={"board_id": board_id, "name": "Again"})).status_code == 409
+
+        for user_id, score in ((1, 10), (2, 30), (1, 25)):
+            response = await client.post(f"/api/boards/{board_id}/submit", json={"user_id": user_id, "score": score})
+            assert response.status_code == 200
+            assert response.json()["duplicate"] is False
+
+        top = (await client.get(f"/api/boards/{board_id}/top")).json()
+        assert [(row["user_id"], row["total_score"]) for row in top["top_players"]] == [(1, 35), (2, 30)]
+        rank = (await client.get(f"/api/boards/{board_id}/rank/2")).json()
+        assert (rank["rank"], rank["total_score"]) == (2, 30)
+
+        assert (await client.delete(f"/api/boards/{board_id}")).status_code == 204
+        assert (await client.get(f"/api/boards/{board_id}")).status_code == 404
+        assert (await client.delete(f"/api/boards/{board_id}")).status_code == 404
+        assert (await client.post(f"/api/boards/{board_id}/submit", json={"user_id": 1, "score": 1})).status_code == 404
+        assert await count("SELECT COUNT(*) FROM board_scores WHERE board_id = :id", id=board_id) == 0
+
+    run(api(test))
+
+
+def test_submission_ids_are_scoped_to_their_board(api, run):
+    first, second = new_board_id(), new_board_id()
+
+    async def submit(client, board_id, score, submission_id="retry-1"):
+        response = await client.post(
+            f"/api/boards/{board_id}/submit", json={"user_id": 7, "score": score, "submission_id": submission_id},
+        )
+        assert response.status_code == 200
+        return response.json()["duplicate"]
+
+    async def test(client):
+        for board_id in (first, second):
+            await client.post("/api/boards", json={"board_id": board_id, "name": "Test"})
+        # The same id already used on the default board, and the raw form of a namespaced key
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO game_session_submissions (submission_id) VALUES ('retry-1'), (:key) ON CONFLICT DO NOTHING"
+            ), {"key": f"board:{first}:other"})
+
+        assert await submit(client, first, 10) is False
+        assert await submit(client, first, 10) is True
+        assert await submit(client, second, 20) is False
+        assert await submit(client, first, 5, submission_id="other") is False
+        assert (await client.get(f"/api/boards/{first}/rank/7")).json()["total_score"] == 15
+        assert (await client.get(f"/api/boards/{second}/rank/7")).json()["total_score"] == 20
+
+        # A board re-created under the same id starts with no remembered submissions
+        await client.delete(f"/api/boards/{first}")
+        await client.post("/api/boards", json={"board_id": first, "name": "Test"})
+        assert await submit(client, first, 3) is False
+        assert (await client.get(f"/api/boards/{first}/rank/7")).json()["total_score"] == 3
+
+        for board_id in (first, second):
+            await client.delete(f"/api/boards/{board_id}")
+        assert await count("SELECT COUNT(*) FROM board_submissions WHERE board_id IN (:a, :b)", a=first, b=second) == 0
+        async with engine.begin() as conn:
+            await conn.execute(text("DELETE FROM game_session_submissions WHERE submission_id IN ('retry-1', :key)"), {"key": f"board:{first}:other"})
+
+    run(api(test))
+
+
+def test_retry_in_the_same_batch_counts_once(api, run):
+    board_id = new_board_id()
+
+    async def test(client):
+        await client.post("/api/boards", json={"board_id": board_id, "name": "Test"})
+        body = {"user_id": 3, "score": 4, "submission_id": "same"}
+        responses = await asyncio.gather(*[client.post(f"/api/boards/{board_id}/submit", json=body) for _ in range(5)])
+        assert sorted(response.json()["duplicate"] for response in responses) == [False, True, True, True, True]
+        assert (await client.get(f"/api/boards/{board_id}/rank/3")).json()["total_score"] == 4
+        await client.delete(f"/api/boards/{board_id}")
+
+    run(api(test))
+
+
+@pytest.mark.parametrize("body", [
+    {"user_id": 0, "score": 1},
+    {"user_id": 2**31, "score": 1},
+    {"user_id": 1, "score": -1},
+    {"user_id": 1, "score": 2**31},
+])
+def test_out_of_range_submissions_are_refused(api, run, body):
+    board_id = new_board_id()
+
+    async def test(client):
+        await client.post("/api/boards", json={"board_id": board_id, "name": "Test"})
+        assert (await client.post(f"/api/boards/{board_id}/submit", json=body)).status_code == 422
+        await client.delete(f"/api/boards/{board_id}")
+
+    run(api(test))
+
+
+def test_refused_submission_fails_alone(api, run):
+    board_id = new_board_id()
+
+    async def test(client):
+        await client.post("/api/boards", json={"board_id": board_id, "name": "Test"})
+        # One more point would overflow this player's BIGINT total
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("INSERT INTO board_scores (board_id, user_id, score) VALUES (:id, 1, :score)"),
+                {"id": board_id, "score": 2**63 - 1},
+            )
+        responses = await asyncio.gather(*[
+            client.post(f"/api/boards/{board_id}/submit", json={"user_id": user_id, "score": 5})
+            for user_id in (1, 2, 3)
+        ])
+        assert [response.status_code for response in responses] == [422, 200, 200]
+        assert await count("SELECT COUNT(*) FROM board_scores WHERE board_id = :id", id=board_id) == 3
+        await client.delete(f"/api/boards/{board_id}")
+
+    run(api(test))
+
+
+def test_board_management_needs_the_admin_token(api, run, monkeypatch):
+    board_id = new_board_id()
+
+    async def test(admin):
+        async with client_for() as anonymous, client_for({"Authorization": "Bearer wrong"}) as impostor:
+            for client in (anonymous, impostor):
+                assert (await client.post("/api/boards", json={"board_id": board_id, "name": "Test"})).status_code == 401
+            assert (await admin.post("/api/boards", json={"board_id": board_id, "name": "Test"})).status_code == 201
+            for client in (anonymous, impostor):
+                assert (await client.delete(f"/api/boards/{board_id}")).status_code == 401
+            # Reads and submits stay open
+            assert (await anonymous.post(f"/api/boards/{board_id}/submit", json={"user_id": 1, "score": 1})).status_code == 200
+
+            monkeypatch.setattr(boards, "BOARD_ADMIN_TOKEN", "")
+            assert (await admin.delete(f"/api/boards/{board_id}")).status_code == 403
+            monkeypatch.setattr(boards, "BOARD_ADMIN_TOKEN", ADMIN_TOKEN)
+            assert (await admin.delete(f"/api/boards/{board_id}")).status_code == 204
+
+    run(api(test))
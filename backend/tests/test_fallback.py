@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import httpx
+import pytest
+from fakeredis import FakeServer, aioredis
+from fastapi import FastAPI
+from sqlalchemy import text
+
+from app import cache
+from app.database import engine
+from app.limits import rate_limiter
+from app.ranks import refresh_ranks
+from app.routers import leaderboard
+
+app = FastAPI()
+app.include_router(leaderboard.router)
+
+MODE = "fallback-test"
+# (user_id, session scores) in MODE today
+SESSIONS = {930001: (10, 25), 930002: (50,), 930003: (5, 5, 5)}
+
+
+@pytest.fixture
+def api(database, monkeypatch):
+    """Call `test(client)` against the leaderboard router with Redis unreachable."""
+    server = FakeServer()
+    server.connected = False
+    monkeypatch.setattr(cache, "_client", aioredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "_scripts", {})
+    monkeypatch.setattr(rate_limiter, "_script", None)
+
+    async def call(test):
+        now = datetime.utcnow()
+        async with engine.begin() as conn:
+            for uid, scores in SESSIONS.items():
+                await conn.execute(text("INSERT INTO users (id, username) VALUES (:uid, :name)"), {"uid": uid, "name": f"fallback-{uid}"})
+                for score in scores:
+                    await conn.execute(text(
+                        "INSERT INTO game_sessions (user_id, score, game_mode, timestamp) VALUES (:uid, :score, :mode, :now)"
+                    ), {"uid": uid, "score": score, "mode": MODE, "now": now})
+                await conn.execute(text("INSERT INTO leaderboard (user_id, total_score) VALUES (:uid, :total)"), {"uid": uid, "total": sum(scores)})
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test/api/leaderboard") as client:
+                return await test(client)
+        finally:
+            async with engine.begin() as conn:
+                for table, column in (("game_sessions", "user_id"), ("leaderboard", "user_id"), ("users", "id")):
+                    await conn.execute(text(f"DELETE FROM {table} WHERE {column} = ANY(:uids)"), {"uids": list(SESSIONS)})
+    return call
+
+
+@pytest.mark.parametrize("window", ["all", "day", "week", "season"])
+def test_mode_and_window_boards_fall_back_to_game_sessions(api, run, window):
+    params = {"mode": MODE, "window": window}
+
+    async def test(client):
+        response = await client.get("/top", params=params)
+        assert response.status_code == 200
+        assert [(row["user_id"], row["total_score"], row["rank"]) for row in response.json()["top_players"]] == [
+            (930002, 50, 1), (930001, 35, 2), (930003, 15, 3),
+        ]
+        response = await client.get("/top", params={**params, "offset": 1, "limit": 1})
+        assert [row["user_id"] for row in response.json()["top_players"]] == [930001]
+
+        response = await client.get("/rank/930001", params=params)
+        assert response.status_code == 200
+        assert response.json() == {"user_id": 930001, "rank": 2, "total_score": 35}
+        assert (await client.get("/rank/1", params=params)).status_code == 404
+
+        response = await client.get("/around/930003", params={**params, "radius": 1})
+        assert response.status_code == 200
+        assert [(row["rank"], row["user_id"]) for row in response.json()["players"]] == [(2, 930001), (3, 930003)]
+        assert (await client.get("/around/1", params=params)).status_code == 404
+
+    run(api(test))
+
+
+def test_stats_fall_back_to_postgres(api, run):
+    async def test(client):
+        # Publishing the histogram to Redis fails; the Postgres copy is still rebuilt
+        await refresh_ranks()
+        response = await client.get("/stats")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["players"] >= len(SESSIONS)
+        assert body["active_players"]["today"] >= len(SESSIONS)
+        assert body["active_players"]["last_7_days"] >= body["active_players"]["today"]
+
+    run(api(test))
@@ -0,0 +1,196 @@
+import asyncio
+import random
+
+import pytest
+
+from app import rank_engine
+from app.rank_engine import MAX_SCORE, EmbeddedScoreboard, RankEngine
+
+
+def ordered(scores):
+    """Reference order: score descending, ties by user_id descending (as ZREVRANGE orders members)."""
+    return sorted(scores.items(), key=lambda row: (row[1], row[0]), reverse=True)
+
+
+def collect(aiter):
+    async def run():
+        return [item async for item in aiter]
+    return asyncio.run(run())
+
+
+def test_set_incr_remove():
+    engine = RankEngine(user_capacity=4)
+    engine.set(3, 10)
+    engine.incr(3, 5)
+    engine.incr(7, 2)
+    assert engine.score(3) == 15
+    assert engine.score(7) == 2
+    assert engine.score(5) is None
+    assert len(engine) == 2
+
+    engine.remove(3)
+    engine.remove(3)
+    assert engine.score(3) is None
+    assert len(engine) == 1
+    assert engine.top(0, 10) == [(7, 2)]
+
+
+def test_add_gt_keeps_higher_score():
+    engine = RankEngine()
+    engine.set(1, 50)
+    engine.add_gt(1, 40)
+    engine.add_gt(2, 40)
+    engine.add_gt(2, 60)
+    assert engine.score(1) == 50
+    assert engine.score(2) == 60
+
+
+def test_ties_ordered_by_user_id_descending():
+    engine = RankEngine()
+    for uid in (4, 9, 1):
+        engine.set(uid, 100)
+    engine.set(5, 200)
+    assert engine.top(0, 3) == [(5, 200), (9, 100), (4, 100), (1, 100)]
+    assert [engine.position(uid) for uid in (5, 9, 4, 1)] == [0, 1, 2, 3]
+    assert engine.top(2, 2) == [(4, 100)]
+    assert engine.position(2) is None
+
+
+@pytest.mark.parametrize("block_size", [4, 1024])
+def test_matches_sorted_model(monkeypatch, block_size):
+    # Small blocks exercise splits and merges
+    monkeypatch.setattr(rank_engine, "BLOCK_SIZE", block_size)
+    rng = random.Random(7)
+    engine = RankEngine(user_capacity=1)
+    model = {}
+    for _ in range(3000):
+        uid = rng.randrange(500)
+        op = rng.random()
+        if op < 0.6:
+            delta = rng.randrange(1, 300)
+            engine.incr(uid, delta)
+            model[uid] = model.get(uid, 0) + delta
+        elif op < 0.85:
+            score = rng.randrange(5000)
+            engine.set(uid, score)
+            model[uid] = score
+        else:
+            engine.remove(uid)
+            model.pop(uid, None)
+
+    expected = ordered(model)
+    assert len(engine) == len(model)
+    assert engine.top(0, len(model)) == expected
+    assert engine.top(37, 81) == expected[37:82]
+    for position, (uid, _) in enumerate(expected):
+        assert engine.position(uid) == position
+    assert all(rank_engine.BLOCK_SIZE // 4 <= len(block) <= 2 * rank_engine.BLOCK_SIZE for block in engine.blocks[:-1])
+
+    for uid in list(model):
+        engine.remove(uid)
+    assert len(engine) == 0
+    assert engine.top(0, 10) == []
+    assert engine.blocks == []
+
+
+def test_large_scores_cost_no_extra_memory():
+    engine = RankEngine()
+    before = engine.memory_bytes()
+    engine.set(1, MAX_SCORE)
+    engine.set(2, 0)
+    engine.set(3, MAX_SCORE - 1)
+    assert engine.memory_bytes() - before < 1024
+    assert engine.top(0, 2) == [(1, MAX_SCORE), (3, MAX_SCORE - 1), (2, 0)]
+    with pytest.raises(ValueError):
+        engine.set(4, MAX_SCORE + 1)
+    with pytest.raises(ValueError):
+        engine.incr(1, 1)
+    assert engine.score(1) == MAX_SCORE
+
+
+def test_large_tie_group(monkeypatch):
+    monkeypatch.setattr(rank_engine, "BLOCK_SIZE", 16)
+    engine = RankEngine()
+    for uid in range(1, 2001):
+        engine.set(uid, 500)
+    engine.set(3000, 501)
+    assert engine.position(3000) == 0
+    assert engine.position(2000) == 1
+    assert engine.position(1) == 2000
+    assert engine.top(1000, 1002) == [(1001, 500), (1000, 500), (999, 500)]
+
+
+@pytest.mark.parametrize("user_id, score", [(-1, 10), (101, 10), (5, -1), (5, MAX_SCORE + 1)])
+def test_set_rejects_out_of_range(user_id, score):
+    engine = RankEngine(max_user_id=100)
+    with pytest.raises(ValueError):
+        engine.set(user_id, score)
+    assert len(engine) == 0
+    assert len(engine.scores) <= 101
+
+
+def test_user_array_capped_at_max_user_id():
+    engine = RankEngine(user_capacity=4, max_user_id=100)
+    engine.set(100, 1)
+    assert len(engine.scores) == 101
+    assert engine.top(0, 0) == [(100, 1)]
+
+
+def test_snapshot_roundtrip(monkeypatch, tmp_path):
+    monkeypatch.setattr(rank_engine, "BLOCK_SIZE", 4)
+    engine = RankEngine()
+    for uid, score in ((1, 30), (2, 10), (3, 30), (900, 2500)):
+        engine.set(uid, score)
+    for uid in range(10, 40):
+        engine.set(uid, uid % 5)
+    path = str(tmp_path / "ranks.snapshot")
+    engine.write_snapshot(path)()
+
+    restored = RankEngine.read_snapshot(path)
+    assert len(restored) == 34
+    assert restored.top(0, 100) == engine.top(0, 100)
+    restored.incr(2, 25)
+    assert restored.position(2) == 1
+    assert restored.position(10) == engine.position(10)
+
+
+def test_read_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "ranks.snapshot"
+    path.write_bytes(b"not a snapshot" * 4)
+    with pytest.raises(ValueError):
+        RankEngine.read_snapshot(str(path))
+
+
+def test_compare_and_set():
+    board = EmbeddedScoreboard(snapshot_path="")
+    asyncio.run(board.add_many({1: 10, 2: 20}))
+
+    changed = asyncio.run(board.compare_and_set({
+        1: (10, 15),       # matches: set
+        2: (19, 30),       # moved since it was read: skipped
+        3: (None, 7),      # absent as expected: added
+    }))
+    assert changed == 2
+    assert asyncio.run(board.scores([1, 2, 3])) == [15, 20, 7]
+
+    # Removal only when the score still matches
+    assert asyncio.run(board.compare_and_set({3: (8, None)})) == 0
+    assert asyncio.run(board.compare_and_set({3: (7, None)})) == 1
+    assert asyncio.run(board.scores([3])) == [None]
+    assert asyncio.run(board.ranks([2, 1, 3])) == [(1, 20), (2, 15), None]
+
+
+def test_scan_covers_every_member():
+    board = EmbeddedScoreboard(snapshot_path="")
+    scores = {uid: uid % 7 for uid in range(1, 50)}
+    asyncio.run(board.add_many(scores))
+    chunks = collect(board.scan(10))
+    assert all(chunks)
+    assert dict(row for chunk in chunks for row in chunk) == scores
+
+
+def test_around():
+    board = EmbeddedScoreboard(snapshot_path="")
+    asyncio.run(board.add_many({uid: uid * 10 for uid in range(1, 11)}))
+    assert asyncio.run(board.around(9, 1)) == [(1, 10, 100), (2, 9, 90), (3, 8, 80)]
+    assert asyncio.run(board.around(42, 1)) is None
@@ -0,0 +1,46 @@
+from sqlalchemy import text
+
+from app.database import engine
+from app.ranks import fetch_db_ranks, refresh_ranks
+
+# Above any score the other tests submit, so these users hold the top ranks
+BASE = 2_000_000_000
+USERS = {920001: BASE + 500, 920002: BASE + 100, 920003: BASE + 900}
+
+
+async def add(conn, uid):
+    await conn.execute(text("INSERT INTO users (id, username) VALUES (:uid, :name)"), {"uid": uid, "name": f"ranks-{uid}"})
+    await conn.execute(text("INSERT INTO leaderboard (user_id, total_score) VALUES (:uid, :score)"), {"uid": uid, "score": USERS[uid]})
+
+
+def test_fallback_ranks_from_the_histogram_are_marked_approximate(database, redis, run):
+    first, second, late = USERS
+
+    async def test():
+        async with engine.begin() as conn:
+            await add(conn, first)
+            await add(conn, second)
+        try:
+            assert await refresh_ranks()
+            async with engine.connect() as conn:
+                assert await fetch_db_ranks(conn, [first, second]) == ({first: (1, USERS[first]), second: (2, USERS[second])}, True)
+
+            # A higher bucket filled after the refresh is not counted until the next one
+            async with engine.begin() as conn:
+                await add(conn, late)
+            async with engine.connect() as conn:
+                assert await fetch_db_ranks(conn, [second]) == ({second: (2, USERS[second])}, True)
+
+            # Without a histogram the rank is the exact count
+            async with engine.begin() as conn:
+                await conn.execute(text("DELETE FROM leaderboard_score_buckets"))
+            async with engine.connect() as conn:
+                assert await fetch_db_ranks(conn, [second]) == ({second: (3, USERS[second])}, False)
+                assert await fetch_db_ranks(conn, [1]) == ({}, False)
+        finally:
+            async with engine.begin() as conn:
+                for table, column in (("leaderboard", "user_id"), ("users", "id")):
+                    await conn.execute(text(f"DELETE FROM {table} WHERE {column} = ANY(:uids)"), {"uids": list(USERS)})
+            await refresh_ranks()
+
+    run(test())
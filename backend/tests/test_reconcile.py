@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fakeredis import aioredis
+
+from app import reconcile
+from app.rank_engine import EmbeddedScoreboard
+from app.scoreboard import SingleKeyScoreboard
+
+
+class Leaderboard:
+    """Stands in for the database engine: answers SCORES_SQL from {user_id: total_score}."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def connect(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params):
+        assert statement is reconcile.SCORES_SQL
+        return [SimpleNamespace(user_id=uid, total_score=self.rows[uid]) for uid in params["uids"] if uid in self.rows]
+
+
+@pytest.fixture
+def board(monkeypatch):
+    board = EmbeddedScoreboard(snapshot_path="")
+    monkeypatch.setattr(reconcile, "scoreboard", board)
+    monkeypatch.setattr(reconcile, "SUBMIT_MODE", "batched")
+    return board
+
+
+def use_leaderboard(monkeypatch, rows):
+    database = Leaderboard(rows)
+    monkeypatch.setattr(reconcile, "engine", database)
+    return database
+
+
+def test_repairs_missing_mismatched_and_extra_members(monkeypatch, board):
+    use_leaderboard(monkeypatch, {1: 10, 2: 20, 4: 40})
+    asyncio.run(board.add_many({2: 25, 3: 5, 4: 40}))
+    reconciler = reconcile.Reconciler(grace=0)
+
+    rows = [SimpleNamespace(user_id=uid, total_score=score) for uid, score in ((1, 10), (2, 20), (4, 40))]
+    assert asyncio.run(reconciler.reconcile_chunk(rows)) == 2
+    assert asyncio.run(reconciler.reconcile_members([(2, 20), (3, 5), (4, 40)])) == 1
+    assert asyncio.run(board.scores([1, 2, 3, 4])) == [10, 20, None, 40]
+
+
+def test_skips_users_that_moved_during_the_grace_period(monkeypatch, board):
+    database = use_leaderboard(monkeypatch, {1: 10, 2: 20})
+    asyncio.run(board.add_many({2: 25}))
+    reconciler = reconcile.Reconciler(grace=0)
+
+    # Postgres committed a new score after the suspect was read
+    database.rows[1] = 12
+    assert asyncio.run(reconciler.repair({1: (10, None)})) == 0
+    # Redis was incremented after the suspect was read
+    assert asyncio.run(reconciler.repair({2: (20, 24)})) == 0
+    assert asyncio.run(board.scores([1, 2])) == [None, 25]
+
+
+def test_skips_while_write_behind_is_draining(monkeypatch, board):
+    use_leaderboard(monkeypatch, {1: 10})
+    monkeypatch.setattr(reconcile, "SUBMIT_MODE", "write_behind")
+
+    async def stream_stats():
+        return {"lag": 3, "pending": 0}
+
+    monkeypatch.setattr(reconcile, "stream_stats", stream_stats)
+    assert asyncio.run(reconcile.Reconciler(grace=0).repair({1: (10, None)})) == 0
+    assert asyncio.run(board.scores([1])) == [None]
+
+
+def test_compare_and_set_script():
+    """COMPARE_AND_SET_LUA as SingleKeyScoreboard runs it, including an absent member (ZSCORE -> false)."""
+    async def run():
+        board = SingleKeyScoreboard(aioredis.FakeRedis(decode_responses=True))
+        await board.add_many({1: 10, 2: 20})
+        changed = await board.compare_and_set({
+            1: (10, 15),     # matches: set
+            2: (19, 30),     # moved: skipped
+            3: (None, 7),    # absent as expected: added
+            4: (5, 9),       # expected a score but absent: skipped
+        })
+        assert changed == 2
+        assert await board.scores([1, 2, 3, 4]) == [15, 20, 7, None]
+        assert await board.compare_and_set({3: (8, None)}) == 0
+        assert await board.compare_and_set({3: (7, None)}) == 1
+        assert await board.scores([3]) == [None]
+
+    asyncio.run(run())
+
+
+def test_repairs_through_the_redis_board(monkeypatch):
+    board = SingleKeyScoreboard(aioredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(reconcile, "scoreboard", board)
+    monkeypatch.setattr(reconcile, "SUBMIT_MODE", "batched")
+    use_leaderboard(monkeypatch, {1: 10, 2: 20})
+
+    async def run():
+        await board.add_many({2: 25, 3: 5})
+        reconciler = reconcile.Reconciler(grace=0)
+        rows = [SimpleNamespace(user_id=1, total_score=10), SimpleNamespace(user_id=2, total_score=20)]
+        assert await reconciler.reconcile_chunk(rows) == 2
+        members = [row async for chunk in board.scan(10) for row in chunk]
+        assert await reconciler.reconcile_members(members) == 1
+        assert await board.scores([1, 2, 3]) == [10, 20, None]
+
+    asyncio.run(run())
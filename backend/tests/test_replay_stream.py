@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+import replay_stream
+from app.database import engine
+from app.write_behind import STREAM_KEY
+
+USERS = (910001, 910002)
+UNKNOWN_USER = 910003
+
+
+async def leaderboard():
+    async with engine.connect() as conn:
+        rows = await conn.execute(text("SELECT user_id, total_score FROM leaderboard WHERE user_id = ANY(:uids)"), {"uids": list(USERS)})
+        return dict(rows.all())
+
+
+def test_replay_skips_refused_entries(database, redis, run):
+    async def test():
+        async with engine.begin() as conn:
+            await conn.execute(text("INSERT INTO users (id, username) VALUES (:a, 'replay-a'), (:b, 'replay-b')"), {"a": USERS[0], "b": USERS[1]})
+        ts = datetime.utcnow().isoformat()
+        for i, uid in enumerate((USERS[0], UNKNOWN_USER, USERS[1], USERS[0])):
+            await redis.xadd(STREAM_KEY, {"sid": f"replay-{i}", "uid": uid, "score": 10 + i, "mode": "default", "ts": ts})
+        try:
+            # The refused entry is in the first chunk; everything around it is still persisted
+            replayed, skipped = await replay_stream.replay(redis, chunk=3)
+            assert replayed == 3
+            assert [entry_id for entry_id, _ in skipped] == [(await redis.xrange(STREAM_KEY))[1][0]]
+            assert await leaderboard() == {USERS[0]: 10 + 13, USERS[1]: 12}
+
+            # Replaying again is a no-op for the persisted entries
+            replayed, skipped = await replay_stream.replay(redis)
+            assert len(skipped) == 1
+            assert await leaderboard() == {USERS[0]: 23, USERS[1]: 12}
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(text("DELETE FROM game_session_submissions WHERE submission_id LIKE 'replay-%'"))
+                for table, column in (("game_sessions", "user_id"), ("leaderboard", "user_id"), ("users", "id")):
+                    await conn.execute(text(f"DELETE FROM {table} WHERE {column} = ANY(:uids)"), {"uids": list(USERS)})
+
+    run(test())
@@ -1,7 +1,9 @@
 import axios from 'axios';
 
+const API_BASE = 'http://localhost:8000/api/leaderboard';
+
 const api = axios.create({
-    baseURL: 'http://localhost:8000/api/leaderboard',
+    baseURL: API_BASE,
     timeout: 5000,
 });
 
@@ -27,6 +29,42 @@ export const fetchLeaderboard = async (): Promise<LeaderboardEntry[]> => {
     }
 };
 
+interface LeaderboardDiff {
+    changed: LeaderboardEntry[];
+    removed: number[];
+}
+
+/**
+ * Subscribe to the live top 10 pushed over server-sent events. `onUpdate` gets the
+ * full list, sorted by rank, after the initial snapshot and after every diff.
+ * `onError` fires when the connection drops (the browser reconnects on its own).
+ * Returns a function that closes the stream.
+ */
+export const subscribeLeaderboard = (
+    onUpdate: (players: LeaderboardEntry[]) => void,
+    onError?: () => void,
+): (() => void) => {
+    const source = new EventSource(`${API_BASE}/stream`);
+    let players = new Map<number, LeaderboardEntry>();
+
+    const emit = () => onUpdate([...players.values()].sort((a, b) => a.rank - b.rank));
+
+    source.addEventListener('snapshot', (event) => {
+        const data = JSON.parse((event as MessageEvent).data) as { top_players: LeaderboardEntry[] };
+        players = new Map(data.top_players.map((player) => [player.user_id, player]));
+        emit();
+    });
+    source.addEventListener('diff', (event) => {
+        const diff = JSON.parse((event as MessageEvent).data) as LeaderboardDiff;
+        diff.removed.forEach((userId) => players.delete(userId));
+        diff.changed.forEach((player) => players.set(player.user_id, player));
+        emit();
+    });
+    source.onerror = () => onError?.();
+
+    return () => source.close();
+};
+
 export const fetchUserRank = async (userId: number): Promise<UserRank> => {
     try {
         const response = await api.get<UserRank>(`/rank/${userId}`);
@@ -1,11 +1,13 @@
 import { useEffect, useState } from 'react';
-import { fetchLeaderboard, type LeaderboardEntry } from '../api/leaderboard';
+import { fetchLeaderboard, subscribeLeaderboard, type LeaderboardEntry } from '../api/leaderboard';
 
 const LeaderboardTable = () => {
     const [players, setPlayers] = useState<LeaderboardEntry[]>([]);
     const [loading, setLoading] = useState(true);
 
     useEffect(() => {
+        let interval: ReturnType<typeof setInterval> | undefined;
+
         const loadData = async () => {
             try {
                 const data = await fetchLeaderboard();
@@ -17,11 +19,24 @@ const LeaderboardTable = () => {
             }
         };
 
-        // Poll every 3 seconds for live updates
-        const interval = setInterval(loadData, 3000);
+        // Live updates are pushed by the server; poll every 3 seconds only while the stream is down
+        const unsubscribe = subscribeLeaderboard(
+            (data) => {
+                clearInterval(interval);
+                interval = undefined;
+                setPlayers(data);
+                setLoading(false);
+            },
+            () => {
+                interval ??= setInterval(loadData, 3000);
+            },
+        );
         loadData();
 
-        return () => clearInterval(interval);
+        return () => {
+            unsubscribe();
+            clearInterval(interval);
+        };
     }, []);
 
     const getRankBadge = (rank: number) => {
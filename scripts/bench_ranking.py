@@ -0,0 +1,165 @@
+"""
+Embedded vs Redis ranking backend benchmark.
+
+Loads the same synthetic scores into the in-process RankEngine
+(RANKING_BACKEND=embedded) and into the Redis sorted set
+(RANKING_BACKEND=redis), then measures top-10, rank, around and increment
+through the scoreboard interface with concurrent clients. Also reports
+memory per user against a plain dict and the sorted set, and snapshot
+write/restore times.
+
+By default it starts its own redis-server (requires `redis-server` on PATH):
+
+    python scripts/bench_ranking.py --users 1000000
+
+Or point it at a running instance, or skip Redis entirely:
+
+    python scripts/bench_ranking.py --redis-url redis://localhost:6379/15
+    python scripts/bench_ranking.py --skip-redis
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from redis import asyncio as redis  # noqa: E402
+
+from app.rank_engine import EmbeddedScoreboard, RankEngine  # noqa: E402
+from app.scoreboard import SingleKeyScoreboard  # noqa: E402
+from latency import LatencyHistogram  # noqa: E402
+
+BENCH_KEY = "bench:leaderboard_scores"
+
+
+def start_redis_server(port):
+    if not shutil.which("redis-server"):
+        sys.exit("redis-server not found on PATH; pass --redis-url or --skip-redis instead")
+    proc = subprocess.Popen(
+        ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no", "--dir", tempfile.mkdtemp(prefix="bench-redis-")],
+        stdout=subprocess.DEVNULL,
+    )
+    time.sleep(0.5)
+    return proc, f"redis://localhost:{port}"
+
+
+def synthetic_scores(users):
+    rng = random.Random(42)
+    return {uid: rng.randint(10, 5000) for uid in range(1, users + 1)}
+
+
+def dict_bytes_per_user(scores):
+    """Memory of a plain {user_id: score} dict, the structure the engine replaces."""
+    tracemalloc.start()
+    copy = {uid: score + 0 for uid, score in scores.items()}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del copy
+    return size / len(scores)
+
+
+async def load(board, scores, chunk=20000):
+    items = list(scores.items())
+    started = time.perf_counter()
+    for start in range(0, len(items), chunk):
+        await board.add_many(dict(items[start:start + chunk]))
+    return time.perf_counter() - started
+
+
+async def measure(name, op, requests, concurrency):
+    histogram = LatencyHistogram()
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            await op()
+            histogram.record(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    row = histogram.summary()
+    print(f"  {name:<8} {requests / elapsed:>9.0f} req/s   p50 {row['p50_ms'] * 1000:8.1f}us"
+          f"   p99 {row['p99_ms'] * 1000:8.1f}us   max {row['max_ms'] * 1000:8.1f}us")
+
+
+async def run_ops(board, args):
+    users = args.users
+    await measure("top-10", lambda: board.top(0, 9), args.requests, args.concurrency)
+    await measure("rank", lambda: board.ranks([random.randint(1, users)]), args.requests, args.concurrency)
+    await measure("around", lambda: board.around(random.randint(1, users), 5), args.requests, args.concurrency)
+    await measure("incr", lambda: board.incr_many({random.randint(1, users): 10}), args.requests, args.concurrency)
+
+
+async def bench_embedded(args, scores):
+    board = EmbeddedScoreboard(snapshot_path="")
+    elapsed = await load(board, scores)
+    engine = board.engine
+    print(f"embedded: loaded {args.users} users in {elapsed:.1f}s, "
+          f"{engine.memory_bytes() / args.users:.1f} bytes/user (dict: {dict_bytes_per_user(scores):.1f})")
+    await run_ops(board, args)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-rank-"), "ranks.snapshot")
+    started = time.perf_counter()
+    write = engine.write_snapshot(path)
+    copied = time.perf_counter() - started
+    write()
+    written = time.perf_counter() - started
+    started = time.perf_counter()
+    RankEngine.read_snapshot(path)
+    print(f"  snapshot {os.path.getsize(path) / 1e6:.1f}MB: copy {copied * 1000:.0f}ms (event loop), "
+          f"write {written * 1000:.0f}ms, restore {(time.perf_counter() - started) * 1000:.0f}ms")
+    os.remove(path)
+
+
+async def bench_redis(args, scores, url):
+    client = redis.from_url(url, decode_responses=True)
+    board = SingleKeyScoreboard(client, key=BENCH_KEY)
+    try:
+        await client.delete(BENCH_KEY)
+        elapsed = await load(board, scores)
+        memory = await client.memory_usage(BENCH_KEY)
+        print(f"redis: loaded {args.users} users in {elapsed:.1f}s, {memory / args.users:.1f} bytes/user (sorted set)")
+        await run_ops(board, args)
+        await client.delete(BENCH_KEY)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedded ranking engine against the Redis sorted set")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=7101)
+    parser.add_argument("--redis-url", help="Use a running Redis instead of starting one")
+    parser.add_argument("--skip-redis", action="store_true", help="Only benchmark the embedded engine")
+    args = parser.parse_args()
+
+    scores = synthetic_scores(args.users)
+    asyncio.run(bench_embedded(args, scores))
+    if args.skip_redis:
+        return
+
+    proc = None
+    try:
+        url = args.redis_url
+        if not url:
+            proc, url = start_redis_server(args.port)
+        asyncio.run(bench_redis(args, scores, url))
+    finally:
+        if proc is not None:
+            proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Per-request CPU of response serialization for the hot read endpoints.
+
+Compares, for payloads shaped like /top, /rank, /around and /ranks built from
+Redis tuples:
+
+- model: the default FastAPI path for a route returning dicts with a
+  response_model (validate through the Pydantic model, jsonable_encoder,
+  JSONResponse with the standard json encoder), run with FastAPI's own
+  serialize_response;
+- json / orjson / msgpack: the app's fast path (app/encoding.py), which
+  encodes the dicts straight into a Response.
+
+No Redis or Postgres is needed:
+
+    python scripts/bench_serialization.py --iterations 20000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from fastapi import utils as fastapi_utils  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+
+from app import encoding  # noqa: E402
+from app.schemas import AroundResponse, LeaderboardResponse, RankBatchResponse, UserRank  # noqa: E402
+
+# Renamed in newer FastAPI releases
+create_field = getattr(fastapi_utils, "create_model_field", None) or fastapi_utils.create_response_field
+
+
+def payloads(rng):
+    def rows(count):
+        return sorted(((rng.randint(1, 10_000_000), rng.randint(10, 500_000)) for _ in range(count)), key=lambda r: -r[1])
+
+    def top(count):
+        page = rows(count)
+        return {
+            "top_players": [{"user_id": uid, "total_score": score, "rank": i + 1} for i, (uid, score) in enumerate(page)],
+            "next_cursor": f"{count}:{page[-1][1]}:{page[-1][0]}",
+        }
+
+    around = rows(11)
+    ranks = rows(100)
+    return {
+        "top-10": (LeaderboardResponse, top(10)),
+        "top-100": (LeaderboardResponse, top(100)),
+        "top-1000": (LeaderboardResponse, top(1000)),
+        "rank": (UserRank, {"user_id": 42, "rank": 48210, "total_score": 1200}),
+        "around-5": (AroundResponse, {
+            "user_id": around[5][0],
+            "players": [{"user_id": uid, "total_score": score, "rank": 100 + i} for i, (uid, score) in enumerate(around)],
+        }),
+        "ranks-100": (RankBatchResponse, {
+            "ranks": [{"user_id": uid, "rank": 1000 + i, "total_score": score} for i, (uid, score) in enumerate(ranks)],
+            "missing": [],
+        }),
+    }
+
+
+def model_path(model):
+    field = create_field(name="Response", type_=model)
+
+    async def serialize(payload):
+        content = await serialize_response(field=field, response_content=payload, is_coroutine=True)
+        return JSONResponse(content=content).body
+
+    return serialize
+
+
+def fast_path(media_type):
+    async def serialize(payload):
+        return encoding.encoded_response(payload, media_type).body
+
+    return serialize
+
+
+async def measure(serialize, payload, iterations):
+    """CPU microseconds per response, and the response size."""
+    body = await serialize(payload)
+    start = time.process_time()
+    for _ in range(iterations):
+        await serialize(payload)
+    return (time.process_time() - start) / iterations * 1e6, len(body)
+
+
+async def run(args):
+    paths = {"json (std)": None, "orjson": None, "msgpack": None}
+    print(f"orjson: {'yes' if encoding.orjson else 'no (std json)'}   msgpack: {'yes' if encoding.msgpack else 'no'}")
+    print(f"{'payload':<10} {'path':<11} {'us/req':>9} {'bytes':>7} {'speedup':>8}")
+    for name, (model, payload) in payloads(random.Random(42)).items():
+        iterations = max(100, args.iterations // (10 if name == "top-1000" else 1))
+        base, size = await measure(model_path(model), payload, iterations)
+        print(f"{name:<10} {'model':<11} {base:>9.1f} {size:>7}")
+
+        orjson = encoding.orjson
+        encoding.orjson = None
+        paths["json (std)"] = await measure(fast_path(encoding.JSON_MEDIA_TYPE), payload, iterations)
+        encoding.orjson = orjson
+        paths["orjson"] = await measure(fast_path(encoding.JSON_MEDIA_TYPE), payload, iterations) if orjson else None
+        paths["msgpack"] = await measure(fast_path(encoding.MSGPACK_MEDIA_TYPE), payload, iterations) if encoding.msgpack else None
+        for path, result in paths.items():
+            if result is not None:
+                cost, size = result
+                print(f"{'':<10} {path:<11} {cost:>9.1f} {size:>7} {base / cost:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure response serialization CPU per request")
+    parser.add_argument("--iterations", type=int, default=20_000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
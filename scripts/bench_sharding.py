@@ -0,0 +1,131 @@
+"""
+Single-key vs sharded leaderboard benchmark.
+
+Loads the same synthetic scores into one sorted set (the layout behind
+get_top_users/get_user_rank) and into N sharded sorted sets, then measures
+top-10 and rank lookups against both with concurrent clients.
+
+By default it starts its own redis-server processes on consecutive ports
+(requires `redis-server` on PATH):
+
+    python scripts/bench_sharding.py --users 1000000 --shards 4
+
+Or point it at running instances:
+
+    python scripts/bench_sharding.py --single redis://localhost:6379 \
+        --shard-urls redis://localhost:7001,redis://localhost:7002
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from redis import asyncio as redis  # noqa: E402
+
+from app.scoreboard import ShardedScoreboard, SingleKeyScoreboard  # noqa: E402
+
+BENCH_KEY = "bench:leaderboard_scores"
+
+
+def start_redis_servers(base_port, count):
+    if not shutil.which("redis-server"):
+        sys.exit("redis-server not found on PATH; pass --single/--shard-urls instead")
+    workdir = tempfile.mkdtemp(prefix="bench-redis-")
+    procs = []
+    for port in range(base_port, base_port + count):
+        procs.append(subprocess.Popen(
+            ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no", "--dir", workdir],
+            stdout=subprocess.DEVNULL,
+        ))
+    time.sleep(0.5)
+    return procs, [f"redis://localhost:{port}" for port in range(base_port, base_port + count)]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+
+
+async def load(board, users, chunk=20000):
+    rng = random.Random(42)
+    for start in range(1, users + 1, chunk):
+        await board.add_many({uid: rng.randint(10, 5000) for uid in range(start, min(start + chunk, users + 1))})
+
+
+async def measure(name, op, requests, concurrency):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            await op()
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<10} {requests / elapsed:>9.0f} req/s   p50 {percentile(latencies, 50):6.2f}ms"
+          f"   p99 {percentile(latencies, 99):6.2f}ms")
+
+
+async def run(args, single_url, shard_urls):
+    single_client = redis.from_url(single_url, decode_responses=True)
+    layouts = [
+        ("single-key", SingleKeyScoreboard(single_client, key=BENCH_KEY)),
+        (f"{len(shard_urls)} shards", ShardedScoreboard(shard_urls, key=BENCH_KEY)),
+    ]
+    try:
+        for name, board in layouts:
+            await board.start()
+            clients = board.shards if board.sharded else [single_client]
+            await asyncio.gather(*[client.delete(BENCH_KEY) for client in clients])
+
+            started = time.perf_counter()
+            await load(board, args.users)
+            print(f"{name}: loaded {args.users} users in {time.perf_counter() - started:.1f}s")
+
+            await measure("top-10", lambda: board.top(0, 9), args.requests, args.concurrency)
+            await measure("rank", lambda: board.ranks([random.randint(1, args.users)]), args.requests, args.concurrency)
+            await measure("incr", lambda: board.incr_many({random.randint(1, args.users): 10}), args.requests, args.concurrency)
+
+            await asyncio.gather(*[client.delete(BENCH_KEY) for client in clients])
+            await board.close()
+    finally:
+        await single_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single-key vs sharded leaderboard layouts")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--base-port", type=int, default=7001)
+    parser.add_argument("--single", help="Redis URL for the single-key layout")
+    parser.add_argument("--shard-urls", help="Comma-separated Redis URLs for the sharded layout")
+    args = parser.parse_args()
+
+    procs = []
+    try:
+        if args.single and args.shard_urls:
+            single_url, shard_urls = args.single, args.shard_urls.split(",")
+        else:
+            procs, urls = start_redis_servers(args.base_port, args.shards + 1)
+            single_url, shard_urls = urls[0], urls[1:]
+        asyncio.run(run(args, single_url, shard_urls))
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
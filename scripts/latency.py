@@ -0,0 +1,56 @@
+"""Log-linear latency histogram shared by the load generator and benchmarks."""
+
+# 2^7 sub-buckets per power of two keeps every recorded value within ~1% (HdrHistogram-style)
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_MASK = (1 << SUB_BUCKET_BITS) - 1
+
+
+class LatencyHistogram:
+    """Constant-memory latency recorder with percentile queries, in microsecond resolution."""
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max_us = 0
+
+    def record(self, seconds):
+        us = max(1, int(seconds * 1_000_000))
+        exponent = max(0, us.bit_length() - SUB_BUCKET_BITS)
+        index = (exponent << SUB_BUCKET_BITS) | (us >> exponent)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.max_us = max(self.max_us, us)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.max_us = max(self.max_us, other.max_us)
+
+    @staticmethod
+    def _value(index):
+        exponent = index >> SUB_BUCKET_BITS
+        # Midpoint of the bucket's range
+        return ((index & SUB_BUCKET_MASK) << exponent) + ((1 << exponent) >> 1)
+
+    def percentile(self, pct):
+        """Latency in milliseconds at the given percentile (0-100)."""
+        if not self.total:
+            return 0.0
+        threshold = self.total * pct / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(self._value(index), self.max_us) / 1000
+        return self.max_us / 1000
+
+    def summary(self):
+        return {
+            "count": self.total,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "p999_ms": self.percentile(99.9),
+            "max_ms": self.max_us / 1000,
+        }
@@ -1,65 +1,216 @@
-import requests
+"""
+Open-loop load generator for the leaderboard API.
+
+Requests are started on a Poisson arrival schedule at --rate per second,
+independent of how fast earlier requests complete, so server slowdowns show
+up as latency instead of silently lowering the offered load. User ids follow
+a Zipf distribution (a few hot players, a long tail). After a --warmup phase
+whose results are discarded, latency percentiles and throughput are reported
+per endpoint.
+
+Usage:
+    pip install httpx
+    python scripts/simulate.py --rate 2000 --duration 60 --warmup 10 \
+        --mix submit=0.2,top=0.5,rank=0.25,around=0.05 --zipf 1.1
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
 import random
 import time
-import threading
-import sys
+import uuid
+from bisect import bisect_left
+
+import httpx
+
+from latency import LatencyHistogram
 
 API_BASE_URL = "http://localhost:8000/api/leaderboard"
 
-def submit_score():
-    try:
-        user_id = random.randint(1, 1000000)
-        score = random.randint(10, 1000)
-        payload = {
-            "user_id": user_id,
-            "score": score,
-            "game_mode": "survival"
-        }
-        response = requests.post(f"{API_BASE_URL}/submit", json=payload)
-        # print(f"Submitted score for user {user_id}: {response.status_code}")
-    except Exception as e:
-        print(f"Error submitting score: {e}")
-
-def get_top_players():
-    try:
-        response = requests.get(f"{API_BASE_URL}/top")
-        # print(f"Top players: {response.status_code}")
-    except Exception as e:
-        print(f"Error getting top players: {e}")
-
-def get_user_rank():
-    try:
-        user_id = random.randint(1, 1000000)
-        response = requests.get(f"{API_BASE_URL}/rank/{user_id}")
-        # print(f"Rank for user {user_id}: {response.status_code}")
-    except Exception as e:
-        print(f"Error getting rank: {e}")
-
-def worker():
-    while True:
-        action = random.choice(['submit', 'top', 'rank'])
-        if action == 'submit':
-            submit_score()
-        elif action == 'top':
-            get_top_players()
-        elif action == 'rank':
-            get_user_rank()
-        time.sleep(random.uniform(0.1, 0.5))
-
-def run_simulation(num_threads=10):
-    print(f"Starting simulation with {num_threads} threads...")
-    threads = []
-    for _ in range(num_threads):
-        t = threading.Thread(target=worker)
-        t.daemon = True
-        t.start()
-        threads.append(t)
-    
-    try:
+# Spreads Zipf ranks over the id space so hot users are not simply ids 1..k
+ID_SCRAMBLE_PRIME = 1_000_003
+
+
+class ZipfUsers:
+    """Samples user ids 1..n with P(rank k) proportional to 1 / k^s."""
+
+    def __init__(self, n, s, rng):
+        self.n = n
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(1.0 / k ** s for k in range(1, n + 1)))
+        self.total = self.cum_weights[-1]
+
+    def sample(self):
+        rank = bisect_left(self.cum_weights, self.rng.random() * self.total)
+        return (rank * ID_SCRAMBLE_PRIME) % self.n + 1
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def submit_request(users, rng):
+    payload = {"user_id": users.sample(), "score": rng.randint(10, 1000), "game_mode": rng.choice(["solo", "team"])}
+    return "POST", "/submit", payload
+
+
+class IdempotentSubmits:
+    """Submits carrying a submission_id, re-sending a recent one at `retry_rate` like a client retrying on timeout."""
+
+    def __init__(self, retry_rate, history=1000):
+        self.retry_rate = retry_rate
+        self.recent = []
+        self.history = history
+
+    def __call__(self, users, rng):
+        if self.recent and rng.random() < self.retry_rate:
+            return "POST", "/submit", rng.choice(self.recent)
+        method, path, payload = submit_request(users, rng)
+        payload["submission_id"] = uuid.uuid4().hex
+        self.recent.append(payload)
+        if len(self.recent) > self.history:
+            self.recent.pop(0)
+        return method, path, payload
+
+
+def top_request(users, rng):
+    return "GET", "/top", None
+
+
+def rank_request(users, rng):
+    return "GET", f"/rank/{users.sample()}", None
+
+
+def around_request(users, rng):
+    return "GET", f"/around/{users.sample()}?radius=5", None
+
+
+def ranks_request(users, rng):
+    return "POST", "/ranks", {"user_ids": [users.sample() for _ in range(100)]}
+
+
+ENDPOINTS = {
+    "submit": submit_request,
+    "top": top_request,
+    "rank": rank_request,
+    "around": around_request,
+    "ranks": ranks_request,
+}
+
+
+class Stats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses = {}
+
+    def record(self, seconds, status):
+        self.latency.record(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    users = ZipfUsers(args.users, args.zipf, rng)
+    if args.submission_ids:
+        # Compare against a run without the flag to measure the dedup overhead
+        ENDPOINTS["submit"] = IdempotentSubmits(args.retry_rate)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+
+    stats = {name: Stats() for name in names}
+    measuring = False
+    dropped = 0
+    inflight = set()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        async def fire(name):
+            method, path, payload = ENDPOINTS[name](users, rng)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=payload)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = "error"
+            if measuring:
+                stats[name].record(time.perf_counter() - start, status)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        measure_from = started + args.warmup
+        end = measure_from + args.duration
+        next_arrival = started
+        print(f"Offering {args.rate} req/s for {args.warmup}s warm-up + {args.duration}s measurement...")
+
         while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("Stopping simulation...")
+            now = loop.time()
+            if now >= end:
+                break
+            if not measuring and now >= measure_from:
+                measuring = True
+            if next_arrival > now:
+                await asyncio.sleep(next_arrival - now)
+            # Open loop: the schedule advances regardless of completions
+            next_arrival += rng.expovariate(args.rate)
+            if len(inflight) >= args.max_inflight:
+                dropped += measuring
+                continue
+            task = asyncio.create_task(fire(rng.choices(names, weights)[0]))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+
+        if inflight:
+            await asyncio.wait(inflight, timeout=args.timeout)
+
+    report(stats, args.duration, dropped, args.json)
+
+
+def report(stats, duration, dropped, as_json):
+    total = LatencyHistogram()
+    for s in stats.values():
+        total.merge(s.latency)
+    rows = {name: {**s.latency.summary(), "rps": s.latency.total / duration, "statuses": s.statuses} for name, s in stats.items()}
+    rows["all"] = {**total.summary(), "rps": total.total / duration}
+
+    if as_json:
+        print(json.dumps({"endpoints": rows, "dropped": dropped}, indent=2, default=str))
+        return
+    print(f"\n{'endpoint':<8} {'count':>8} {'rps':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8} {'max':>8}  statuses")
+    for name, row in rows.items():
+        print(f"{name:<8} {row['count']:>8} {row['rps']:>9.1f} {row['p50_ms']:>7.2f}m {row['p90_ms']:>7.2f}m "
+              f"{row['p99_ms']:>7.2f}m {row['p999_ms']:>7.2f}m {row['max_ms']:>7.2f}m  {row.get('statuses', '')}")
+    if dropped:
+        print(f"\n⚠️  {dropped} arrivals dropped at --max-inflight; the server could not keep up with the offered rate")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the leaderboard API")
+    parser.add_argument("--url", default=API_BASE_URL)
+    parser.add_argument("--rate", type=float, default=500, help="Offered requests per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of load before measuring")
+    parser.add_argument("--mix", default="submit=0.3,top=0.4,rank=0.3", help="Endpoint weights: submit,top,rank,around,ranks")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent for user ids (0 = uniform)")
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--max-inflight", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--submission-ids", action="store_true", help="Send a submission_id with every submit")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="With --submission-ids, fraction of submits that re-send a recent id")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    asyncio.run(run(parser.parse_args()))
+
 
 if __name__ == "__main__":
-    run_simulation()
+    main()